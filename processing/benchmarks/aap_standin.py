@@ -0,0 +1,450 @@
+"""Local stand-in for the AAP job endpoints.
+
+    python aap_standin.py serve --jobs 10000                       # synthetic jobs
+    python aap_standin.py serve --jobs 10000 --latency 0.05 --throttle-rate 0.02
+    python aap_standin.py record --upstream https://tower.example.com --out tower.ndjson.gz
+    python aap_standin.py serve --replay tower.ndjson.gz
+
+Serves `/api/v2/jobs/`, `/api/v2/jobs/<id>/` and `/api/v2/jobs/<id>/job_events/`
+the way the towers do: Django style filters (`created__gt`, `name__icontains`, `not__...`),
+`page`/`page_size` pagination with relative `next` links and a `count`, and a
+`max_page_size` cap. Latency, 500s and 429s can be injected.
+
+`record` runs as a proxy in front of a real tower and appends every response
+to an NDJSON file. `serve --replay` loads the jobs and job events found in
+such a file and serves them through the same filtering and pagination, so
+replayed traffic still works when the client changes its page size or its
+start time.
+
+Only the standard library is used so it runs anywhere the benchmarks do.
+"""
+
+import argparse
+import gzip
+import json
+import random
+import re
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+from synthetic import SyntheticAAP
+
+_JOBS_PATH = "/api/v2/jobs/"
+_JOB_PATH = re.compile(r"^/api/v2/jobs/(\d+)/$")
+_JOB_EVENTS_PATH = re.compile(r"^/api/v2/jobs/(\d+)/job_events/$")
+
+_DATETIME_FIELDS = {"created", "modified", "started", "finished"}
+
+# Query parameters that are not field filters
+_CONTROL_PARAMS = {"page", "page_size", "format", "order_by"}
+
+
+def _open_text(path, mode):
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + "t", encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
+
+
+def _parse_datetime(value):
+    parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed
+
+
+def _coerce(field, actual, value):
+    """Converts a query string value to the type of the stored field."""
+    if field in _DATETIME_FIELDS:
+        return _parse_datetime(value)
+    if isinstance(actual, bool):
+        return value.lower() == "true"
+    if isinstance(actual, int):
+        return int(value)
+    if isinstance(actual, float):
+        return float(value)
+    return value
+
+
+def _matches(record, key, value):
+    """Evaluates one `field__lookup=value` filter against a job or event."""
+    negate = key.startswith("not__")
+    if negate:
+        key = key[len("not__"):]
+    field, _, lookup = key.partition("__")
+    lookup = lookup or "exact"
+    actual = record.get(field)
+
+    if lookup == "isnull":
+        result = (actual is None) == (value.lower() == "true")
+    elif actual is None:
+        result = False
+    else:
+        if field in _DATETIME_FIELDS:
+            actual = _parse_datetime(actual)
+        if lookup == "icontains":
+            result = value.lower() in str(actual).lower()
+        elif lookup == "in":
+            result = actual in [_coerce(field, actual, v) for v in value.split(",")]
+        else:
+            expected = _coerce(field, actual, value)
+            if lookup == "exact":
+                result = actual == expected
+            elif lookup == "gt":
+                result = actual > expected
+            elif lookup == "gte":
+                result = actual >= expected
+            elif lookup == "lt":
+                result = actual < expected
+            elif lookup == "lte":
+                result = actual <= expected
+            else:
+                raise ValueError(f"Unsupported lookup: {lookup}")
+    return result != negate
+
+
+class AAPDataset:
+    """Jobs and job events served by the stand-in.
+
+    @Param: jobs - list - Raw `/api/v2/jobs/` results
+    @Param: job_events - dict - Job id to its raw job_events results
+    """
+
+    def __init__(self, jobs, job_events):
+        self.jobs = sorted(jobs, key=lambda job: job["id"])
+        self.job_events = job_events
+
+    @classmethod
+    def synthetic(cls, count, **kwargs):
+        generator = SyntheticAAP(**kwargs)
+        jobs = generator.jobs(count)
+        return cls(jobs, generator.job_events)
+
+    @classmethod
+    def from_recording(cls, path):
+        """Collects every job and job event found in a recording."""
+        jobs, job_events = {}, {}
+        with _open_text(path, "r") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                if entry["status"] != 200:
+                    continue
+                results = entry["body"].get("results", [])
+                path = urlsplit(entry["path"]).path
+                match = _JOB_EVENTS_PATH.match(path)
+                if match:
+                    events = job_events.setdefault(int(match.group(1)), {})
+                    for event in results:
+                        events[event["id"]] = event
+                elif path == _JOBS_PATH:
+                    for job in results:
+                        jobs[job["id"]] = job
+                elif _JOB_PATH.match(path):
+                    jobs[entry["body"]["id"]] = entry["body"]
+        return cls(
+            list(jobs.values()),
+            {job_id: list(events.values()) for job_id, events in job_events.items()},
+        )
+
+
+class _Faults:
+    """Decides the latency and failure of each request."""
+
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, throttle_rate=0.0, seed=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def draw(self):
+        """Returns (delay in seconds, status override or None)."""
+        with self._lock:
+            delay = self.latency + self._rng.uniform(0, self.jitter)
+            roll = self._rng.random()
+        if roll < self.throttle_rate:
+            return delay, 429
+        if roll < self.throttle_rate + self.error_rate:
+            return delay, 500
+        return delay, None
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server_version = "AAPStandIn/1.0"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, body, headers=None):
+        payload = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(payload)
+        self.server.count(status)
+
+    def do_GET(self):
+        delay, status = self.server.faults.draw()
+        if delay:
+            time.sleep(delay)
+        if status == 429:
+            self._send_json(
+                429,
+                {"detail": "Request was throttled. Expected available in 1 second."},
+                {"Retry-After": "1"},
+            )
+            return
+        if status == 500:
+            self._send_json(500, {"detail": "A server error occurred."})
+            return
+
+        url = urlsplit(self.path)
+        params = parse_qsl(url.query, keep_blank_values=True)
+        match = _JOB_EVENTS_PATH.match(url.path)
+        job_match = _JOB_PATH.match(url.path)
+        if job_match:
+            job_id = int(job_match.group(1))
+            for job in self.server.dataset.jobs:
+                if job["id"] == job_id:
+                    self._send_json(200, job)
+                    return
+            self._send_json(404, {"detail": "Not found."})
+            return
+        if url.path == _JOBS_PATH:
+            records = self.server.dataset.jobs
+        elif match:
+            records = self.server.dataset.job_events.get(int(match.group(1)), [])
+        else:
+            self._send_json(404, {"detail": "Not found."})
+            return
+
+        try:
+            self._send_json(200, self.server.page(url.path, params, records))
+        except ValueError as e:
+            self._send_json(400, {"detail": str(e)})
+
+
+class StandInAAP(ThreadingHTTPServer):
+    """Threaded HTTP stand-in for one tower, optionally run in the background.
+
+        with StandInAAP(AAPDataset.synthetic(1000), latency=0.01) as aap:
+            requests.get(f"{aap.url}/api/v2/jobs/?page_size=200")
+
+    @Param: dataset - AAPDataset - Jobs and job events to serve
+    @Param: host, port - Address to bind; port 0 picks a free port
+    @Param: latency - float - Seconds added to every response
+    @Param: jitter - float - Extra random delay of up to this many seconds
+    @Param: error_rate - float - Share of requests answered with a 500
+    @Param: throttle_rate - float - Share of requests answered with a 429
+    @Param: default_page_size, max_page_size - int - AAP pagination limits
+    """
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        dataset,
+        host="127.0.0.1",
+        port=0,
+        latency=0.0,
+        jitter=0.0,
+        error_rate=0.0,
+        throttle_rate=0.0,
+        default_page_size=25,
+        max_page_size=200,
+        seed=0,
+    ):
+        super().__init__((host, port), _Handler)
+        self.dataset = dataset
+        self.faults = _Faults(latency, jitter, error_rate, throttle_rate, seed)
+        self.default_page_size = default_page_size
+        self.max_page_size = max_page_size
+        self.stats = {}
+        self._stats_lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def count(self, status):
+        with self._stats_lock:
+            self.stats[status] = self.stats.get(status, 0) + 1
+
+    def page(self, path, params, records):
+        """Filters, orders and paginates `records` like the AAP API does."""
+        query = dict(params)
+        for key, value in params:
+            if key not in _CONTROL_PARAMS:
+                records = [r for r in records if _matches(r, key, value)]
+
+        order_by = query.get("order_by", "id")
+        if order_by.lstrip("-") != "id":
+            field = order_by.lstrip("-")
+            records = sorted(records, key=lambda r: (r.get(field) is None, r.get(field)))
+            if order_by.startswith("-"):
+                records.reverse()
+        elif order_by.startswith("-"):
+            records = records[::-1]
+
+        page = int(query.get("page", 1))
+        page_size = min(int(query.get("page_size", self.default_page_size)), self.max_page_size)
+        start = (page - 1) * page_size
+        if page < 1 or (start >= len(records) and page > 1):
+            raise ValueError("Invalid page.")
+
+        def link(number):
+            query["page"] = number
+            return f"{path}?{urlencode(query)}"
+
+        has_next = start + page_size < len(records)
+        return {
+            "count": len(records),
+            "next": link(page + 1) if has_next else None,
+            "previous": link(page - 1) if page > 1 else None,
+            "results": records[start:start + page_size],
+        }
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+        self.server_close()
+        self._thread.join()
+
+
+class _RecordingHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        request = urllib.request.Request(f"{self.server.upstream}{self.path}")
+        cookie = self.headers.get("Cookie") or self.server.cookie
+        if cookie:
+            request.add_header("Cookie", cookie)
+        try:
+            with urllib.request.urlopen(request, context=self.server.ssl_context) as response:
+                status, payload = response.status, response.read()
+        except urllib.error.HTTPError as e:
+            status, payload = e.code, e.read()
+
+        try:
+            body = json.loads(payload)
+        except ValueError:
+            body = None
+        self.server.record(self.path, status, body)
+
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+class RecordingProxy(ThreadingHTTPServer):
+    """Forwards requests to a real tower and appends each response to `out`."""
+
+    daemon_threads = True
+
+    def __init__(self, upstream, out, cookie=None, host="127.0.0.1", port=8052, verify=False):
+        import ssl
+
+        super().__init__((host, port), _RecordingHandler)
+        self.upstream = upstream.rstrip("/")
+        self.cookie = cookie
+        self.ssl_context = ssl.create_default_context()
+        if not verify:
+            self.ssl_context.check_hostname = False
+            self.ssl_context.verify_mode = ssl.CERT_NONE
+        self._out = _open_text(out, "a")
+        self._lock = threading.Lock()
+
+    def record(self, path, status, body):
+        line = json.dumps({"path": path, "status": status, "body": body})
+        with self._lock:
+            self._out.write(line + "\n")
+            self._out.flush()
+
+    def server_close(self):
+        super().server_close()
+        self._out.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Local AAP stand-in")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    serve = commands.add_parser("serve", help="Serve synthetic or replayed jobs")
+    serve.add_argument("--host", default="127.0.0.1")
+    serve.add_argument("--port", type=int, default=8052)
+    serve.add_argument("--replay", help="Recording written by the record command")
+    serve.add_argument("--jobs", type=int, default=10000, help="Synthetic jobs to serve")
+    serve.add_argument("--seed", type=int, default=0)
+    serve.add_argument("--extra-vars-bytes", type=int, default=4096)
+    serve.add_argument("--latency", type=float, default=0.0)
+    serve.add_argument("--jitter", type=float, default=0.0)
+    serve.add_argument("--error-rate", type=float, default=0.0)
+    serve.add_argument("--throttle-rate", type=float, default=0.0)
+    serve.add_argument("--max-page-size", type=int, default=200)
+
+    record = commands.add_parser("record", help="Proxy a real tower and record responses")
+    record.add_argument("--upstream", required=True, help="Tower base URL")
+    record.add_argument("--out", required=True, help="NDJSON file, .gz to compress")
+    record.add_argument("--cookie", help="Cookie sent when the client sends none")
+    record.add_argument("--host", default="127.0.0.1")
+    record.add_argument("--port", type=int, default=8052)
+    record.add_argument("--verify", action="store_true", help="Verify TLS certificates")
+
+    args = parser.parse_args(argv)
+
+    if args.command == "record":
+        server = RecordingProxy(
+            args.upstream, args.out, args.cookie, args.host, args.port, args.verify
+        )
+        print(f"Recording {args.upstream} into {args.out} on port {args.port}")
+    else:
+        if args.replay:
+            dataset = AAPDataset.from_recording(args.replay)
+        else:
+            dataset = AAPDataset.synthetic(
+                args.jobs, seed=args.seed, extra_vars_bytes=args.extra_vars_bytes
+            )
+        server = StandInAAP(
+            dataset,
+            args.host,
+            args.port,
+            latency=args.latency,
+            jitter=args.jitter,
+            error_rate=args.error_rate,
+            throttle_rate=args.throttle_rate,
+            max_page_size=args.max_page_size,
+            seed=args.seed,
+        )
+        print(f"Serving {len(dataset.jobs)} jobs on {server.url}")
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
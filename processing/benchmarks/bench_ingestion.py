@@ -0,0 +1,259 @@
+"""Microbenchmarks for the ingestion hot paths.
+
+    python bench_ingestion.py                          # 1k, 10k and 100k jobs
+    python bench_ingestion.py --sizes 1000 10000       # quicker run
+    python bench_ingestion.py --update-baseline        # store results as baseline
+    python bench_ingestion.py --check                  # exit 1 on regressions
+
+Every case runs against synthetic AAP payloads (see synthetic.py) with fresh
+inputs for each repetition. Wall time is the best of --repeat runs; peak
+memory is measured in a separate run under tracemalloc, so it only counts
+allocations made by the code under test.
+"""
+
+import argparse
+import gc
+import importlib.util
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+from contextlib import redirect_stdout
+
+from synthetic import SyntheticAAP
+
+_HERE = os.path.dirname(os.path.abspath(__file__))
+_PROCESSING = os.path.dirname(_HERE)
+_BASELINE = os.path.join(_HERE, "baseline.json")
+
+_INGESTION_MODULES = {
+    "v1": os.path.join(_PROCESSING, "ingestionV1", "rhel_upgrade_ingestion_v1.py"),
+    "v3": os.path.join(_PROCESSING, "ingestionV3", "main.py"),
+}
+
+
+def load_ingestion(version):
+    """Imports the V1 or V3 ingestion script as a module."""
+    spec = importlib.util.spec_from_file_location(
+        f"ingestion_{version}", _INGESTION_MODULES[version]
+    )
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def load_workflow_processor():
+    sys.path.insert(0, os.path.join(_PROCESSING, "ingestionV2"))
+    from workflow_processor import WorkflowProcessor
+
+    return WorkflowProcessor(config=None)
+
+
+def to_v2_jobs(raw_jobs, generator):
+    """Shapes raw jobs with the helpers ingestionV2's AAPClient applies to them."""
+    sys.path.insert(0, os.path.join(_PROCESSING, "ingestionV2"))
+    from aap_client import AAPClient
+
+    # Only the shaping helpers are used, which need no config or session
+    client = AAPClient.__new__(AAPClient)
+    jobs = []
+    for raw in raw_jobs:
+        job = client._filter_job_data(raw, generator.region)
+        if job["failed"]:
+            job["failed_tasks"] = [
+                client._filter_failed_task_data(event)
+                for event in generator.failed_events(raw["id"])
+                if event["event_level"] in [0, 3]
+            ]
+        jobs.append(job)
+    return jobs
+
+
+class Dataset:
+    """Synthetic jobs of one size, with cheap ways to get fresh copies."""
+
+    def __init__(self, size, seed=0, extra_vars_bytes=4096):
+        self.generator = SyntheticAAP(seed=seed, extra_vars_bytes=extra_vars_bytes)
+        self.raw_jobs = self.generator.jobs(size)
+        self.size = len(self.raw_jobs)
+        self._raw_json = json.dumps(self.raw_jobs)
+        self._events_json = {
+            job_id: json.dumps(events)
+            for job_id, events in self.generator.job_events.items()
+        }
+        self.v2_jobs = to_v2_jobs(self.raw_jobs, self.generator)
+
+    def fresh_jobs(self):
+        return json.loads(self._raw_json)
+
+    def failed_tasks(self, playbook, region, auth):
+        """Stand-in for get_failed_tasks that decodes a stored response."""
+        if not playbook["failed"]:
+            return []
+        events = json.loads(self._events_json.get(playbook["id"], "[]"))
+        return [e for e in events if e["event_level"] in [0, 3]]
+
+
+def build_cases(ingestion, processor):
+    """Returns {name: (setup, run)}; setup(dataset) builds untimed inputs."""
+
+    def generated(dataset):
+        jobs = dataset.fresh_jobs()
+        return ingestion.generate_workflows(jobs, "amrs", {}, set()), jobs
+
+    def setup_generate(dataset):
+        return (dataset.fresh_jobs(),)
+
+    def run_generate(jobs):
+        ingestion.generate_workflows(jobs, "amrs", {}, set())
+
+    def setup_validate(dataset):
+        groups, jobs = generated(dataset)
+        return groups, jobs[-1]["finished"]
+
+    def run_validate(groups, latest_job):
+        ingestion.validate_workflows(groups, "amrs", latest_job)
+
+    def setup_format(dataset):
+        groups, _ = generated(dataset)
+        return ([{"jobs": jobs} for jobs in groups.values()],)
+
+    def run_format(workflows):
+        for workflow in workflows:
+            ingestion.format_workflow(workflow)
+
+    def setup_mode(dataset):
+        groups, _ = generated(dataset)
+        return ([[j["extra_vars"]["major_workflow"] for j in jobs] for jobs in groups.values()],)
+
+    def run_mode(values):
+        for value in values:
+            ingestion._mode(value)
+
+    def setup_process_jobs(dataset):
+        return (dataset.v2_jobs,)
+
+    def run_process_jobs(jobs):
+        processor.process_jobs(jobs)
+
+    return {
+        "generate_workflows": (setup_generate, run_generate),
+        "validate_workflows": (setup_validate, run_validate),
+        "format_workflow": (setup_format, run_format),
+        "_mode": (setup_mode, run_mode),
+        "v2_process_jobs": (setup_process_jobs, run_process_jobs),
+    }
+
+
+def measure(setup, run, dataset, repeat):
+    best = None
+    for _ in range(repeat):
+        args = setup(dataset)
+        gc.collect()
+        start = time.perf_counter()
+        run(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    args = setup(dataset)
+    gc.collect()
+    tracemalloc.start()
+    run(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "jobs": dataset.size,
+        "seconds": round(best, 6),
+        "jobs_per_sec": round(dataset.size / best, 1),
+        "peak_mb": round(peak / (1024 * 1024), 3),
+    }
+
+
+def compare(results, baseline, threshold):
+    """Prints results next to the baseline and returns the regressed keys."""
+    regressions = []
+    print(f"{'case':<32} {'jobs':>8} {'seconds':>10} {'jobs/s':>12} {'peak MB':>9} {'vs base':>9}")
+    for key, result in results.items():
+        name = key.split("@")[0]
+        delta = ""
+        base = baseline.get(key)
+        if base:
+            change = result["seconds"] / base["seconds"] - 1
+            delta = f"{change:+.1%}"
+            if change > threshold:
+                regressions.append(key)
+                delta += " !"
+        print(
+            f"{name:<32} {result['jobs']:>8} {result['seconds']:>10.4f} "
+            f"{result['jobs_per_sec']:>12.1f} {result['peak_mb']:>9.2f} {delta:>9}"
+        )
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Ingestion microbenchmarks")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--cases", nargs="+", help="Only run these cases")
+    parser.add_argument("--ingestion", choices=sorted(_INGESTION_MODULES), default="v3")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--extra-vars-bytes", type=int, default=4096)
+    parser.add_argument("--baseline", default=_BASELINE)
+    parser.add_argument("--update-baseline", action="store_true")
+    parser.add_argument("--threshold", type=float, default=0.10, help="Allowed slowdown")
+    parser.add_argument("--check", action="store_true", help="Exit 1 on regressions")
+    args = parser.parse_args(argv)
+
+    ingestion = load_ingestion(args.ingestion)
+    cases = build_cases(ingestion, load_workflow_processor())
+    selected = args.cases or list(cases)
+
+    results = {}
+    with open(os.devnull, "w") as devnull:
+        for size in args.sizes:
+            dataset = Dataset(size, extra_vars_bytes=args.extra_vars_bytes)
+            # Replace the per-playbook AAP call with the synthetic events
+            ingestion.get_failed_tasks = dataset.failed_tasks
+            for name in selected:
+                setup, run = cases[name]
+                with redirect_stdout(devnull):
+                    results[f"{name}@{size}"] = measure(setup, run, dataset, args.repeat)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            stored = json.load(f)
+        if stored.get("ingestion") == args.ingestion:
+            baseline = stored["results"]
+
+    if args.check and not args.update_baseline and not baseline.keys() & results.keys():
+        sys.exit(f"No {args.ingestion} baseline for these sizes in {args.baseline}")
+
+    regressions = compare(results, baseline, args.threshold)
+
+    if args.update_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(
+                {
+                    "ingestion": args.ingestion,
+                    "python": platform.python_version(),
+                    "machine": platform.machine(),
+                    "results": results,
+                },
+                f,
+                indent=2,
+                sort_keys=True,
+            )
+            f.write("\n")
+        print(f"Baseline written to {args.baseline}")
+
+    if regressions:
+        print(f"Slower than baseline by more than {args.threshold:.0%}: {', '.join(regressions)}")
+        if args.check:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""Start-up time of the ingestion CLI.
+
+    python bench_startup.py                 # report, exit 1 over the target
+    python bench_startup.py --target-ms 80 --runs 20
+
+Each case runs in a fresh interpreter. The interpreter's own start-up
+(`python -c pass`) is measured the same way and subtracted, so the numbers
+are the time spent importing our code before any work starts.
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+_PROCESSING = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CASES = {
+    "python": ["-c", "pass"],
+    "cli --help": ["cli.py", "--help"],
+    "cli run-once --help": ["cli.py", "run-once", "--help"],
+    "import V3": ["-c", "import cli; cli._load_v3()"],
+}
+
+
+def measure(args, runs):
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(
+            [sys.executable, *args],
+            cwd=_PROCESSING,
+            stdout=subprocess.DEVNULL,
+            check=True,
+        )
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="CLI start-up benchmark")
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument(
+        "--target-ms", type=float, default=100, help="Allowed time on top of python itself"
+    )
+    args = parser.parse_args(argv)
+
+    interpreter = measure(CASES["python"], args.runs)
+    print(f"{'case':<22} {'median ms':>10} {'overhead ms':>12}")
+    print(f"{'python':<22} {interpreter * 1000:>10.1f} {'':>12}")
+    over = []
+    for name, case in CASES.items():
+        if name == "python":
+            continue
+        median = measure(case, args.runs)
+        overhead = (median - interpreter) * 1000
+        flag = " !" if overhead > args.target_ms else ""
+        print(f"{name:<22} {median * 1000:>10.1f} {overhead:>12.1f}{flag}")
+        if flag:
+            over.append(name)
+
+    if over:
+        print(f"Over the {args.target_ms:.0f} ms start-up target: {', '.join(over)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+"""End-to-end fetch load tests against local AAP stand-ins.
+
+    python load_test.py                                   # every scenario, V2 client
+    python load_test.py --client v3 --scenarios flaky
+    python load_test.py --jobs 20000 --cycles 5
+    python load_test.py --replay amrs=amrs.ndjson.gz --replay emea=emea.ndjson.gz
+
+One stand-in tower is started per region and the chosen client runs full
+collection cycles against them: V2 `AAPClient.get_new_jobs` (which pulls
+failed tasks itself) or V3 `get_playbooks` followed by `generate_workflows`.
+Each scenario reports jobs per second, cycle latency and the responses the
+towers sent.
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+from contextlib import redirect_stdout
+from datetime import datetime, timedelta
+
+from aap_standin import AAPDataset, StandInAAP
+from bench_ingestion import _PROCESSING, load_ingestion
+
+_REGIONS = ["amrs", "emea", "apac", "dmz"]
+
+# Fault settings handed to every region's StandInAAP
+SCENARIOS = {
+    "clean": {},
+    "latency": {"latency": 0.05, "jitter": 0.05},
+    "flaky": {"latency": 0.02, "error_rate": 0.02, "throttle_rate": 0.03},
+}
+
+
+def _fetch_start(dataset):
+    """A start time just before the oldest served job."""
+    first = min(job["created"] for job in dataset.jobs)
+    return datetime.fromisoformat(first.replace("Z", "+00:00")) - timedelta(hours=1)
+
+
+def v2_cycle(towers, datasets, page_size):
+    """Returns a callable running one V2 fetch cycle over every region."""
+    sys.path.insert(0, os.path.join(_PROCESSING, "ingestionV2"))
+    from aap_client import AAPClient
+    from config import Config
+
+    # Config defaults for everything but the towers, and no checkpoints so
+    # every cycle fetches the whole window
+    config = Config()
+    config.regions = list(towers)
+    config.aap_base_urls = {region: tower.url for region, tower in towers.items()}
+    config.aap_cookies = {region: "sessionid=loadtest" for region in towers}
+    config.aap_page_size = page_size
+    config.fetch_checkpoint_dir = ""
+    client = AAPClient(config)
+    # get_new_jobs starts 12 hours before the last processed time
+    since = {
+        region: _fetch_start(dataset) + timedelta(hours=12)
+        for region, dataset in datasets.items()
+    }
+
+    def cycle():
+        return sum(len(client.get_new_jobs(region, since[region])) for region in towers)
+
+    return cycle
+
+
+def v3_cycle(towers, datasets, page_size):
+    """Returns a callable running one V3 fetch and grouping cycle over every region."""
+    ingestion = load_ingestion("v3")
+    ingestion._ENVIRONMENTS = {
+        region: {"tower": tower.url, "elk": None} for region, tower in towers.items()
+    }
+    auth = {"sessionid": "loadtest"}
+    since = {region: _fetch_start(dataset) for region, dataset in datasets.items()}
+
+    def cycle():
+        jobs = 0
+        with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+            for region in towers:
+                playbooks = ingestion.get_playbooks(region, since[region], auth)
+                ingestion.generate_workflows(playbooks, region, auth, set())
+                jobs += len(playbooks)
+        return jobs
+
+    return cycle
+
+
+_CLIENTS = {"v2": v2_cycle, "v3": v3_cycle}
+
+
+def run_scenario(name, faults, datasets, client, cycles, page_size):
+    towers = {
+        region: StandInAAP(dataset, seed=seed, **faults)
+        for seed, (region, dataset) in enumerate(datasets.items())
+    }
+    for tower in towers.values():
+        tower.__enter__()
+    try:
+        cycle = _CLIENTS[client](towers, datasets, page_size)
+        latencies, jobs = [], 0
+        for _ in range(cycles):
+            start = time.perf_counter()
+            jobs += cycle()
+            latencies.append(time.perf_counter() - start)
+    finally:
+        for tower in towers.values():
+            tower.__exit__(None, None, None)
+
+    responses = {}
+    for tower in towers.values():
+        for status, count in tower.stats.items():
+            responses[status] = responses.get(status, 0) + count
+    return {
+        "scenario": name,
+        "jobs_per_cycle": jobs / cycles,
+        "jobs_per_sec": jobs / sum(latencies),
+        "cycle_p50": statistics.median(latencies),
+        "cycle_max": max(latencies),
+        "responses": responses,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="AAP fetch load tests")
+    parser.add_argument("--client", choices=sorted(_CLIENTS), default="v2")
+    parser.add_argument("--scenarios", nargs="+", choices=sorted(SCENARIOS))
+    parser.add_argument("--jobs", type=int, default=2000, help="Synthetic jobs per region")
+    parser.add_argument("--cycles", type=int, default=3)
+    parser.add_argument("--page-size", type=int, default=200)
+    parser.add_argument("--extra-vars-bytes", type=int, default=4096)
+    parser.add_argument(
+        "--replay",
+        action="append",
+        default=[],
+        metavar="REGION=FILE",
+        help="Serve a recording for a region instead of synthetic jobs",
+    )
+    args = parser.parse_args(argv)
+
+    recordings = dict(item.split("=", 1) for item in args.replay)
+    datasets = {}
+    for seed, region in enumerate(_REGIONS):
+        if recordings:
+            if region in recordings:
+                datasets[region] = AAPDataset.from_recording(recordings[region])
+        else:
+            datasets[region] = AAPDataset.synthetic(
+                args.jobs, seed=seed, extra_vars_bytes=args.extra_vars_bytes
+            )
+
+    print(f"{'scenario':<10} {'jobs/cycle':>10} {'jobs/s':>10} {'p50 s':>8} {'max s':>8}  responses")
+    for name in args.scenarios or list(SCENARIOS):
+        result = run_scenario(
+            name, SCENARIOS[name], datasets, args.client, args.cycles, args.page_size
+        )
+        responses = " ".join(f"{k}:{v}" for k, v in sorted(result["responses"].items()))
+        print(
+            f"{name:<10} {result['jobs_per_cycle']:>10.0f} {result['jobs_per_sec']:>10.1f} "
+            f"{result['cycle_p50']:>8.2f} {result['cycle_max']:>8.2f}  {responses}"
+        )
+
+
+if __name__ == "__main__":
+    main()
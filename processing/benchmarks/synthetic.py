@@ -0,0 +1,250 @@
+"""Synthetic AAP payloads for benchmarks and load tests.
+
+Generates `/api/v2/jobs/` results and `/api/v2/jobs/<id>/job_events/` results
+shaped like the ones the towers return for leapp workflows. Every
+major_workflow is covered, with a configurable share of failed workflows and
+padding in extra_vars to mimic the large variable sets real jobs carry.
+"""
+
+import json
+import random
+import uuid
+from datetime import datetime, timedelta, timezone
+
+_AAP_TIME_FORMAT = "%Y-%m-%dT%H:%M:%S.%fZ"
+
+_RELEASES = ["1.14", "1.15.2", "1.16.0", "1.17.1"]
+
+# major_workflow -> (source version, target version)
+_WORKFLOW_VERSIONS = {
+    "operational_check_7_to_8": ("7", "8"),
+    "operational_check_7_to_9": ("7", "9"),
+    "operational_check_8_to_9": ("8", "9"),
+    "inhibitor_check_7_to_8": ("7", "8"),
+    "inhibitor_check_8_to_9": ("8", "9"),
+    "upgrade_7_to_8": ("7", "8"),
+    "upgrade_8_to_9": ("8", "9"),
+    "upgrade_7_to_9": ("7", "9"),
+}
+
+MAJOR_WORKFLOWS = list(_WORKFLOW_VERSIONS)
+
+_NON_AUTOMATION_TASKS = [
+    "Check for NFS mounts",
+    "Check for inhibitors",
+    "Fail if any previous stage failed",
+    "Call error in order to fail stage.",
+    "Gathering Facts",
+]
+
+_AUTOMATION_TASKS = [
+    "Run leapp preupgrade",
+    "Run leapp upgrade",
+    "Remove old kernels",
+    "Restore /etc/fstab",
+    "Wait for host to come back after reboot",
+]
+
+_FAILED_EVENT_LEVELS = [
+    ("runner_on_failed", 3),
+    ("runner_item_on_failed", 3),
+    ("runner_on_unreachable", 3),
+    ("playbook_on_start", 0),
+]
+
+
+def _format_time(dt):
+    return dt.strftime(_AAP_TIME_FORMAT)
+
+
+def _padding(rng, size):
+    """Filler variables that make extra_vars about `size` bytes long."""
+    padding = {}
+    while size > 0:
+        value = f"{rng.getrandbits(256):064x}"
+        padding[f"inventory_var_{len(padding)}"] = value
+        size -= len(value) + 24
+    return padding
+
+
+def _stages(major_workflow, failed, rng):
+    """Returns the (stage name, extra_vars) of each job in a workflow."""
+    _, target = _WORKFLOW_VERSIONS[major_workflow]
+    if major_workflow.startswith("operational_check"):
+        return [("operational_check", {"sub_workflow": "operational_check"})]
+
+    if major_workflow.startswith("inhibitor_check"):
+        if failed and rng.random() < 0.5:
+            return [("operational_check", {"sub_workflow": "operational_check"})]
+        return [
+            ("operational_check", {"sub_workflow": "operational_check", "changefile_tasks_from": "main"}),
+            ("preupgrade", {"sub_workflow": "preupgrade", "changefile_tasks_from": "preupgrade"}),
+            ("rollback", {"sub_workflow": "rollback", "changefile_tasks_from": "rollback"}),
+        ]
+
+    stages = [
+        ("operational_check", {"sub_workflow": "operational_check"}),
+        ("preupgrade", {"sub_workflow": "preupgrade"}),
+        ("upgrade", {"sub_workflow": "upgrade"}),
+    ]
+    if failed:
+        stages.append(("vastool_revert", {"sub_workflow": "vastool_revert"}))
+    else:
+        # 7 to 9 upgrades finish with the 8 to 9 post-upgrade role
+        role = "postupgrade_8_to_9" if target == "9" else "postupgrade_7_to_8"
+        stages.append(
+            ("postupgrade", {"sub_workflow": "postupgrade", "changefile_included_role": role})
+        )
+    return stages
+
+
+class SyntheticAAP:
+    """Deterministic generator of AAP jobs and failed job events.
+
+    @Param: seed - int - Random seed
+    @Param: failure_rate - float - Share of workflows that fail
+    @Param: automation_failure_rate - float - Share of failed tasks whose task
+        name is not a known non-automation failure
+    @Param: incomplete_rate - float - Share of multi-job workflows still
+        missing their last job (they fail validation as in-progress)
+    @Param: extra_vars_bytes - int - Approximate padding added to extra_vars
+    @Param: region - string - Region written onto V2 style jobs
+    """
+
+    def __init__(
+        self,
+        seed=0,
+        failure_rate=0.2,
+        automation_failure_rate=0.5,
+        incomplete_rate=0.05,
+        extra_vars_bytes=4096,
+        region="amrs",
+        start=datetime(2024, 6, 1, tzinfo=timezone.utc),
+    ):
+        self.rng = random.Random(seed)
+        self.failure_rate = failure_rate
+        self.automation_failure_rate = automation_failure_rate
+        self.incomplete_rate = incomplete_rate
+        self.extra_vars_bytes = extra_vars_bytes
+        self.region = region
+        self.start = start
+        self.job_events = {}
+        self._next_job_id = 1000000
+        self._next_event_id = 50000000
+
+    def jobs(self, count):
+        """Returns at least `count` raw jobs, ordered by id, whole workflows only."""
+        jobs = []
+        clock = self.start
+        while len(jobs) < count:
+            major_workflow = self.rng.choice(MAJOR_WORKFLOWS)
+            failed = self.rng.random() < self.failure_rate
+            tx_id = f"tx_{uuid.UUID(int=self.rng.getrandbits(128))}"
+            limit = f"host{self.rng.randrange(1, 10 ** 6):06d}.example.com"
+            release = self.rng.choice(_RELEASES)
+            padding = _padding(self.rng, self.extra_vars_bytes)
+
+            stages = _stages(major_workflow, failed, self.rng)
+            if len(stages) > 1 and self.rng.random() < self.incomplete_rate:
+                stages = stages[:-1]
+            for position, (stage, stage_vars) in enumerate(stages):
+                # A failed workflow fails in its first stage when it has a
+                # single job, otherwise in the stage before the revert.
+                job_failed = failed and (
+                    len(stages) == 1 or position == len(stages) - 2
+                )
+                jobs.append(
+                    self._job(
+                        clock, major_workflow, stage, stage_vars, tx_id, limit,
+                        release, padding, job_failed,
+                    )
+                )
+                clock += timedelta(seconds=self.rng.randint(5, 90))
+        return jobs
+
+    def _job(self, clock, major_workflow, stage, stage_vars, tx_id, limit, release, padding, failed):
+        job_id = self._next_job_id
+        self._next_job_id += 1
+
+        elapsed = round(self.rng.uniform(30, 3600), 3)
+        started = clock + timedelta(seconds=self.rng.uniform(0.5, 5))
+        finished = started + timedelta(seconds=elapsed)
+        extra_vars = dict(padding)
+        extra_vars.update(stage_vars)
+        extra_vars.update({"txId": tx_id, "major_workflow": major_workflow})
+
+        if failed:
+            self.job_events[job_id] = self._failed_events(job_id, limit, started)
+
+        return {
+            "id": job_id,
+            "type": "job",
+            "url": f"/api/v2/jobs/{job_id}/",
+            "related": {"job_events": f"/api/v2/jobs/{job_id}/job_events/"},
+            "summary_fields": {"inventory": {"id": 1, "name": "leapp"}},
+            "created": _format_time(clock),
+            "modified": _format_time(finished),
+            "name": f"leapp_{major_workflow}_{stage}_{release}",
+            "description": "",
+            "job_type": "run",
+            "launch_type": "workflow",
+            "status": "failed" if failed else "successful",
+            "failed": failed,
+            "started": _format_time(started),
+            "finished": _format_time(finished),
+            "canceled_on": None,
+            "elapsed": elapsed,
+            "timeout": 7200,
+            "job_explanation": "",
+            "execution_node": "tower-node-1",
+            "limit": limit,
+            "extra_vars": json.dumps(extra_vars),
+        }
+
+    def _failed_events(self, job_id, limit, started):
+        events = []
+        for counter in range(1, self.rng.randint(2, 6)):
+            event_type, level = self.rng.choice(_FAILED_EVENT_LEVELS)
+            if self.rng.random() < self.automation_failure_rate:
+                task = self.rng.choice(_AUTOMATION_TASKS)
+            else:
+                task = self.rng.choice(_NON_AUTOMATION_TASKS)
+            event_id = self._next_event_id
+            self._next_event_id += 1
+            moment = _format_time(started + timedelta(seconds=counter))
+            events.append(
+                {
+                    "id": event_id,
+                    "type": "job_event",
+                    "created": moment,
+                    "modified": moment,
+                    "job": job_id,
+                    "event": event_type,
+                    "counter": counter,
+                    "event_display": event_type.replace("_", " ").title(),
+                    "event_level": level,
+                    "failed": True,
+                    "changed": False,
+                    "task": task,
+                    "role": "leapp_upgrade",
+                    "stdout": f"fatal: [{limit}]: FAILED! => {{\"msg\": \"{task} failed on attempt {counter}\"}}",
+                    "event_data": {
+                        "resolved_action": "ansible.builtin.command",
+                        "task_args": "",
+                        "remote_addr": limit,
+                        "host": limit,
+                        "res": {"msg": f"{task} failed", "rc": 1, "stderr": "error " * 20},
+                        "duration": round(self.rng.uniform(0.1, 30), 3),
+                        "start": moment,
+                        "end": moment,
+                        "uuid": str(uuid.UUID(int=self.rng.getrandbits(128))),
+                        "playbook": "leapp.yml",
+                    },
+                }
+            )
+        return events
+
+    def failed_events(self, job_id):
+        """Returns the failed job events of a job (empty for successful jobs)."""
+        return self.job_events.get(job_id, [])
+
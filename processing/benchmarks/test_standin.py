@@ -0,0 +1,192 @@
+"""End-to-end checks of the ingestion code against the local AAP stand-in.
+
+    python -m pytest test_standin.py
+"""
+
+import json
+import os
+import sys
+from datetime import timedelta
+
+import pytest
+import requests
+
+from aap_standin import AAPDataset, StandInAAP
+from bench_ingestion import _PROCESSING, load_ingestion
+from load_test import _fetch_start, run_scenario
+
+sys.path.insert(0, os.path.join(_PROCESSING, "ingestionV2"))
+
+
+class ListSink:
+    """Collects bulk actions instead of sending them to Elasticsearch."""
+
+    def __init__(self):
+        self.actions = []
+
+    def write(self, actions):
+        self.actions.extend(actions)
+        return len(actions), 0
+
+
+class WorkflowRecorder:
+    """Stands in for the V2 ElasticsearchClient."""
+
+    def __init__(self):
+        self.workflows = []
+        self.sketched = []
+
+    def update_workflows(self, workflows, sketch=True):
+        self.workflows.extend(workflows)
+        self.sketched.append(sketch)
+
+    def flush(self):
+        pass
+
+
+@pytest.fixture
+def dataset():
+    return AAPDataset.synthetic(300, seed=1, extra_vars_bytes=64)
+
+
+@pytest.fixture
+def v3(dataset):
+    ingestion = load_ingestion("v3")
+    with StandInAAP(dataset) as tower:
+        ingestion._ENVIRONMENTS = {"amrs": {"tower": tower.url, "elk": "http://127.0.0.1:9200"}}
+        yield ingestion
+
+
+def test_v3_gather_region_data_saves_cursor(v3, dataset, tmp_path):
+    plan = {"start_time": _fetch_start(dataset), "existing_ids": set()}
+    sink = ListSink()
+
+    res = v3.gather_region_data("amrs", "sessionid=test", sink=sink, plan=plan, cursor_dir=tmp_path)
+
+    assert res["uploaded_workflows"]
+    assert len(sink.actions) == len(res["uploaded_workflows"]) + len(res["updated_workflows"])
+    with open(tmp_path / "amrs.cursor.json") as f:
+        after_id = json.load(f)["after_id"]
+    assert 0 < after_id <= dataset.jobs[-1]["id"]
+
+    # The next run starts after the saved cursor
+    cursor = v3.JobCursor("amrs", tmp_path)
+    assert cursor.after_id == after_id
+    playbooks = v3.get_playbooks("amrs", plan["start_time"], {"sessionid": "test"}, cursor)
+    assert all(playbook["id"] > after_id for playbook in playbooks)
+
+
+def test_v3_bounded_gather_region_data_saves_cursor(v3, dataset, tmp_path):
+    plan = {"start_time": _fetch_start(dataset), "existing_ids": set()}
+
+    res = v3.gather_region_data(
+        "amrs",
+        "sessionid=test",
+        sink=ListSink(),
+        plan=plan,
+        memory_budget_mb=1,
+        spill_dir=tmp_path,
+        cursor_dir=tmp_path,
+    )
+
+    assert res["uploaded_workflows"]
+    assert (tmp_path / "amrs.cursor.json").exists()
+
+
+def test_v3_gather_region_data_fails_on_a_failing_tower(dataset, tmp_path, monkeypatch):
+    ingestion = load_ingestion("v3")
+    monkeypatch.setattr(ingestion, "_PAGE_BACKOFF", 0)
+    plan = {"start_time": _fetch_start(dataset), "existing_ids": set()}
+    sink = ListSink()
+    with StandInAAP(dataset, error_rate=1.0) as tower:
+        ingestion._ENVIRONMENTS = {"amrs": {"tower": tower.url, "elk": "http://127.0.0.1:9200"}}
+        with pytest.raises(requests.HTTPError):
+            ingestion.gather_region_data(
+                "amrs", "sessionid=test", sink=sink, plan=plan, cursor_dir=tmp_path
+            )
+
+    assert not sink.actions
+    assert not (tmp_path / "amrs.cursor.json").exists()
+
+
+def test_v1_get_playbooks_fails_on_a_failing_tower(dataset, monkeypatch):
+    pytest.importorskip("pandas")
+    ingestion = load_ingestion("v1")
+    monkeypatch.setattr(ingestion, "_PAGE_BACKOFF", 0)
+    with StandInAAP(dataset, error_rate=1.0) as tower:
+        ingestion._ENVIRONMENTS = {"amrs": {"tower": tower.url}}
+        with pytest.raises(requests.HTTPError):
+            ingestion.get_playbooks("amrs", _fetch_start(dataset), {"sessionid": "test"})
+    assert tower.stats == {500: ingestion._PAGE_RETRIES + 1}
+
+
+@pytest.mark.parametrize("client", ["v2", "v3"])
+def test_load_test_cycle(client, dataset):
+    result = run_scenario("clean", {}, {"amrs": dataset}, client, cycles=1, page_size=200)
+
+    assert result["jobs_per_cycle"] == len(dataset.jobs)
+    assert set(result["responses"]) == {200}
+
+
+@pytest.fixture
+def v2(dataset, tmp_path, monkeypatch):
+    # main.py configures file logging on import
+    monkeypatch.chdir(tmp_path)
+    from aap_client import AAPClient
+    from config import Config
+    from workflow_processor import WorkflowProcessor
+    import main
+
+    with StandInAAP(dataset) as tower:
+        config = Config()
+        config.regions = ["amrs"]
+        config.aap_base_urls = {"amrs": tower.url}
+        config.aap_cookies = {"amrs": "sessionid=test"}
+        config.fetch_checkpoint_dir = ""
+        config.failure_cluster_dir = ""
+        yield main, AAPClient(config), WorkflowProcessor(config)
+
+
+def _workflow_key(job):
+    return json.loads(job["extra_vars"])["txId"], job["limit"]
+
+
+def test_v2_notified_job_is_ingested_with_its_workflow(v2, dataset):
+    main, aap_client, processor = v2
+    notified = dataset.jobs[-1]
+    es_client = WorkflowRecorder()
+
+    main.process_notifications({"amrs": [notified["id"]]}, ["amrs"], aap_client, processor, es_client)
+
+    (workflow,) = es_client.workflows
+    expected = [job["id"] for job in dataset.jobs if _workflow_key(job) == _workflow_key(notified)]
+    assert sorted(job["id"] for job in workflow["jobs"]) == expected
+    assert workflow["region"] == "amrs"
+    # Left to the next sweep so the sketch watermark only moves in order
+    assert es_client.sketched == [False]
+
+
+def test_v2_swept_jobs_are_processed(v2, dataset):
+    main, aap_client, processor = v2
+    since = _fetch_start(dataset) + timedelta(hours=12)
+    es_client = WorkflowRecorder()
+
+    new_jobs, workflows = main.process_region("amrs", since, aap_client, processor, es_client)
+
+    assert len(new_jobs) == len(dataset.jobs)
+    assert len(workflows) == len({_workflow_key(job) for job in dataset.jobs})
+    assert es_client.workflows == workflows
+
+
+def test_v2_region_run_stops_without_writing_once_its_lease_is_lost(v2, dataset):
+    main, aap_client, processor = v2
+    since = _fetch_start(dataset) + timedelta(hours=12)
+    es_client = WorkflowRecorder()
+
+    def keep_lease():
+        raise main.LeaseLostError("Lost the lease for region amrs")
+
+    with pytest.raises(main.LeaseLostError):
+        main.process_region("amrs", since, aap_client, processor, es_client, keep_lease)
+
+    assert not es_client.workflows
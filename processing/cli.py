@@ -0,0 +1,316 @@
+"""Single entry point for the ingestion jobs.
+
+    python cli.py run-once                          # every region with a cookie set
+    python cli.py run-once --regions amrs emea --sink ndjson --output-dir out/
+    python cli.py run-once --cursor-dir state/      # resume job listings between runs
+    python cli.py run-once --parallel-regions 4     # regions on one cluster share a bulk stream
+    python cli.py run-once --archive-dir archive/   # keep every raw AAP response
+    python cli.py backfill --since 2024-02-01 --regions amrs
+    python cli.py revalidate --archive-dir archive/ --regions amrs
+    python cli.py daemon                            # the V2 long-running daemon
+    python cli.py replay out/ --es-url http://localhost:9200
+    python cli.py report success-by-release --analytics-dir analytics/ --days 90
+
+`run-once` and `backfill` run the V3 collection; cookies come from
+AAP_COOKIE_<REGION> or --cookie region=cookie. `revalidate` rebuilds the
+workflows archived with --archive-dir under the current rules, without
+calling AAP. `daemon` and `replay` hand over to ingestionV2/main.py and
+ingestionV2/replay.py. `report` runs one of the ingestionV2/reports.py
+queries over the daemon's ANALYTICS_DIR export without touching Elasticsearch.
+
+Only argparse is imported up front; each subcommand imports what it needs
+when it runs, so cron-style invocations do not pay for pandas, requests or
+the Elasticsearch client before doing any work. benchmarks/bench_startup.py
+checks the start-up time target.
+"""
+
+import argparse
+import os
+import sys
+
+_HERE = os.path.dirname(os.path.abspath(__file__))
+
+REGIONS = ["amrs", "emea", "apac", "dmz", "uat", "sit"]
+
+
+def _load_v3():
+    import importlib.util
+
+    spec = importlib.util.spec_from_file_location(
+        "ingestion_v3", os.path.join(_HERE, "ingestionV3", "main.py")
+    )
+    module = importlib.util.module_from_spec(spec)
+    # Registered so revalidation workers can unpickle its functions
+    sys.modules["ingestion_v3"] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def _use_v2():
+    sys.path.insert(0, os.path.join(_HERE, "ingestionV2"))
+
+
+def _cookies(args):
+    cookies = dict(item.split("=", 1) for item in args.cookie)
+    regions = args.regions or REGIONS
+    for region in regions:
+        if region not in cookies and os.getenv(f"AAP_COOKIE_{region.upper()}"):
+            cookies[region] = os.environ[f"AAP_COOKIE_{region.upper()}"]
+    missing = [region for region in args.regions or [] if region not in cookies]
+    if missing:
+        sys.exit(f"No cookie for: {', '.join(missing)}")
+    if not cookies:
+        sys.exit("No cookies given; set AAP_COOKIE_<REGION> or pass --cookie")
+    return {region: cookies[region] for region in regions if region in cookies}
+
+
+def _sink(args):
+    if args.sink == "elasticsearch":
+        return None
+    _use_v2()
+    from sinks import NdjsonSink, ParquetSink
+
+    if args.sink == "ndjson":
+        return NdjsonSink(args.output_dir, compression=args.compression)
+    return ParquetSink(args.output_dir)
+
+
+def _report(results):
+    for region, res in results.items():
+        print(
+            f"{region}: uploaded {len(res['uploaded_workflows'])}, "
+            f"updated {len(res['updated_workflows'])}"
+        )
+
+
+def _archive(ingestion, args):
+    if args.archive_dir:
+        ingestion.set_archive(ingestion.ResponseArchive(args.archive_dir))
+
+
+def run_once(args):
+    ingestion = _load_v3()
+    _archive(ingestion, args)
+    sink = _sink(args)
+    try:
+        results = ingestion.gather_all_regions(
+            _cookies(args),
+            sink=sink,
+            memory_budget_mb=args.memory_budget_mb,
+            spill_dir=args.spill_dir,
+            cursor_dir=args.cursor_dir,
+            id_filter_dir=args.id_filter_dir,
+            parallel_regions=args.parallel_regions,
+        )
+    finally:
+        if sink is not None:
+            sink.close()
+    _report(results)
+
+
+def backfill(args):
+    from datetime import datetime, timezone
+
+    ingestion = _load_v3()
+    _archive(ingestion, args)
+    since = datetime.fromisoformat(args.since)
+    if since.tzinfo is None:
+        since = since.replace(tzinfo=timezone.utc)
+
+    sink = _sink(args)
+    results = {}
+    try:
+        for region, cookie in _cookies(args).items():
+            es_client = ingestion._elasticsearch(ingestion._ENVIRONMENTS[region]["elk"])
+            plan = {"start_time": since}
+            if not args.id_filter_dir:
+                plan["existing_ids"] = ingestion.get_existing_workflow_ids(
+                    es_client, region, since
+                )
+            results[region] = ingestion.gather_region_data(
+                region,
+                cookie,
+                sink=sink,
+                plan=plan,
+                memory_budget_mb=args.memory_budget_mb,
+                spill_dir=args.spill_dir,
+                id_filter_dir=args.id_filter_dir,
+            )
+    finally:
+        if sink is not None:
+            sink.close()
+    _report(results)
+
+
+def revalidate(args):
+    ingestion = _load_v3()
+    sink = _sink(args)
+    try:
+        for region in args.regions or REGIONS:
+            ingestion.revalidate_region(
+                region,
+                args.archive_dir,
+                sink=sink,
+                workers=args.workers,
+                batch_size=args.batch_size,
+            )
+    finally:
+        if sink is not None:
+            sink.close()
+
+
+def daemon(args):
+    _use_v2()
+    from main import main
+
+    main()
+
+
+def replay(args):
+    _use_v2()
+    from replay import main
+
+    main(args.replay_args)
+
+
+def report(args):
+    import csv
+    import json
+
+    _use_v2()
+    from reports import REPORTS, ReportEngine
+
+    if args.name not in REPORTS:
+        sys.exit(
+            "Unknown report; choose one of:\n"
+            + "\n".join(f"  {name:<20} {r.description}" for name, r in REPORTS.items())
+        )
+    if not args.analytics_dir:
+        sys.exit("No analytics directory; set ANALYTICS_DIR or pass --analytics-dir")
+    params = {}
+    for item in args.param:
+        key, _, value = item.partition("=")
+        params[key] = int(value) if value.lstrip("-").isdigit() else value
+    if args.days is not None:
+        params["days"] = args.days
+
+    engine = ReportEngine(args.analytics_dir, threads=args.threads)
+    try:
+        columns, rows = engine.run(args.name, **params)
+    except ValueError as e:
+        sys.exit(str(e))
+    finally:
+        engine.close()
+
+    if args.format == "json":
+        json.dump([dict(zip(columns, row)) for row in rows], sys.stdout, default=str, indent=2)
+        print()
+    elif args.format == "csv":
+        writer = csv.writer(sys.stdout)
+        writer.writerow(columns)
+        writer.writerows(rows)
+    else:
+        cells = [columns] + [["" if v is None else str(v) for v in row] for row in rows]
+        widths = [max(len(row[i]) for row in cells) for i in range(len(columns))]
+        for row in cells:
+            print("  ".join(value.ljust(width) for value, width in zip(row, widths)).rstrip())
+
+
+def _add_sink_args(parser):
+    parser.add_argument(
+        "--sink", choices=["elasticsearch", "ndjson", "parquet"], default="elasticsearch"
+    )
+    parser.add_argument("--output-dir", default="output")
+    parser.add_argument("--compression", choices=["gzip", "zstd", "none"], default="gzip")
+
+
+def _add_collection_args(parser, memory_budget_mb):
+    parser.add_argument("--regions", nargs="+", choices=REGIONS)
+    parser.add_argument(
+        "--cookie", action="append", default=[], metavar="REGION=COOKIE"
+    )
+    _add_sink_args(parser)
+    parser.add_argument("--archive-dir", help="Archive every raw AAP response here")
+    parser.add_argument(
+        "--memory-budget-mb",
+        type=int,
+        default=memory_budget_mb,
+        help="Spill playbooks to disk to keep those in memory within this budget "
+        "(workflow IDs and the current page are not counted)",
+    )
+    parser.add_argument("--spill-dir", help="Where spilled playbooks go (default: temp dir)")
+    parser.add_argument(
+        "--id-filter-dir",
+        help="Look up existing workflows through Bloom filters kept here",
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="RHEL upgrade reporting ingestion")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    once = commands.add_parser("run-once", help="Collect every region once and exit")
+    _add_collection_args(once, memory_budget_mb=None)
+    once.add_argument(
+        "--cursor-dir", help="Keep each region's job listing cursor here between runs"
+    )
+    once.add_argument(
+        "--parallel-regions",
+        type=int,
+        default=1,
+        help="Regions gathered at once; writes to a shared cluster are merged",
+    )
+    once.set_defaults(func=run_once)
+
+    back = commands.add_parser("backfill", help="Re-collect regions from a given time")
+    back.add_argument("--since", required=True, help="ISO date or time, UTC if no offset")
+    _add_collection_args(back, memory_budget_mb=512)
+    back.set_defaults(func=backfill)
+
+    check = commands.add_parser(
+        "revalidate", help="Rebuild archived workflows with the current rules"
+    )
+    check.add_argument("--archive-dir", required=True)
+    check.add_argument("--regions", nargs="+", choices=REGIONS)
+    check.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    check.add_argument("--batch-size", type=int, default=500)
+    _add_sink_args(check)
+    check.set_defaults(func=revalidate)
+
+    run_daemon = commands.add_parser("daemon", help="Run the V2 ingestion daemon")
+    run_daemon.set_defaults(func=daemon)
+
+    run_report = commands.add_parser(
+        "report", help="Run an analytics report over the local workflow export"
+    )
+    run_report.add_argument("name", help="Report to run; an unknown name lists them")
+    run_report.add_argument("--analytics-dir", default=os.environ.get("ANALYTICS_DIR"))
+    run_report.add_argument("--days", type=int, help="Look-back window in days")
+    run_report.add_argument(
+        "--param",
+        action="append",
+        default=[],
+        metavar="KEY=VALUE",
+        help="Other report parameters, e.g. host_pattern='^([a-z]+)' or limit=50",
+    )
+    run_report.add_argument("--format", choices=["table", "csv", "json"], default="table")
+    run_report.add_argument("--threads", type=int)
+    run_report.set_defaults(func=report)
+
+    run_replay = commands.add_parser(
+        "replay", help="Bulk-load sink output into Elasticsearch", add_help=False
+    )
+    run_replay.add_argument("replay_args", nargs=argparse.REMAINDER)
+    run_replay.set_defaults(func=replay)
+
+    # Options meant for replay.py are passed through untouched
+    args, extra = parser.parse_known_args(argv)
+    if args.command == "replay":
+        args.replay_args = extra + args.replay_args
+    elif extra:
+        parser.error(f"unrecognized arguments: {' '.join(extra)}")
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -11,6 +11,8 @@ __name__ = "RHEL Upgrade Reporting Ingestion"
 
 from datetime import datetime, timedelta
 import json
+import random
+import time
 import pytz
 import requests
 
@@ -123,6 +125,13 @@ _ENVIRONMENTS = {
 
 _PAGES = "200"
 
+# Retries of a failing page, with jittered exponential backoff (seconds)
+_PAGE_RETRIES = 3
+_PAGE_BACKOFF = 1
+
+# Connect and read timeouts of every AAP request, in seconds
+_AAP_TIMEOUT = (10, 60)
+
 
 def _get_auth(cookie):
     """Returns authentication token from cookie
@@ -162,21 +171,36 @@ def scrape(baseurl, endpoint, query, auth, data):
     @Param: auth - string - authentication token
     @Param: data - list - list which results will be appended to
 
+    Each page is retried on its own with jittered backoff. A page that keeps
+    failing raises its last error, so a run fails rather than ingesting part
+    of its data.
+
     @Return - None
     """
     print("Scraping: {}{}{}".format(baseurl, endpoint, query))
-    try:
-        response = requests.get(
-            "{}{}{}".format(baseurl, endpoint, query), cookies=auth, verify=False
-        )
-        tmp = response.json()
-        if "results" in tmp:
-            data.extend(tmp["results"])
-        if "next" in tmp and tmp["next"]:
-            if f"page={_PAGES}" not in tmp["next"]:
-                scrape(baseurl, tmp["next"], "", auth, data)
-    except Exception as e:
-        print("Error: {}".format(e))
+    for attempt in range(_PAGE_RETRIES + 1):
+        try:
+            response = requests.get(
+                "{}{}{}".format(baseurl, endpoint, query),
+                cookies=auth,
+                verify=False,
+                timeout=_AAP_TIMEOUT,
+            )
+            response.raise_for_status()
+            tmp = response.json()
+            break
+        except Exception as e:
+            if attempt == _PAGE_RETRIES:
+                print("Error: {}".format(e))
+                raise
+            wait_time = _PAGE_BACKOFF * (2**attempt) * random.uniform(0.5, 1.5)
+            print(f"Error: {e}, retrying page in {wait_time:.1f} seconds")
+            time.sleep(wait_time)
+    if "results" in tmp:
+        data.extend(tmp["results"])
+    if "next" in tmp and tmp["next"]:
+        if f"page={_PAGES}" not in tmp["next"]:
+            scrape(baseurl, tmp["next"], "", auth, data)
 
 
 def get_playbooks(region, start_time, auth):
@@ -623,11 +647,13 @@ def get_ids(es_client, region, start_time):
     return []
 
 
-def gather_region_data(region, cookie):
+def gather_region_data(region, cookie, sink=None):
     """Gathers data for a given region and uploads it to Elasticsearch.
 
     @Param: region - string - One of [amrs, emea, apac, sit, uat]
     @Param: cookie - string - Cookie to use for authentication while pulling data
+    @Param: sink - object - Optional destination with a write(actions) method,
+        used instead of uploading to Elasticsearch
 
     @Return: dict - Dictionary containing uploaded and non-uploaded workflows.
     """
@@ -671,7 +697,10 @@ def gather_region_data(region, cookie):
         # for i in res['uploaded_workflows']:
         #     print(i)
         #     res = es_client.index(index=_ES_INDEX, id=i['id'], document=i)
-        helpers.bulk(es_client, res["uploaded_workflows"])
+        if sink is not None:
+            sink.write(res["uploaded_workflows"])
+        else:
+            helpers.bulk(es_client, res["uploaded_workflows"])
     except Exception as e:
         print(e)
     return res
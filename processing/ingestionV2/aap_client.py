@@ -1,6 +1,13 @@
+import json
+import time
 import requests
-from datetime import datetime, timedelta
+from urllib.parse import urljoin
+from datetime import datetime, timedelta, timezone
 from logger import get_logger
+from checkpoints import FetchCheckpoint, NoCheckpoint
+from metrics import observe_aap_response
+from resilience import CircuitBreaker, CircuitOpenError, Hedger, LatencyTracker
+from tracing import span
 from utils import retry_with_backoff
 
 logger = get_logger(__name__)
@@ -42,6 +49,37 @@ class AAPClient:
         "stdout",
     }
 
+    # Job event types AAP reports at event_level 0 or 3. Filtering on them
+    # server side leaves out the play and task start events that AAP also
+    # marks failed when one of their hosts fails.
+    _FAILED_TASK_EVENTS = (
+        "playbook_on_start",
+        "debug",
+        "verbose",
+        "deprecated",
+        "warning",
+        "system_warning",
+        "error",
+        "runner_on_failed",
+        "runner_on_start",
+        "runner_on_ok",
+        "runner_on_error",
+        "runner_on_skipped",
+        "runner_on_unreachable",
+        "runner_on_no_hosts",
+        "runner_on_async_poll",
+        "runner_on_async_ok",
+        "runner_on_async_failed",
+        "runner_on_file_diff",
+        "runner_item_on_ok",
+        "runner_item_on_failed",
+        "runner_item_on_skipped",
+        "runner_retry",
+    )
+
+    # How far before a notified job its workflow's other jobs are looked for
+    _WORKFLOW_LOOKBACK = timedelta(days=7)
+
     _FAILED_TASKS_EVENT_DATA_KEYS = {
         "resolved_action",
         "task_args",
@@ -55,6 +93,17 @@ class AAPClient:
 
     def __init__(self, config):
         self.config = config
+        self.timeout = (config.aap_connect_timeout, config.aap_read_timeout)
+        self.breakers = {
+            region: CircuitBreaker(
+                region,
+                failure_threshold=config.aap_breaker_failures,
+                reset_timeout=config.aap_breaker_reset,
+            )
+            for region in config.regions
+        }
+        self.latencies = {}
+        self.hedger = Hedger() if config.aap_hedge_requests else None
         self.sessions = {}
         for region in self.config.regions:
             session = requests.Session()
@@ -69,8 +118,29 @@ class AAPClient:
         cookie_parts = cookie_string.split("=", 1)
         return {cookie_parts[0]: cookie_parts[1]}
 
-    @retry_with_backoff(max_retries=3, backoff_in_seconds=1)
-    def get_new_jobs(self, region, last_processed_time):
+    def _checkpoint(self, region):
+        if self.config.fetch_checkpoint_dir:
+            return FetchCheckpoint(self.config.fetch_checkpoint_dir, region)
+        return NoCheckpoint()
+
+    def get_new_jobs(self, region, last_processed_time, keep_lease=lambda: None):
+        """Lists new jobs with their failed tasks.
+
+        Pages are fetched by job id (`order_by=id&id__gt=<last id>`) rather
+        than by page number, so deep pages cost the tower no more than the
+        first. Every request is retried on its own, so a failing page is
+        retried from that page. With FETCH_CHECKPOINT_DIR set, a fetch that
+        still fails resumes from its last committed page on the next call.
+        keep_lease is called after every page and stops the fetch by raising.
+
+        Unlike the V3 JobCursor, the last id is not kept between calls: every
+        call starts at `id__gt=0` over the 12 hour window. process_jobs
+        builds each workflow from the jobs fetched here alone and the write
+        replaces its `jobs`, so a call may only skip jobs whose workflow gets
+        no job in the window. Every job in the window belongs to such a
+        workflow, so a cursor kept safely would never move past the window's
+        first job, and one kept further would drop jobs from workflows.
+        """
         base_url = self.config.aap_base_urls[region]
         endpoint = "/api/v2/jobs/"
 
@@ -79,45 +149,159 @@ class AAPClient:
         query = (
             f"?format=json&name__icontains=leapp&not__finished__isnull=true"
             f"&type=job"
-            f"&created__gt={start_time.isoformat()}"
-            f"&page_size={self.config.aap_page_size}"
+            f"&created__gt={requests.utils.quote(start_time.isoformat())}"
+            f"&order_by=id&page_size={self.config.aap_page_size}"
         )
+        listing = f"{base_url}{endpoint}{query}"
 
-        url = f"{base_url}{endpoint}{query}"
-
-        jobs = []
+        checkpoint = self._checkpoint(region)
+        jobs, url, page = checkpoint.resume(f"{listing}&id__gt=0")
         while url:
-            response = self.sessions[region].get(url)
-            response.raise_for_status()
-            data = response.json()
-            filtered_jobs = [self._filter_job_data(job) for job in data["results"]]
+            page += 1
+            data = self._get(region, "jobs", url, page=page)
+            filtered_jobs = [self._filter_job_data(job, region) for job in data["results"]]
             for job in filtered_jobs:
                 if job["failed"]:
                     job["failed_tasks"] = self.get_failed_tasks(job["id"], region)
             jobs.extend(filtered_jobs)
-            url = data["next"]
+            url = None
+            if data["next"] and data["results"]:
+                url = f"{listing}&id__gt={data['results'][-1]['id']}"
+            checkpoint.commit(filtered_jobs, url, page)
+            keep_lease()
 
+        checkpoint.clear()
         logger.info(f"Fetched {len(jobs)} new jobs for region {region}")
         return jobs
 
-    @retry_with_backoff(max_retries=3, backoff_in_seconds=1)
+    def get_workflow_jobs(self, region, job_id):
+        """Fetches a notified job and the other jobs of its workflow.
+
+        Workflow documents are written whole, so a single finished job is not
+        enough. Its siblings share its host (`limit`) and `txId`; the tower
+        narrows the listing to the host and the lookback, and the txId is
+        matched here.
+        """
+        base_url = self.config.aap_base_urls[region]
+        job = self._get(region, "job", f"{base_url}/api/v2/jobs/{job_id}/", job_id=job_id)
+        tx_id = self._filter_job_data(job, region)["extra_vars"].get("txId")
+        if not tx_id:
+            logger.info(f"Job {job_id} in region {region} has no txId; ignoring")
+            return []
+
+        created = datetime.fromisoformat(job["created"].replace("Z", "+00:00"))
+        start_time = created.astimezone(timezone.utc) - self._WORKFLOW_LOOKBACK
+        query = (
+            f"?format=json&name__icontains=leapp&not__finished__isnull=true"
+            f"&type=job&limit={requests.utils.quote(job['limit'])}"
+            f"&created__gt={requests.utils.quote(start_time.isoformat())}"
+            f"&page_size={self.config.aap_page_size}"
+        )
+        url = f"{base_url}/api/v2/jobs/{query}"
+        jobs = []
+        page = 0
+        while url:
+            page += 1
+            data = self._get(region, "jobs", url, page=page)
+            for candidate in data["results"]:
+                candidate = self._filter_job_data(candidate, region)
+                if candidate["extra_vars"].get("txId") != tx_id:
+                    continue
+                if candidate["failed"]:
+                    candidate["failed_tasks"] = self.get_failed_tasks(candidate["id"], region)
+                jobs.append(candidate)
+            url = urljoin(base_url, data["next"]) if data["next"] else None
+
+        logger.info(f"Fetched {len(jobs)} jobs of workflow {tx_id} for job {job_id}")
+        return jobs
+
     def get_failed_tasks(self, job_id, region):
+        """Lists a job's failed events at event_level 0 or 3, in run order.
+
+        The tower filters on failure, event type and order, so every page of
+        the listing is made of candidate events. The listing is read to its
+        end on purpose: Ansible drops the job's host from the play once it
+        fails or is unreachable, so that failure is already among the last
+        events of the listing, and stopping at it would save no request but
+        could miss a later `error` event.
+        """
         base_url = self.config.aap_base_urls[region]
-        url = f"{base_url}/api/v2/jobs/{job_id}/job_events/?failed=true"
+        query = (
+            f"?failed=true&event__in={','.join(self._FAILED_TASK_EVENTS)}"
+            f"&order_by=counter&page_size={self.config.aap_events_page_size}"
+        )
+        url = f"{base_url}/api/v2/jobs/{job_id}/job_events/{query}"
 
-        response = self.sessions[region].get(url)
+        failed_tasks = []
+        page = 0
+        while url:
+            page += 1
+            data = self._get(
+                region, "job_events", url, hedge=True, job_id=job_id, page=page
+            )
+            failed_tasks.extend(
+                self._filter_failed_task_data(task)
+                for task in data["results"]
+                if task["event_level"] in [0, 3]
+            )
+            url = urljoin(base_url, data["next"]) if data["next"] else None
+        return failed_tasks
+
+    @retry_with_backoff(
+        max_retries=3, backoff_in_seconds=1, jitter=True, no_retry_on=(CircuitOpenError,)
+    )
+    def _get(self, region, endpoint, url, hedge=False, **attrs):
+        """GETs an AAP URL through the tower's circuit breaker.
+
+        Reads marked hedge are duplicated when slower than the recent p95
+        latency if AAP_HEDGE_REQUESTS is on.
+        """
+        breaker = self.breakers[region]
+        breaker.before_call()
+        latencies = self.latencies.setdefault((region, endpoint), LatencyTracker())
+        with span(f"aap.{endpoint}", region=region, **attrs):
+            start = time.perf_counter()
+            try:
+                if hedge and self.hedger is not None:
+                    response = self.hedger.call(
+                        lambda: self._send(region, url, latencies),
+                        latencies,
+                        region,
+                        accept=lambda response: response.ok,
+                    )
+                else:
+                    response = self._send(region, url, latencies)
+            except requests.RequestException:
+                breaker.record_failure()
+                raise
+            observe_aap_response(region, endpoint, response, time.perf_counter() - start)
+
+        # Throttling and server errors mean the tower is struggling
+        if response.status_code == 429 or response.status_code >= 500:
+            breaker.record_failure()
+        else:
+            breaker.record_success()
         response.raise_for_status()
-        data = response.json()
+        return response.json()
 
-        failed_tasks = [
-            self._filter_failed_task_data(task)
-            for task in data["results"]
-            if task["event_level"] in [0, 3]
-        ]
-        return failed_tasks
+    def _send(self, region, url, latencies):
+        start = time.perf_counter()
+        response = self.sessions[region].get(url, timeout=self.timeout)
+        if response.ok:
+            latencies.add(time.perf_counter() - start)
+        return response
+
+    def _filter_job_data(self, job, region):
+        """Shapes a listed job the way WorkflowProcessor.process_jobs reads it.
 
-    def _filter_job_data(self, job):
-        return {k: v for k, v in job.items() if k in self._PLAYBOOK_KEYS}
+        AAP returns `extra_vars` as a JSON string; it is decoded here, and the
+        job is tagged with its region.
+        """
+        filtered_job = {k: v for k, v in job.items() if k in self._PLAYBOOK_KEYS}
+        if isinstance(filtered_job.get("extra_vars"), str):
+            filtered_job["extra_vars"] = json.loads(filtered_job["extra_vars"] or "{}")
+        filtered_job["region"] = region
+        return filtered_job
 
     def _filter_failed_task_data(self, task):
         filtered_task = {k: v for k, v in task.items() if k in self._FAILED_TASKS_KEYS}
@@ -0,0 +1,250 @@
+import glob
+import json
+import os
+from datetime import datetime, timezone
+from logger import get_logger
+from tracing import span
+
+logger = get_logger(__name__)
+
+
+def _ts(value):
+    if value is None or value == "":
+        return None
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc)
+
+
+def _text(value):
+    if value is None or isinstance(value, str):
+        return value
+    return json.dumps(value, sort_keys=True)
+
+
+def _schemas():
+    import pyarrow as pa
+
+    ts = pa.timestamp("us", tz="UTC")
+    return {
+        "workflows": pa.schema(
+            [
+                ("id", pa.string()),
+                ("workflow_type", pa.string()),
+                ("status", pa.string()),
+                ("host", pa.string()),
+                ("release", pa.string()),
+                ("started", ts),
+                ("finished", ts),
+                ("duration_seconds", pa.float64()),
+                ("failed", pa.bool_()),
+                ("automation_failure", pa.bool_()),
+                ("job_count", pa.int32()),
+                ("exported_at", ts),
+            ]
+        ),
+        "jobs": pa.schema(
+            [
+                ("id", pa.int64()),
+                ("workflow_id", pa.string()),
+                ("workflow_type", pa.string()),
+                ("name", pa.string()),
+                ("stage", pa.string()),
+                ("release", pa.string()),
+                ("host", pa.string()),
+                ("status", pa.string()),
+                ("failed", pa.bool_()),
+                ("created", ts),
+                ("started", ts),
+                ("finished", ts),
+                ("elapsed", pa.float64()),
+                ("timeout", pa.int64()),
+                ("timed_out", pa.bool_()),
+                ("exported_at", ts),
+            ]
+        ),
+        "failed_tasks": pa.schema(
+            [
+                ("id", pa.int64()),
+                ("job_id", pa.int64()),
+                ("workflow_id", pa.string()),
+                ("task", pa.string()),
+                ("role", pa.string()),
+                ("event", pa.string()),
+                ("created", ts),
+                ("host", pa.string()),
+                ("message", pa.string()),
+                ("cluster_id", pa.string()),
+                ("exported_at", ts),
+            ]
+        ),
+    }
+
+
+def flatten(workflow, exported_at):
+    """Splits a processed workflow into workflow, job and failed task rows."""
+    jobs = workflow["jobs"]
+    started, finished = _ts(workflow["started"]), _ts(workflow["finished"])
+    release = jobs[0]["name"].split("_")[-1] if jobs else None
+    rows = {
+        "workflows": [
+            {
+                "id": workflow["id"],
+                "workflow_type": workflow["workflow_type"],
+                "status": workflow["status"],
+                "host": jobs[0].get("limit") if jobs else None,
+                "release": release,
+                "started": started,
+                "finished": finished,
+                "duration_seconds": (
+                    (finished - started).total_seconds() if started and finished else None
+                ),
+                "failed": workflow["failed"],
+                "automation_failure": workflow["automation_failure"],
+                "job_count": len(jobs),
+                "exported_at": exported_at,
+            }
+        ],
+        "jobs": [],
+        "failed_tasks": [],
+    }
+    for job in jobs:
+        extra_vars = job.get("extra_vars") or {}
+        rows["jobs"].append(
+            {
+                "id": job["id"],
+                "workflow_id": workflow["id"],
+                "workflow_type": workflow["workflow_type"],
+                "name": job["name"],
+                "stage": (
+                    extra_vars.get("sub_workflow") if isinstance(extra_vars, dict) else None
+                ),
+                "release": job["name"].split("_")[-1],
+                "host": job.get("limit"),
+                "status": job.get("status"),
+                "failed": job.get("failed"),
+                "created": _ts(job.get("created")),
+                "started": _ts(job.get("started")),
+                "finished": _ts(job.get("finished")),
+                "elapsed": job.get("elapsed"),
+                "timeout": job.get("timeout"),
+                "timed_out": job.get("timed_out"),
+                "exported_at": exported_at,
+            }
+        )
+        for task in job.get("failed_tasks", []):
+            event_data = task.get("event_data") or {}
+            res = event_data.get("res") or {}
+            rows["failed_tasks"].append(
+                {
+                    "id": task["id"],
+                    "job_id": job["id"],
+                    "workflow_id": workflow["id"],
+                    "task": task.get("task"),
+                    "role": task.get("role"),
+                    "event": task.get("event"),
+                    "created": _ts(task.get("created")),
+                    "host": event_data.get("host"),
+                    "message": _text(res.get("msg") if isinstance(res, dict) else res),
+                    "cluster_id": task.get("cluster_id"),
+                    "exported_at": exported_at,
+                }
+            )
+    return rows
+
+
+class AnalyticsExport:
+    """Appends changed workflows to Parquet tables for offline analysis.
+
+    Three tables, `workflows`, `jobs` and `failed_tasks`, live under
+    `directory`, each partitioned as region=<region>/month=<YYYY-MM> by the
+    month the workflow started. Every flush() adds one file per touched
+    partition, so a workflow updated over several cycles has one row per
+    version; `exported_at` tells them apart. Once a partition has
+    `compact_files` files they are merged into one holding only the latest
+    row of each id.
+    """
+
+    TABLES = ("workflows", "jobs", "failed_tasks")
+
+    def __init__(self, directory, compact_files=16):
+        self.directory = directory
+        self.compact_files = compact_files
+        self._rows = {}
+        os.makedirs(directory, exist_ok=True)
+
+    def append(self, workflows):
+        exported_at = datetime.now(timezone.utc)
+        for workflow in workflows:
+            started = _ts(workflow["started"])
+            month = started.strftime("%Y-%m") if started else "unknown"
+            partition = self._rows.setdefault(
+                (workflow["region"], month), {t: [] for t in self.TABLES}
+            )
+            for table, rows in flatten(workflow, exported_at).items():
+                partition[table].extend(rows)
+
+    def _partition_dir(self, table, region, month):
+        return os.path.join(self.directory, table, f"region={region}", f"month={month}")
+
+    def flush(self):
+        """Writes the appended rows and compacts the partitions that grew."""
+        if not self._rows:
+            return
+
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        schemas = _schemas()
+        stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%f")
+        with span("analytics.flush", partitions=len(self._rows)):
+            for (region, month), tables in self._rows.items():
+                for table, rows in tables.items():
+                    if not rows:
+                        continue
+                    directory = self._partition_dir(table, region, month)
+                    os.makedirs(directory, exist_ok=True)
+                    path = os.path.join(directory, f"part-{stamp}.parquet")
+                    pq.write_table(
+                        pa.Table.from_pylist(rows, schema=schemas[table]),
+                        f"{path}.tmp",
+                        compression="zstd",
+                    )
+                    os.replace(f"{path}.tmp", path)
+                    if len(glob.glob(os.path.join(directory, "*.parquet"))) >= self.compact_files:
+                        self.compact(table, region, month)
+        logger.info(f"Exported workflows of {len(self._rows)} partitions to {self.directory}")
+        self._rows = {}
+
+    def compact(self, table, region, month):
+        """Merges a partition's files, keeping the latest row of each id."""
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        directory = self._partition_dir(table, region, month)
+        paths = sorted(glob.glob(os.path.join(directory, "*.parquet")))
+        if len(paths) < 2:
+            return
+        with span("analytics.compact", table=table, region=region, month=month, files=len(paths)):
+            merged = pa.concat_tables(pq.read_table(path) for path in paths)
+            latest = {}
+            for index, (row_id, exported_at) in enumerate(
+                zip(merged.column("id").to_pylist(), merged.column("exported_at").to_pylist())
+            ):
+                if row_id not in latest or exported_at >= latest[row_id][1]:
+                    latest[row_id] = (index, exported_at)
+            keep = sorted(index for index, _ in latest.values())
+            compacted = merged.take(pa.array(keep, type=pa.int64()))
+
+            stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%f")
+            path = os.path.join(directory, f"compacted-{stamp}.parquet")
+            pq.write_table(compacted, f"{path}.tmp", compression="zstd")
+            os.replace(f"{path}.tmp", path)
+            for old in paths:
+                os.remove(old)
+        logger.info(
+            f"Compacted {len(paths)} files of {table}/{region}/{month} "
+            f"into {compacted.num_rows} rows"
+        )
@@ -0,0 +1,89 @@
+import json
+import os
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+
+class FetchCheckpoint:
+    """On-disk progress of one region's job listing.
+
+    After every page the filtered jobs of that page are appended to
+    `<region>.jobs.ndjson` and `<region>.json` is atomically replaced with the
+    cursor of the next page. A fetch that dies part way through resumes from
+    the last committed page, as long as it is asked for the same listing.
+    """
+
+    def __init__(self, directory, region):
+        self.directory = directory
+        self.region = region
+        self._state_path = os.path.join(directory, f"{region}.json")
+        self._jobs_path = os.path.join(directory, f"{region}.jobs.ndjson")
+        self._first_url = None
+        os.makedirs(directory, exist_ok=True)
+
+    def resume(self, first_url):
+        """Returns (jobs, next url, page) to continue from.
+
+        Starts over from first_url when there is no checkpoint or it belongs
+        to a different listing.
+        """
+        try:
+            with open(self._state_path, "r", encoding="utf-8") as f:
+                state = json.load(f)
+        except (FileNotFoundError, ValueError):
+            state = None
+
+        self._first_url = first_url
+        if not state or state["first_url"] != first_url:
+            self.clear()
+            self._write_state({"first_url": first_url, "next_url": first_url, "page": 0})
+            return [], first_url, 0
+
+        # A page may have been appended without its cursor being committed
+        jobs = {}
+        with open(self._jobs_path, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    job = json.loads(line)
+                    jobs[job["id"]] = job
+        logger.info(
+            f"Resuming {self.region} fetch at page {state['page'] + 1} "
+            f"with {len(jobs)} jobs already fetched"
+        )
+        return list(jobs.values()), state["next_url"], state["page"]
+
+    def commit(self, jobs, next_url, page):
+        """Records a fetched page and the cursor of the page after it."""
+        with open(self._jobs_path, "a", encoding="utf-8") as f:
+            for job in jobs:
+                f.write(json.dumps(job) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self._write_state({"first_url": self._first_url, "next_url": next_url, "page": page})
+
+    def clear(self):
+        for path in (self._state_path, self._jobs_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def _write_state(self, state):
+        tmp_path = f"{self._state_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self._state_path)
+        if not os.path.exists(self._jobs_path):
+            open(self._jobs_path, "a").close()
+
+
+class NoCheckpoint:
+    """Keeps no progress; every fetch starts from its first page."""
+
+    def resume(self, first_url):
+        return [], first_url, 0
+
+    def commit(self, jobs, next_url, page):
+        pass
+
+    def clear(self):
+        pass
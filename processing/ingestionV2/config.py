@@ -1,4 +1,5 @@
 import os
+import socket
 from dotenv import load_dotenv
 
 
@@ -28,5 +29,71 @@ class Config:
 
         self.es_url = os.getenv("ELASTICSEARCH_URL")
         self.es_index = os.getenv("ELASTICSEARCH_INDEX", "rhel_upgrade_reporting")
+        self.es_request_timeout = float(os.getenv("ES_REQUEST_TIMEOUT", "30"))
+        # Store jobs and failed tasks in their own indices, referenced by id
+        self.es_split_jobs = os.getenv("ES_SPLIT_JOBS", "false").lower() == "true"
+        self.es_jobs_index = os.getenv("ELASTICSEARCH_JOBS_INDEX", f"{self.es_index}_jobs")
+        self.es_failed_tasks_index = os.getenv(
+            "ELASTICSEARCH_FAILED_TASKS_INDEX", f"{self.es_index}_failed_tasks"
+        )
+        # Keep one document per host (keyed by limit) with its latest state
+        self.es_host_state = os.getenv("ES_HOST_STATE", "false").lower() == "true"
+        self.es_hosts_index = os.getenv("ELASTICSEARCH_HOSTS_INDEX", f"{self.es_index}_hosts")
+        # Keep mergeable duration sketches per region, workflow, job, release and day
+        self.es_duration_sketches = (
+            os.getenv("ES_DURATION_SKETCHES", "false").lower() == "true"
+        )
+        self.es_sketches_index = os.getenv(
+            "ELASTICSEARCH_SKETCHES_INDEX", f"{self.es_index}_duration_sketches"
+        )
+        self.es_async_writes = os.getenv("ES_ASYNC_WRITES", "false").lower() == "true"
+        self.es_max_inflight_writes = int(os.getenv("ES_MAX_INFLIGHT_WRITES", "2"))
+
+        # Where processed workflows go: elasticsearch, ndjson or parquet
+        self.output_sink = os.getenv("OUTPUT_SINK", "elasticsearch").lower()
+        self.output_dir = os.getenv("OUTPUT_DIR", "output")
+        self.output_compression = os.getenv("OUTPUT_COMPRESSION", "gzip").lower()
+
+        # Poll each region on its own schedule instead of every RUN_INTERVAL
+        self.adaptive_polling = os.getenv("ADAPTIVE_POLLING", "false").lower() == "true"
+        self.min_poll_interval = int(os.getenv("MIN_POLL_INTERVAL", "60"))
+        self.max_poll_interval = int(os.getenv("MAX_POLL_INTERVAL", "14400"))
+        self.target_jobs_per_poll = int(os.getenv("TARGET_JOBS_PER_POLL", "50"))
+
+        # Share regions between several workers: none, elasticsearch or file
+        self.lease_store = os.getenv("LEASE_STORE", "none").lower()
+        self.lease_index = os.getenv("LEASE_INDEX", f"{self.es_index}_leases")
+        self.lease_dir = os.getenv("LEASE_DIR", "leases")
+        self.lease_ttl = int(os.getenv("LEASE_TTL", "900"))
+        self.worker_id = os.getenv("WORKER_ID") or f"{socket.gethostname()}-{os.getpid()}"
 
         self.aap_page_size = int(os.getenv("AAP_PAGE_SIZE", "200"))
+        self.aap_events_page_size = int(os.getenv("AAP_EVENTS_PAGE_SIZE", "50"))
+        # Connect and read timeouts of every AAP request, in seconds
+        self.aap_connect_timeout = float(os.getenv("AAP_CONNECT_TIMEOUT", "10"))
+        self.aap_read_timeout = float(os.getenv("AAP_READ_TIMEOUT", "60"))
+        self.aap_breaker_failures = int(os.getenv("AAP_BREAKER_FAILURES", "5"))
+        self.aap_breaker_reset = int(os.getenv("AAP_BREAKER_RESET", "120"))
+        self.aap_hedge_requests = os.getenv("AAP_HEDGE_REQUESTS", "false").lower() == "true"
+        # Commit fetch progress here after every page, empty to disable
+        self.fetch_checkpoint_dir = os.getenv("FETCH_CHECKPOINT_DIR", "")
+
+        # Append changed workflows to partitioned Parquet tables here, empty to disable
+        self.analytics_dir = os.getenv("ANALYTICS_DIR", "")
+        self.analytics_compact_files = int(os.getenv("ANALYTICS_COMPACT_FILES", "16"))
+
+        # Keep the failure clustering state here, empty to disable clustering
+        self.failure_cluster_dir = os.getenv("FAILURE_CLUSTER_DIR", "")
+
+        # Port receiving AAP job notifications, 0 to rely on polling alone
+        self.webhook_port = int(os.getenv("WEBHOOK_PORT", "0"))
+        self.webhook_token = os.getenv("WEBHOOK_TOKEN", "")
+        # Polling interval of the reconciliation sweep when notifications are on
+        self.reconcile_interval = int(os.getenv("RECONCILE_INTERVAL", "3600"))
+
+        # Port of the Prometheus /metrics endpoint, 0 to disable
+        self.metrics_port = int(os.getenv("METRICS_PORT", "9108"))
+
+        # Write a span trace of every cycle here, empty to disable
+        self.trace_dir = os.getenv("TRACE_DIR", "")
+        self.profile_next_cycle = os.getenv("PROFILE_NEXT_CYCLE", "false").lower() == "true"
@@ -1,36 +1,145 @@
-from elasticsearch import Elasticsearch, helpers
+import asyncio
+import threading
+from collections import OrderedDict
+from elasticsearch import AsyncElasticsearch, Elasticsearch, helpers
 from datetime import datetime, timezone
+from analytics_export import AnalyticsExport
+from host_state import host_state_action
 from logger import get_logger
+from metrics import RETRIES, record_bulk
+from sketches import DurationSketcher
+from tracing import span
+from sinks import create_sink, raise_for_bulk_errors
 from utils import retry_with_backoff
 
 logger = get_logger(__name__)
 
 
+def _doc_id(region, aap_id):
+    """Document id of a job or job event, whose AAP id is only unique per tower."""
+    return f"{region}-{aap_id}"
+
+
 class ElasticsearchClient:
+    _DEFAULT_START_TIME = datetime(2024, 2, 1, 6, 0, 0, tzinfo=timezone.utc)
+
+    # How many written job ids to remember so unchanged jobs are not resent
+    _WRITTEN_JOBS_CACHE_SIZE = 200000
+
     def __init__(self, config):
         self.config = config
-        self.es = Elasticsearch([config.es_url])
+        # Without a cluster (file sink dry runs) every region starts from the
+        # default start time.
+        self.es = (
+            Elasticsearch([config.es_url], request_timeout=config.es_request_timeout)
+            if config.es_url
+            else None
+        )
         self.index = config.es_index
+        self.sink = create_sink(config, self.es)
+        self._written_job_ids = OrderedDict()
+        self.sketcher = (
+            DurationSketcher(config.es_sketches_index, self.es)
+            if config.es_duration_sketches
+            else None
+        )
+        self.analytics = (
+            AnalyticsExport(config.analytics_dir, config.analytics_compact_files)
+            if config.analytics_dir
+            else None
+        )
 
     @retry_with_backoff(max_retries=3, backoff_in_seconds=1)
     def get_last_processed_time(self, region):
-        query = {
+        if self.es is None:
+            return self._DEFAULT_START_TIME
+
+        result = self.es.search(index=self.index, body=self._last_processed_query(region))
+        return self._parse_last_processed(result)
+
+    @retry_with_backoff(max_retries=3, backoff_in_seconds=1)
+    def get_last_processed_times(self, regions):
+        """Returns the last processed time of every region.
+
+        All regions are planned with a single _msearch round-trip instead of
+        one search per region.
+        """
+        if self.es is None:
+            return {region: self._DEFAULT_START_TIME for region in regions}
+
+        searches = []
+        for region in regions:
+            searches.append({"index": self.index})
+            searches.append(self._last_processed_query(region))
+
+        result = self.es.msearch(searches=searches)
+
+        last_processed_times = {}
+        for region, response in zip(regions, result["responses"]):
+            if "error" in response:
+                raise RuntimeError(
+                    f"Planning search failed for region {region}: {response['error']}"
+                )
+            last_processed_times[region] = self._parse_last_processed(response)
+        return last_processed_times
+
+    def _last_processed_query(self, region):
+        return {
             "size": 1,
             "sort": [{"finished": {"order": "desc"}}],
             "query": {"match": {"region": region}},
         }
 
-        result = self.es.search(index=self.index, body=query)
-
+    def _parse_last_processed(self, result):
         if result["hits"]["hits"]:
             return datetime.fromisoformat(
                 result["hits"]["hits"][0]["_source"]["finished"]
             )
         else:
-            return datetime(2024, 2, 1, 6, 0, 0, tzinfo=timezone.utc)
+            return self._DEFAULT_START_TIME
 
-    @retry_with_backoff(max_retries=3, backoff_in_seconds=1)
-    def update_workflows(self, workflows):
+    def update_workflows(self, workflows, sketch=True):
+        """Writes workflows to the sink.
+
+        With sketch=False their durations are left out of the sketches, for
+        writes that are not in `finished` order (see DurationSketcher).
+        """
+        actions = self._build_actions(workflows, sketch)
+
+        if actions:
+            self.sink.write(actions)
+            self._remember_written_jobs(actions)
+            logger.info(f"Updated {len(workflows)} workflows")
+        if self.analytics is not None:
+            self.analytics.append(workflows)
+
+    def flush(self):
+        self.sink.flush()
+        if self.analytics is not None:
+            self.analytics.flush()
+
+    def close(self):
+        self.sink.close()
+        if self.es is not None:
+            self.es.close()
+
+    def _build_actions(self, workflows, sketch=True):
+        if self.config.es_split_jobs:
+            actions = self._build_split_actions(workflows)
+        else:
+            actions = self._build_workflow_actions(workflows)
+
+        if self.config.es_host_state:
+            actions.extend(
+                host_state_action(workflow, self.config.es_hosts_index)
+                for workflow in workflows
+                if workflow["jobs"]
+            )
+        if sketch and self.sketcher is not None:
+            actions.extend(self.sketcher.actions(workflows))
+        return actions
+
+    def _build_workflow_actions(self, workflows):
         actions = []
         for workflow in workflows:
             action = {
@@ -41,7 +150,185 @@ class ElasticsearchClient:
                 "doc_as_upsert": True,
             }
             actions.append(action)
+        return actions
 
-        if actions:
-            helpers.bulk(self.es, actions)
-            logger.info(f"Updated {len(actions)} workflows in Elasticsearch")
+    def _build_split_actions(self, workflows):
+        """Builds actions for the split index layout.
+
+        Finished jobs and their failed tasks never change, so they are created
+        once in their own indices. AAP ids are only unique within one tower
+        and every region shares those indices, so they are keyed by region
+        and AAP id (see _doc_id). The workflow document only carries its
+        summary fields and the keys of its jobs, which keeps updates to
+        in-progress workflows small.
+        """
+        actions = []
+        for workflow in workflows:
+            region = workflow["region"]
+            summary = {k: v for k, v in workflow.items() if k != "jobs"}
+            summary["job_ids"] = [_doc_id(region, job["id"]) for job in workflow["jobs"]]
+            actions.append(
+                {
+                    "_op_type": "update",
+                    "_index": self.index,
+                    "_id": workflow["id"],
+                    "doc": summary,
+                    "doc_as_upsert": True,
+                }
+            )
+
+            for job in workflow["jobs"]:
+                job_id = _doc_id(region, job["id"])
+                if job_id in self._written_job_ids:
+                    continue
+
+                failed_tasks = job.get("failed_tasks", [])
+                job_doc = {k: v for k, v in job.items() if k != "failed_tasks"}
+                job_doc["workflow_id"] = workflow["id"]
+                job_doc["failed_task_ids"] = [
+                    _doc_id(region, task["id"]) for task in failed_tasks
+                ]
+                actions.append(
+                    {
+                        "_op_type": "create",
+                        "_index": self.config.es_jobs_index,
+                        "_id": job_id,
+                        "_source": job_doc,
+                    }
+                )
+
+                for task in failed_tasks:
+                    actions.append(
+                        {
+                            "_op_type": "create",
+                            "_index": self.config.es_failed_tasks_index,
+                            "_id": _doc_id(region, task["id"]),
+                            "_source": dict(task, workflow_id=workflow["id"]),
+                        }
+                    )
+        return actions
+
+    def _remember_written_jobs(self, actions):
+        for action in actions:
+            if action["_index"] == self.config.es_jobs_index:
+                self._written_job_ids[action["_id"]] = True
+        while len(self._written_job_ids) > self._WRITTEN_JOBS_CACHE_SIZE:
+            self._written_job_ids.popitem(last=False)
+        if self.sketcher is not None:
+            self.sketcher.remember(actions)
+
+
+class AsyncElasticsearchClient(ElasticsearchClient):
+    """Elasticsearch client whose bulk writes run in the background.
+
+    update_workflows() hands the bulk request to an AsyncElasticsearch client
+    running on its own event loop thread and returns immediately, so AAP
+    fetching for the next region overlaps with the write. At most
+    `es_max_inflight_writes` bulk requests run at once; a further call blocks
+    until one of them completes. flush() waits for every outstanding write.
+
+    Reads still go through the synchronous client.
+    """
+
+    def __init__(self, config):
+        super().__init__(config)
+        self.max_retries = 3
+        self.backoff_in_seconds = 1
+        self._slots = threading.BoundedSemaphore(config.es_max_inflight_writes)
+        self._pending = set()
+        self._errors = []
+        self._lock = threading.Lock()
+
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(
+            target=self._loop.run_forever, name="es-bulk-writer", daemon=True
+        )
+        self._thread.start()
+        self.async_es = self._run(self._create_client()).result()
+
+    async def _create_client(self):
+        return AsyncElasticsearch(
+            [self.config.es_url], request_timeout=self.config.es_request_timeout
+        )
+
+    def _run(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self._loop)
+
+    def update_workflows(self, workflows, sketch=True):
+        actions = self._build_actions(workflows, sketch)
+        if not actions:
+            return
+
+        self._slots.acquire()
+        future = self._run(self._bulk(actions))
+        with self._lock:
+            self._pending.add(future)
+        future.add_done_callback(self._on_write_done)
+        if self.analytics is not None:
+            self.analytics.append(workflows)
+
+    async def _bulk(self, actions):
+        retries = 0
+        while True:
+            try:
+                with span("es.async_bulk", actions=len(actions), attempt=retries + 1):
+                    success, errors = await helpers.async_bulk(
+                        self.async_es, actions, raise_on_error=False
+                    )
+                success += raise_for_bulk_errors(errors)
+                record_bulk(success=success)
+                self._remember_written_jobs(actions)
+                logger.info(f"Wrote {success} documents to Elasticsearch")
+                return success
+            except Exception as e:
+                if retries >= self.max_retries:
+                    raise
+                wait_time = self.backoff_in_seconds * (2**retries)
+                logger.warning(
+                    f"Error in async bulk write, retrying in {wait_time} seconds... Error: {str(e)}"
+                )
+                RETRIES.labels(function="async_bulk").inc()
+                await asyncio.sleep(wait_time)
+                retries += 1
+
+    def _on_write_done(self, future):
+        with self._lock:
+            self._pending.discard(future)
+            if future.cancelled():
+                # The loop shut down before the write ran; its documents are lost
+                self._errors.append(RuntimeError("Bulk write was cancelled"))
+            elif future.exception() is not None:
+                self._errors.append(future.exception())
+        self._slots.release()
+
+    def flush(self):
+        """Blocks until every scheduled bulk write has finished.
+
+        Raises the first error seen since the previous flush, if any.
+        """
+        while True:
+            with self._lock:
+                pending = list(self._pending)
+            if not pending:
+                break
+            for future in pending:
+                try:
+                    future.result()
+                except Exception:
+                    pass  # collected by _on_write_done
+
+        with self._lock:
+            errors, self._errors = self._errors, []
+        if errors:
+            raise errors[0]
+        if self.analytics is not None:
+            self.analytics.flush()
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            self._run(self.async_es.close()).result()
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+            super().close()
@@ -0,0 +1,204 @@
+import hashlib
+import json
+import os
+import random
+import re
+from datetime import datetime, timedelta, timezone
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+_ANSI = re.compile(r"\x1b\[[0-9;]*[A-Za-z]")
+_UUID = re.compile(r"\b[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}\b")
+_IP = re.compile(r"\b\d{1,3}(?:\.\d{1,3}){3}(?::\d+)?\b")
+_HEX = re.compile(r"\b(?:0x)?[0-9a-f]{8,}\b")
+_NUMBER = re.compile(r"\d+")
+_TOKEN = re.compile(r"[a-z_<>#]+|[^\sa-z_<>#]")
+
+# Messages are cut to this many characters before shingling
+_MAX_MESSAGE = 2000
+
+
+def failure_message(task):
+    """The text a failed task is clustered on: its task name and result message."""
+    event_data = task.get("event_data") or {}
+    res = event_data.get("res") or {}
+    message = res.get("msg") or res.get("stderr") or res.get("stdout")
+    if not message:
+        message = task.get("stdout") or ""
+    if not isinstance(message, str):
+        message = json.dumps(message, sort_keys=True)
+    return f"{task.get('task') or ''}: {message}", event_data.get("host")
+
+
+def normalize(message, host=None):
+    """Lower-cases a message and masks the parts that differ between hosts."""
+    message = _ANSI.sub("", message)[:_MAX_MESSAGE].lower()
+    if host:
+        message = message.replace(host.lower(), "<host>")
+    message = _UUID.sub("<uuid>", message)
+    message = _IP.sub("<ip>", message)
+    message = _HEX.sub("<hex>", message)
+    message = _NUMBER.sub("#", message)
+    return " ".join(message.split())
+
+
+def shingles(message, size=3):
+    tokens = _TOKEN.findall(message)
+    if len(tokens) <= size:
+        return {" ".join(tokens)}
+    return {" ".join(tokens[i : i + size]) for i in range(len(tokens) - size + 1)}
+
+
+def _today():
+    return datetime.now(timezone.utc).date().isoformat()
+
+
+def _hash64(text):
+    return int.from_bytes(hashlib.blake2b(text.encode(), digest_size=8).digest(), "big")
+
+
+class FailureClusters:
+    """Assigns cluster ids to failed tasks with MinHash LSH.
+
+    Each normalized message becomes a MinHash signature of its word
+    shingles, split into `bands` bands of `rows` values. Two messages that
+    share any band land in the same cluster, which happens with high
+    probability once their shingle sets are more similar than roughly
+    (1/bands)^(1/rows) (0.5 with the defaults). Looking up a message costs one
+    dictionary probe per band, so clustering a night of failures is linear in
+    its size instead of comparing every pair.
+
+    Band buckets, the messages already seen and each cluster's example
+    message are kept in `clusters.json` under `directory` and carried over
+    between cycles. A new cluster takes its id
+    from its first message's signature, so workers with separate state files
+    name the same failure alike. Clusters not seen for `max_age_days` are
+    dropped together with their buckets, and at most `max_known` message
+    digests are kept, the most recently seen first.
+    """
+
+    _MERSENNE = (1 << 61) - 1
+
+    def __init__(self, directory, bands=16, rows=4, max_age_days=90, max_known=100000):
+        self.directory = directory
+        self.bands = bands
+        self.rows = rows
+        self.max_age_days = max_age_days
+        self.max_known = max_known
+        self._path = os.path.join(directory, "clusters.json")
+        rng = random.Random(42)
+        self._permutations = [
+            (rng.randrange(1, self._MERSENNE), rng.randrange(0, self._MERSENNE))
+            for _ in range(bands * rows)
+        ]
+        self.buckets = {}
+        self.clusters = {}
+        # Digests of normalized messages already seen skip the MinHash step,
+        # mapped to [cluster id, day last seen]
+        self.known = {}
+        self._changed = False
+        os.makedirs(directory, exist_ok=True)
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self._path, "r", encoding="utf-8") as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            return
+        if state.get("bands") != self.bands or state.get("rows") != self.rows:
+            logger.warning("Failure cluster state uses other LSH parameters; starting over")
+            return
+        self.buckets = state["buckets"]
+        self.clusters = state["clusters"]
+        self.known = state["known"]
+        # State written before clusters were aged out has no last-seen days
+        today = _today()
+        for cluster in self.clusters.values():
+            cluster.setdefault("last_seen", today)
+        for digest, entry in self.known.items():
+            if isinstance(entry, str):
+                self.known[digest] = [entry, today]
+        logger.info(f"Loaded {len(self.clusters)} failure clusters")
+
+    def _prune(self):
+        cutoff = (
+            datetime.now(timezone.utc).date() - timedelta(days=self.max_age_days)
+        ).isoformat()
+        stale = {cid for cid, c in self.clusters.items() if c["last_seen"] < cutoff}
+        if stale:
+            self.clusters = {cid: c for cid, c in self.clusters.items() if cid not in stale}
+            self.buckets = {k: cid for k, cid in self.buckets.items() if cid not in stale}
+            logger.info(f"Dropped {len(stale)} failure clusters not seen since {cutoff}")
+        known = [(d, e) for d, e in self.known.items() if e[0] not in stale]
+        if len(known) > self.max_known:
+            known.sort(key=lambda item: item[1][1], reverse=True)
+            known = known[: self.max_known]
+        self.known = dict(known)
+
+    def save(self):
+        """Writes the state if anything changed since it was loaded or saved."""
+        if not self._changed:
+            return
+        self._prune()
+        tmp_path = f"{self._path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "bands": self.bands,
+                    "rows": self.rows,
+                    "buckets": self.buckets,
+                    "clusters": self.clusters,
+                    "known": self.known,
+                },
+                f,
+            )
+        os.replace(tmp_path, self._path)
+        self._changed = False
+
+    def signature(self, message):
+        hashes = [_hash64(shingle) for shingle in shingles(message)]
+        return [
+            min((a * h + b) % self._MERSENNE for h in hashes)
+            for a, b in self._permutations
+        ]
+
+    def _band_keys(self, signature):
+        keys = []
+        for band in range(self.bands):
+            rows = signature[band * self.rows : (band + 1) * self.rows]
+            digest = hashlib.blake2b(
+                ",".join(map(str, rows)).encode(), digest_size=8
+            ).hexdigest()
+            keys.append(f"{band}:{digest}")
+        return keys
+
+    def assign(self, task):
+        """Returns the cluster id of a failed task, creating a cluster if needed."""
+        message = normalize(*failure_message(task))
+        digest = hashlib.blake2b(message.encode(), digest_size=8).hexdigest()
+        today = _today()
+        if digest in self.known:
+            cluster_id = self.known[digest][0]
+            # Last-seen days only move once a day, so repeats leave nothing to save
+            if self.known[digest][1] != today:
+                self.known[digest][1] = today
+                self.clusters[cluster_id]["last_seen"] = today
+                self._changed = True
+        else:
+            keys = self._band_keys(self.signature(message))
+            matches = {self.buckets[key] for key in keys if key in self.buckets}
+            if matches:
+                # Prefer the largest cluster when a message bridges several
+                cluster_id = max(matches, key=lambda c: (self.clusters[c]["messages"], c))
+            else:
+                cluster_id = keys[0].split(":", 1)[1]
+                self.clusters[cluster_id] = {"example": message, "messages": 0}
+            for key in keys:
+                self.buckets.setdefault(key, cluster_id)
+            self.known[digest] = [cluster_id, today]
+            self.clusters[cluster_id]["messages"] += 1
+            self.clusters[cluster_id]["last_seen"] = today
+            self._changed = True
+        return cluster_id
@@ -0,0 +1,107 @@
+from datetime import datetime, timezone
+
+# Folds one workflow into its host's document. Workflows are remembered by id
+# so re-sending an updated in-progress workflow does not count a new attempt,
+# and "latest" comparisons use the ISO timestamps, which sort as strings.
+_UPDATE_SCRIPT = """
+def s = ctx._source;
+def w = params.workflow;
+if (s.host == null) {
+  s.host = params.host;
+  s.latest = [:];
+  s.attempts = [:];
+  s.workflow_ids = [];
+}
+s.region = params.region;
+s.updated = params.now;
+
+if (!s.workflow_ids.contains(w.id)) {
+  s.workflow_ids.add(w.id);
+  def count = s.attempts.containsKey(w.workflow_type) ? s.attempts[w.workflow_type] : 0;
+  s.attempts[w.workflow_type] = count + 1;
+  s.attempt_count = s.workflow_ids.size();
+}
+
+def latest = s.latest[w.workflow_type];
+if (latest == null || latest.id == w.id || latest.started.compareTo(w.started) <= 0) {
+  s.latest[w.workflow_type] = w;
+}
+
+if (s.current == null || s.current.id == w.id || s.current.started.compareTo(w.started) <= 0) {
+  s.current = w;
+}
+
+if (w.failed && (s.last_failure == null || s.last_failure.id == w.id
+    || s.last_failure.started.compareTo(w.started) <= 0)) {
+  s.last_failure = w;
+}
+
+if (w.target_version != null && w.status == 'completed' && !w.failed
+    && (s.upgraded == null || s.upgraded.started.compareTo(w.started) <= 0)) {
+  s.upgraded = w;
+  s.rhel_major = w.target_version;
+}
+"""
+
+
+def _iso(value):
+    if value is None:
+        return None
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc).isoformat()
+
+
+def workflow_summary(workflow):
+    """The per-workflow fields kept on a host document."""
+    jobs = workflow["jobs"]
+    last_job = jobs[-1] if jobs else {}
+    failed_task = None
+    for job in jobs:
+        for task in job.get("failed_tasks", []):
+            failed_task = task["task"]
+            break
+        if failed_task:
+            break
+
+    workflow_type = workflow["workflow_type"]
+    target_version = None
+    if workflow_type.startswith("upgrade_"):
+        target_version = workflow_type.rsplit("_", 1)[-1]
+
+    return {
+        "id": workflow["id"],
+        "workflow_type": workflow_type,
+        "status": workflow["status"],
+        "stage": last_job.get("extra_vars", {}).get("sub_workflow"),
+        "started": _iso(workflow["started"]),
+        "finished": _iso(workflow["finished"]),
+        "failed": workflow["failed"],
+        "automation_failure": workflow["automation_failure"],
+        "failed_task": failed_task,
+        "target_version": target_version,
+    }
+
+
+def host_state_action(workflow, index):
+    """Bulk action updating the host document of the workflow's limit."""
+    host = workflow["jobs"][0]["limit"]
+    return {
+        "_op_type": "update",
+        "_index": index,
+        "_id": host,
+        "scripted_upsert": True,
+        "upsert": {},
+        "script": {
+            "source": _UPDATE_SCRIPT,
+            "lang": "painless",
+            "params": {
+                "host": host,
+                "region": workflow["region"],
+                "now": datetime.now(timezone.utc).isoformat(),
+                "workflow": workflow_summary(workflow),
+            },
+        },
+    }
@@ -0,0 +1,285 @@
+import fcntl
+import json
+import math
+import os
+import time
+from contextlib import contextmanager
+from elasticsearch import ConflictError, NotFoundError
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+
+class LeaseLostError(Exception):
+    """Raised when another worker has taken over a region mid-run."""
+
+
+class ElasticsearchLeaseStore:
+    """Leases stored as documents, guarded by optimistic concurrency control.
+
+    Expiry uses each worker's wall clock, so nodes must keep their clocks in
+    sync to well within the lease TTL.
+    """
+
+    _MAPPINGS = {
+        "properties": {
+            "kind": {"type": "keyword"},
+            "name": {"type": "keyword"},
+            "owner": {"type": "keyword"},
+            "expires": {"type": "double"},
+        }
+    }
+
+    def __init__(self, es, index):
+        self.es = es
+        self.index = index
+        if not self.es.indices.exists(index=index):
+            try:
+                self.es.indices.create(index=index, mappings=self._MAPPINGS)
+            except Exception as e:
+                # Another worker created it first
+                if not self.es.indices.exists(index=index):
+                    raise e
+
+    def acquire(self, kind, name, owner, ttl):
+        """Takes or renews a lease. Returns False if someone else holds it."""
+        doc_id = f"{kind}:{name}"
+        now = time.time()
+        document = {"kind": kind, "name": name, "owner": owner, "expires": now + ttl}
+        try:
+            current = self.es.get(index=self.index, id=doc_id)
+        except NotFoundError:
+            try:
+                self.es.create(index=self.index, id=doc_id, document=document, refresh=True)
+                return True
+            except ConflictError:
+                return False
+
+        lease = current["_source"]
+        if lease["owner"] != owner and lease["expires"] > now:
+            return False
+        try:
+            self.es.index(
+                index=self.index,
+                id=doc_id,
+                document=document,
+                if_seq_no=current["_seq_no"],
+                if_primary_term=current["_primary_term"],
+                refresh=True,
+            )
+            return True
+        except ConflictError:
+            return False
+
+    def release(self, kind, name, owner):
+        doc_id = f"{kind}:{name}"
+        try:
+            current = self.es.get(index=self.index, id=doc_id)
+            if current["_source"]["owner"] != owner:
+                return
+            self.es.delete(
+                index=self.index,
+                id=doc_id,
+                if_seq_no=current["_seq_no"],
+                if_primary_term=current["_primary_term"],
+                refresh=True,
+            )
+        except (ConflictError, NotFoundError):
+            pass
+
+    def live(self, kind):
+        """Returns {name: owner} of the unexpired leases of a kind."""
+        result = self.es.search(
+            index=self.index,
+            size=1000,
+            query={
+                "bool": {
+                    "filter": [
+                        {"term": {"kind": kind}},
+                        {"range": {"expires": {"gt": time.time()}}},
+                    ]
+                }
+            },
+        )
+        return {
+            hit["_source"]["name"]: hit["_source"]["owner"]
+            for hit in result["hits"]["hits"]
+        }
+
+
+class FileLeaseStore:
+    """Leases stored as JSON files, for running several workers on one host.
+
+    Every operation holds an exclusive lock on the directory's lock file.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._lock_path = os.path.join(directory, ".lock")
+
+    @contextmanager
+    def _locked(self):
+        with open(self._lock_path, "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _path(self, kind, name):
+        return os.path.join(self.directory, f"{kind}-{name}.json")
+
+    def _read(self, path):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def acquire(self, kind, name, owner, ttl):
+        path = self._path(kind, name)
+        with self._locked():
+            now = time.time()
+            lease = self._read(path)
+            if lease and lease["owner"] != owner and lease["expires"] > now:
+                return False
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"kind": kind, "name": name, "owner": owner, "expires": now + ttl}, f)
+            os.replace(tmp_path, path)
+            return True
+
+    def release(self, kind, name, owner):
+        path = self._path(kind, name)
+        with self._locked():
+            lease = self._read(path)
+            if lease and lease["owner"] == owner:
+                os.remove(path)
+
+    def live(self, kind):
+        leases = {}
+        with self._locked():
+            now = time.time()
+            for filename in os.listdir(self.directory):
+                if filename.startswith(f"{kind}-") and filename.endswith(".json"):
+                    lease = self._read(os.path.join(self.directory, filename))
+                    if lease and lease["expires"] > now:
+                        leases[lease["name"]] = lease["owner"]
+        return leases
+
+
+class RegionLeases:
+    """Splits regions between the live workers sharing a lease store.
+
+    A lease belongs to its owner until it expires; anyone may take over an
+    expired lease. Each call to claim() heartbeats this worker, renews the regions it holds
+    and takes free or expired regions until it owns its fair share (regions
+    divided by live workers, rounded up). A worker over its share releases
+    the extra regions so newly started workers can pick them up, and the
+    regions of a dead worker are taken over once its leases expire.
+
+    @Param: store - ElasticsearchLeaseStore or FileLeaseStore - Where leases live
+    @Param: regions - list - Every region to be ingested
+    @Param: worker_id - string - Unique id of this worker
+    @Param: ttl - int - Lease lifetime in seconds
+    """
+
+    def __init__(self, store, regions, worker_id, ttl, clock=time.monotonic):
+        self.store = store
+        self.regions = list(regions)
+        self.worker_id = worker_id
+        self.ttl = ttl
+        self.clock = clock
+        # Longest sleep that still renews leases well before they expire
+        self.heartbeat_interval = ttl / 3
+        self._renewed = {}
+
+    def claim(self):
+        """Returns the regions this worker owns for the coming cycle."""
+        self.store.acquire("worker", self.worker_id, self.worker_id, self.ttl)
+        workers = self.store.live("worker")
+        share = math.ceil(len(self.regions) / max(len(workers), 1))
+
+        holders = self.store.live("region")
+        owned = []
+        for region in self.regions:
+            if holders.get(region) == self.worker_id:
+                if len(owned) < share and self.renew(region):
+                    owned.append(region)
+                else:
+                    self.store.release("region", region, self.worker_id)
+                    logger.info(f"Released region {region} to rebalance")
+
+        for region in self.regions:
+            if len(owned) >= share:
+                break
+            if region not in holders and self.store.acquire(
+                "region", region, self.worker_id, self.ttl
+            ):
+                logger.info(f"Acquired region {region}")
+                self._renewed[region] = self.clock()
+                owned.append(region)
+
+        return owned
+
+    def renew(self, region):
+        """Extends a region lease; False means another worker took it over."""
+        renewed = self.store.acquire("region", region, self.worker_id, self.ttl)
+        if renewed:
+            self._renewed[region] = self.clock()
+        else:
+            logger.warning(f"Lost the lease for region {region}")
+        return renewed
+
+    def keep(self, region):
+        """Renews a region lease during its run once a heartbeat interval has passed.
+
+        Raises LeaseLostError if another worker took the region over, so the
+        run stops before writing anything.
+        """
+        if self.clock() - self._renewed.get(region, -math.inf) < self.heartbeat_interval:
+            return
+        if not self.renew(region):
+            raise LeaseLostError(f"Lost the lease for region {region}")
+
+    def release_all(self):
+        for region in self.regions:
+            self.store.release("region", region, self.worker_id)
+        self.store.release("worker", self.worker_id, self.worker_id)
+
+
+class AllRegions:
+    """Stand-in for RegionLeases when a single worker owns everything."""
+
+    heartbeat_interval = math.inf
+
+    def __init__(self, regions):
+        self.regions = list(regions)
+
+    def claim(self):
+        return list(self.regions)
+
+    def renew(self, region):
+        return True
+
+    def keep(self, region):
+        pass
+
+    def release_all(self):
+        pass
+
+
+def create_region_leases(config, es=None):
+    """Builds the lease manager selected by `LEASE_STORE`."""
+    if config.lease_store == "none":
+        return AllRegions(config.regions)
+    if config.lease_store == "elasticsearch":
+        if es is None:
+            raise ValueError("LEASE_STORE=elasticsearch needs ELASTICSEARCH_URL")
+        store = ElasticsearchLeaseStore(es, config.lease_index)
+    elif config.lease_store == "file":
+        store = FileLeaseStore(config.lease_dir)
+    else:
+        raise ValueError(f"Unknown LEASE_STORE: {config.lease_store}")
+    return RegionLeases(store, config.regions, config.worker_id, config.lease_ttl)
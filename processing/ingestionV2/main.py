@@ -1,47 +1,214 @@
+import signal
+import sys
 import time
+from datetime import datetime, timezone
 from config import Config
 from aap_client import AAPClient
-from elasticsearch_client import ElasticsearchClient
+from elasticsearch_client import AsyncElasticsearchClient, ElasticsearchClient
 from workflow_processor import WorkflowProcessor
+from leases import LeaseLostError, create_region_leases
 from logger import setup_logger
+from scheduler import create_scheduler
+from webhook import WebhookReceiver
+from resilience import CircuitOpenError
+from metrics import CYCLES, record_finished, record_workflows, stage, start_metrics_server
+import tracing
+from tracing import span
 
 logger = setup_logger()
 
 
+def process_region(
+    region, last_processed_time, aap_client, workflow_processor, es_client, keep_lease=lambda: None
+):
+    logger.info(f"Starting data collection for region: {region}")
+    record_finished(region, last_processed_time)
+
+    # Fetch new jobs from AAP
+    with span("fetch", region=region), stage("fetch", region):
+        new_jobs = aap_client.get_new_jobs(region, last_processed_time, keep_lease)
+
+    if not new_jobs:
+        logger.info(f"No new jobs found for region: {region}")
+        return new_jobs, []
+
+    # Process jobs into workflows
+    with span("process", region=region, jobs=len(new_jobs)), stage("process", region):
+        workflows = workflow_processor.process_jobs(new_jobs)
+    record_workflows(region, workflows)
+
+    # Don't write a region another worker took over during a long run
+    keep_lease()
+
+    # Write to the configured sink (returns immediately in async mode)
+    with span("write", region=region, workflows=len(workflows)), stage("write", region):
+        es_client.update_workflows(workflows)
+
+    logger.info(f"Completed processing for region: {region}")
+    return new_jobs, workflows
+
+
+def process_notifications(batch, owned, aap_client, workflow_processor, es_client):
+    """Ingests the workflows of notified jobs in the regions this worker owns.
+
+    A job that cannot be fetched, or a region whose notified workflows cannot
+    be written, is left to the next reconciliation sweep.
+    """
+    for region, job_ids in batch.items():
+        if region not in owned:
+            logger.info(f"Leaving {len(job_ids)} notified jobs of {region} to its owner")
+            continue
+        jobs = {}
+        for job_id in job_ids:
+            # Already fetched with an earlier job of the same workflow
+            if job_id in jobs:
+                continue
+            try:
+                with span("push", region=region, job_id=job_id), stage("push", region):
+                    for job in aap_client.get_workflow_jobs(region, job_id):
+                        jobs[job["id"]] = job
+            except Exception as e:
+                logger.warning(f"Could not fetch notified job {job_id} in {region}: {e}")
+
+        if jobs:
+            try:
+                workflows = workflow_processor.process_jobs(list(jobs.values()))
+                record_workflows(region, workflows)
+                # Sketched by the next sweep, which reads jobs in finished order
+                es_client.update_workflows(workflows, sketch=False)
+            except Exception as e:
+                logger.warning(f"Could not ingest notified jobs of {region}: {e}")
+    es_client.flush()
+
+
+def wait(seconds, owned, receiver, aap_client, workflow_processor, es_client):
+    """Sleeps, ingesting notified jobs as they arrive when webhooks are on."""
+    if receiver is None:
+        time.sleep(seconds)
+        return
+    deadline = time.monotonic() + seconds
+    while deadline > time.monotonic():
+        batch = receiver.take(deadline - time.monotonic())
+        if batch:
+            process_notifications(batch, owned, aap_client, workflow_processor, es_client)
+
+
 def main():
     config = Config()
+    start_metrics_server(config.metrics_port)
+    tracer = tracing.configure(config.trace_dir, config.profile_next_cycle)
     aap_client = AAPClient(config)
-    es_client = ElasticsearchClient(config)
+    if config.es_async_writes and config.output_sink == "elasticsearch":
+        es_client = AsyncElasticsearchClient(config)
+    else:
+        es_client = ElasticsearchClient(config)
     workflow_processor = WorkflowProcessor(config)
+    scheduler = create_scheduler(config)
+    leases = create_region_leases(config, es_client.es)
+    receiver = (
+        WebhookReceiver(config.webhook_port, config.regions, config.webhook_token)
+        if config.webhook_port
+        else None
+    )
 
-    while True:
-        try:
-            for region in config.regions:
-                logger.info(f"Starting data collection for region: {region}")
-
-                # Get the timestamp of the last processed job
-                last_processed_time = es_client.get_last_processed_time(region)
+    # Hand our regions over straight away when stopped
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    try:
+        run(
+            config,
+            aap_client,
+            es_client,
+            workflow_processor,
+            scheduler,
+            leases,
+            tracer,
+            receiver,
+        )
+    finally:
+        if receiver is not None:
+            receiver.close()
+        leases.release_all()
 
-                # Fetch new jobs from AAP
-                new_jobs = aap_client.get_new_jobs(region, last_processed_time)
 
-                if not new_jobs:
-                    logger.info(f"No new jobs found for region: {region}")
-                    continue
+def run(
+    config, aap_client, es_client, workflow_processor, scheduler, leases, tracer, receiver=None
+):
+    # Start of each region's last successful sweep. Pushed writes move the
+    # newest finished time in the index forward, so with webhooks on the
+    # sweep window starts from here instead, or jobs whose notification was
+    # lost could fall behind it.
+    swept_since = {}
+    while True:
+        owned, regions = [], []
+        try:
+            owned = leases.claim()
+            due = set(scheduler.due_regions())
+            regions = [region for region in owned if region in due]
+            if not regions:
+                wait(
+                    min(scheduler.sleep_time(owned), leases.heartbeat_interval),
+                    owned,
+                    receiver,
+                    aap_client,
+                    workflow_processor,
+                    es_client,
+                )
+                continue
 
-                # Process jobs into workflows
-                workflows = workflow_processor.process_jobs(new_jobs)
+            with tracer.cycle():
+                # Plan every due region's fetch window in one round-trip
+                with span("plan"), stage("plan"):
+                    last_processed_times = es_client.get_last_processed_times(regions)
 
-                # Update Elasticsearch
-                es_client.update_workflows(workflows)
+                for region in regions:
+                    # Skip regions another worker took over during this cycle
+                    if not leases.renew(region):
+                        continue
+                    since = last_processed_times[region]
+                    if receiver is not None:
+                        since = min(since, swept_since.get(region, since))
+                    sweep_started = datetime.now(timezone.utc)
+                    try:
+                        with span("region", region=region):
+                            new_jobs, workflows = process_region(
+                                region,
+                                since,
+                                aap_client,
+                                workflow_processor,
+                                es_client,
+                                lambda: leases.keep(region),
+                            )
+                    except LeaseLostError as e:
+                        logger.warning(f"Stopped region {region}: {e}")
+                        continue
+                    except CircuitOpenError as e:
+                        # Try the region again once the circuit lets a call through
+                        logger.warning(f"Skipping region {region}: {e}")
+                        scheduler.defer(region, e.retry_after)
+                        continue
+                    swept_since[region] = sweep_started
+                    scheduler.record(region, new_jobs, workflows)
 
-                logger.info(f"Completed processing for region: {region}")
+                # Make sure every background write has landed before sleeping
+                with span("flush"), stage("flush"):
+                    es_client.flush()
+            CYCLES.labels(result="success").inc()
 
-            # Wait for the configured interval before the next run
-            time.sleep(config.run_interval)
+            # Wait until the next owned region is due
+            wait(
+                min(scheduler.sleep_time(owned), leases.heartbeat_interval),
+                owned,
+                receiver,
+                aap_client,
+                workflow_processor,
+                es_client,
+            )
 
         except Exception as e:
+            CYCLES.labels(result="error").inc()
             logger.error(f"An error occured: {str(e)}")
+            # Poll the cycle's regions again after the retry interval
+            scheduler.retry(regions)
             time.sleep(config.error_retry_interval)
 
 
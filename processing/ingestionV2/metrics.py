@@ -0,0 +1,153 @@
+import time
+from datetime import timezone
+from prometheus_client import Counter, Gauge, Histogram, start_http_server
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+_NAMESPACE = "leapp_ingestion"
+
+AAP_REQUEST_SECONDS = Histogram(
+    "aap_request_seconds",
+    "AAP request latency",
+    ["region", "endpoint"],
+    namespace=_NAMESPACE,
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60),
+)
+AAP_RESPONSES = Counter(
+    "aap_responses",
+    "AAP responses by status code",
+    ["region", "endpoint", "code"],
+    namespace=_NAMESPACE,
+)
+AAP_PAGES = Counter(
+    "aap_pages",
+    "AAP result pages fetched",
+    ["region", "endpoint"],
+    namespace=_NAMESPACE,
+)
+AAP_BYTES = Counter(
+    "aap_bytes",
+    "AAP response bytes fetched",
+    ["region", "endpoint"],
+    namespace=_NAMESPACE,
+)
+STAGE_SECONDS = Histogram(
+    "stage_seconds",
+    "Duration of each ingestion stage",
+    ["stage", "region"],
+    namespace=_NAMESPACE,
+    buckets=(0.1, 0.5, 1, 5, 15, 30, 60, 120, 300, 600),
+)
+WORKFLOWS_PROCESSED = Counter(
+    "workflows_processed",
+    "Workflows processed by status",
+    ["region", "status"],
+    namespace=_NAMESPACE,
+)
+BULK_DOCUMENTS = Counter(
+    "bulk_documents",
+    "Bulk write results",
+    ["result"],
+    namespace=_NAMESPACE,
+)
+RETRIES = Counter(
+    "retries",
+    "Retries made by retry_with_backoff",
+    ["function"],
+    namespace=_NAMESPACE,
+)
+CYCLES = Counter(
+    "cycles",
+    "Completed and failed ingestion cycles",
+    ["result"],
+    namespace=_NAMESPACE,
+)
+NEWEST_FINISHED = Gauge(
+    "newest_finished_timestamp_seconds",
+    "Newest job finished time ingested per region",
+    ["region"],
+    namespace=_NAMESPACE,
+)
+LAG_SECONDS = Gauge(
+    "lag_seconds",
+    "Now minus the newest job finished time ingested per region",
+    ["region"],
+    namespace=_NAMESPACE,
+)
+POLL_INTERVAL_SECONDS = Gauge(
+    "poll_interval_seconds",
+    "Current polling interval per region",
+    ["region"],
+    namespace=_NAMESPACE,
+)
+CIRCUIT_STATE = Gauge(
+    "circuit_state",
+    "AAP circuit breaker state per region (0 closed, 1 open, 2 half-open)",
+    ["region"],
+    namespace=_NAMESPACE,
+)
+HEDGED_REQUESTS = Counter(
+    "hedged_requests",
+    "Duplicate job_events requests sent for slow reads",
+    ["region"],
+    namespace=_NAMESPACE,
+)
+WEBHOOK_NOTIFICATIONS = Counter(
+    "webhook_notifications",
+    "AAP job notifications received, by outcome",
+    ["region", "result"],
+    namespace=_NAMESPACE,
+)
+
+_newest_finished = {}
+
+
+def start_metrics_server(port):
+    """Serves /metrics on `port`; 0 disables the endpoint."""
+    if port:
+        start_http_server(port)
+        logger.info(f"Serving metrics on port {port}")
+
+
+def stage(name, region=""):
+    """Context manager timing one ingestion stage."""
+    return STAGE_SECONDS.labels(stage=name, region=region).time()
+
+
+def observe_aap_response(region, endpoint, response, seconds):
+    AAP_REQUEST_SECONDS.labels(region=region, endpoint=endpoint).observe(seconds)
+    AAP_RESPONSES.labels(region=region, endpoint=endpoint, code=response.status_code).inc()
+    AAP_BYTES.labels(region=region, endpoint=endpoint).inc(len(response.content))
+    if response.ok:
+        AAP_PAGES.labels(region=region, endpoint=endpoint).inc()
+
+
+def record_bulk(success=0, failed=0):
+    if success:
+        BULK_DOCUMENTS.labels(result="success").inc(success)
+    if failed:
+        BULK_DOCUMENTS.labels(result="failed").inc(failed)
+
+
+def record_workflows(region, workflows):
+    """Counts processed workflows and moves the region's lag forward."""
+    for workflow in workflows:
+        WORKFLOWS_PROCESSED.labels(region=region, status=workflow["status"]).inc()
+        if workflow["finished"]:
+            record_finished(region, workflow["finished"])
+
+
+def record_finished(region, finished):
+    """Records an ingested finished time if it is the region's newest."""
+    if finished.tzinfo is None:
+        finished = finished.replace(tzinfo=timezone.utc)
+    timestamp = finished.timestamp()
+    if timestamp <= _newest_finished.get(region, 0):
+        return
+    if region not in _newest_finished:
+        LAG_SECONDS.labels(region=region).set_function(
+            lambda: time.time() - _newest_finished[region]
+        )
+    _newest_finished[region] = timestamp
+    NEWEST_FINISHED.labels(region=region).set(timestamp)
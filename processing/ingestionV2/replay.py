@@ -0,0 +1,140 @@
+"""Bulk-loads files written by NdjsonSink or ParquetSink into Elasticsearch.
+
+    python replay.py output/ --es-url http://localhost:9200 --workers 4
+
+NDJSON files already hold `_bulk` request bodies, so their lines are sent as-is
+in size-bounded chunks without being decoded. Parquet rows are turned back
+into action/source line pairs first.
+"""
+
+import argparse
+import glob
+import gzip
+import json
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from elasticsearch import Elasticsearch
+from logger import get_logger, setup_logger
+
+logger = get_logger(__name__)
+
+_NDJSON_SUFFIXES = (".ndjson", ".ndjson.gz", ".ndjson.zst")
+
+
+def _open_text(path):
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8")
+    if path.endswith(".zst"):
+        import zstandard
+
+        return zstandard.open(path, "rt", encoding="utf-8")
+    return open(path, "r", encoding="utf-8")
+
+
+def _iter_ndjson_operations(path):
+    """Yields one operation (action line plus optional source line) at a time."""
+    with _open_text(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            if line.startswith('{"delete"'):
+                yield line
+            else:
+                yield line + next(f)
+
+
+def _iter_parquet_operations(path):
+    import pyarrow.parquet as pq
+
+    table = pq.read_table(path)
+    for row in table.to_pylist():
+        params = {"_index": row["index"]}
+        if row["id"] is not None:
+            params["_id"] = row["id"]
+        operation = json.dumps({row["op_type"]: params}) + "\n"
+        if row["body"] is not None:
+            operation += row["body"] + "\n"
+        yield operation
+
+
+def _find_files(paths):
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for candidate in sorted(glob.glob(os.path.join(path, "**", "*"), recursive=True)):
+                if candidate.endswith(_NDJSON_SUFFIXES + (".parquet",)):
+                    files.append(candidate)
+        else:
+            files.append(path)
+    return files
+
+
+def iter_operations(paths):
+    for path in _find_files(paths):
+        logger.info(f"Replaying {path}")
+        if path.endswith(".parquet"):
+            yield from _iter_parquet_operations(path)
+        else:
+            yield from _iter_ndjson_operations(path)
+
+
+def chunk_operations(operations, max_chunk_bytes):
+    chunk, size = [], 0
+    for operation in operations:
+        if chunk and size + len(operation) > max_chunk_bytes:
+            yield "".join(chunk)
+            chunk, size = [], 0
+        chunk.append(operation)
+        size += len(operation)
+    if chunk:
+        yield "".join(chunk)
+
+
+def replay(es, paths, max_chunk_bytes=10 * 1024 * 1024, workers=4):
+    """Sends every operation found under `paths` to Elasticsearch.
+
+    @Return: tuple(int, int) - successful and failed operations
+    """
+
+    def send(body):
+        response = es.bulk(operations=body)
+        failed = [i for i in response["items"] if next(iter(i.values())).get("error")]
+        return len(response["items"]) - len(failed), len(failed)
+
+    success, failed = 0, 0
+    in_flight = deque()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for body in chunk_operations(iter_operations(paths), max_chunk_bytes):
+            # Keep only a couple of chunks per worker in memory
+            if len(in_flight) >= workers * 2:
+                ok, errors = in_flight.popleft().result()
+                success += ok
+                failed += errors
+            in_flight.append(executor.submit(send, body))
+        for future in in_flight:
+            ok, errors = future.result()
+            success += ok
+            failed += errors
+    logger.info(f"Replay completed. Successful: {success}, Failed: {failed}")
+    return success, failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("paths", nargs="+", help="Files or directories to replay")
+    parser.add_argument("--es-url", default=os.getenv("ELASTICSEARCH_URL"))
+    parser.add_argument("--chunk-mb", type=int, default=10)
+    parser.add_argument("--workers", type=int, default=4)
+    args = parser.parse_args(argv)
+    setup_logger()
+
+    es = Elasticsearch([args.es_url])
+    success, failed = replay(
+        es, args.paths, max_chunk_bytes=args.chunk_mb * 1024 * 1024, workers=args.workers
+    )
+    print(f"Successful: {success}, Failed: {failed}")
+
+
+if __name__ == "__main__":
+    main()
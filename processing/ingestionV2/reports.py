@@ -0,0 +1,161 @@
+import glob
+import os
+import time
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+
+class Report:
+    """A parameterized SQL report over the analytics tables."""
+
+    def __init__(self, description, sql, tables, **defaults):
+        self.description = description
+        self.sql = sql
+        self.tables = tables
+        self.defaults = defaults
+
+
+_SINCE = "now() - to_days(CAST($days AS INTEGER))"
+
+REPORTS = {
+    "success-by-release": Report(
+        "Finished workflows and success rate per release and workflow type",
+        f"""
+        SELECT release, workflow_type,
+               count(*) AS workflows,
+               count(*) FILTER (WHERE status = 'completed') AS completed,
+               count(*) FILTER (WHERE status = 'failed') AS failed,
+               count(*) FILTER (WHERE automation_failure) AS automation_failures,
+               round(100.0 * count(*) FILTER (WHERE status = 'completed') / count(*), 1)
+                   AS success_pct
+        FROM workflows
+        WHERE started >= {_SINCE} AND status <> 'in_progress'
+        GROUP BY ALL
+        ORDER BY release, workflow_type
+        """,
+        ("workflows",),
+        days=90,
+    ),
+    "stage-durations": Report(
+        "Job duration per stage and host class (first group of host_pattern)",
+        f"""
+        SELECT coalesce(stage, name) AS stage,
+               regexp_extract(host, $host_pattern, 1) AS host_class,
+               count(*) AS jobs,
+               round(avg(elapsed), 1) AS mean_seconds,
+               round(quantile_cont(elapsed, 0.5), 1) AS p50_seconds,
+               round(quantile_cont(elapsed, 0.95), 1) AS p95_seconds
+        FROM jobs
+        WHERE finished >= {_SINCE}
+        GROUP BY ALL
+        ORDER BY stage, host_class
+        """,
+        ("jobs",),
+        days=90,
+        host_pattern="^([a-z]+)",
+    ),
+    "failure-clusters": Report(
+        "Most frequent failure clusters with an example message",
+        f"""
+        SELECT cluster_id,
+               count(*) AS failures,
+               count(DISTINCT host) AS hosts,
+               any_value(task) AS task,
+               any_value(message) AS example,
+               max(created) AS last_seen
+        FROM failed_tasks
+        WHERE created >= {_SINCE}
+        GROUP BY cluster_id
+        ORDER BY failures DESC
+        LIMIT $limit
+        """,
+        ("failed_tasks",),
+        days=30,
+        limit=20,
+    ),
+    "daily-throughput": Report(
+        "Workflows finished per day and region",
+        f"""
+        SELECT CAST(finished AS DATE) AS day, region,
+               count(*) AS finished,
+               count(*) FILTER (WHERE failed) AS failed,
+               round(avg(duration_seconds) / 60, 1) AS mean_minutes
+        FROM workflows
+        WHERE finished >= {_SINCE} AND status <> 'in_progress'
+        GROUP BY ALL
+        ORDER BY day, region
+        """,
+        ("workflows",),
+        days=30,
+    ),
+}
+
+
+class ReportEngine:
+    """Runs REPORTS with DuckDB over the Parquet tables of an analytics export.
+
+    Each table becomes a view holding the latest version of every row, with
+    the `region` and `month` partition columns, so reports never see the
+    superseded rows of partitions that are not compacted yet. Job and event
+    ids are only unique within a region's tower, so rows are told apart by
+    region and id. Nothing here touches Elasticsearch.
+
+    @Param: directory - string - ANALYTICS_DIR of the ingestion daemon
+    @Param: threads - int - DuckDB worker threads, default all cores
+    """
+
+    def __init__(self, directory, threads=None):
+        import duckdb
+
+        self.directory = directory
+        self.db = duckdb.connect()
+        if threads:
+            self.db.execute(f"SET threads = {int(threads)}")
+        self.tables = set()
+        for table in ("workflows", "jobs", "failed_tasks"):
+            pattern = os.path.join(directory, table, "*", "*", "*.parquet")
+            if not glob.glob(pattern):
+                continue
+            self.db.execute(
+                f"""
+                CREATE VIEW {table} AS
+                SELECT * FROM read_parquet('{pattern.replace("'", "''")}',
+                                           hive_partitioning = true, union_by_name = true)
+                QUALIFY row_number() OVER (
+                    PARTITION BY region, id ORDER BY exported_at DESC
+                ) = 1
+                """
+            )
+            self.tables.add(table)
+
+    def run(self, name, **params):
+        """Runs a report.
+
+        @Param: name - string - Key of REPORTS
+        @Param: params - Overrides of the report's default parameters
+        @Return: tuple - (column names, list of row tuples)
+        """
+        report = REPORTS[name]
+        missing = [table for table in report.tables if table not in self.tables]
+        if missing:
+            raise ValueError(
+                f"No {', '.join(missing)} data under {self.directory}; "
+                "is ANALYTICS_DIR set on the ingestion daemon?"
+            )
+        unknown = set(params) - set(report.defaults)
+        if unknown:
+            raise ValueError(f"Unknown parameters for {name}: {', '.join(sorted(unknown))}")
+
+        start = time.perf_counter()
+        result = self.db.execute(report.sql, dict(report.defaults, **params))
+        columns = [column[0] for column in result.description]
+        rows = result.fetchall()
+        logger.info(
+            f"Report {name} returned {len(rows)} rows "
+            f"in {(time.perf_counter() - start) * 1000:.0f} ms"
+        )
+        return columns, rows
+
+    def close(self):
+        self.db.close()
@@ -0,0 +1,142 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from logger import get_logger
+from metrics import CIRCUIT_STATE, HEDGED_REQUESTS
+
+logger = get_logger(__name__)
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a tower whose circuit is open.
+
+    `retry_after` is the number of seconds until the circuit lets a trial
+    call through.
+    """
+
+    def __init__(self, message, retry_after=0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """Stops calls to a tower after repeated failures.
+
+    After `failure_threshold` consecutive failures the circuit opens and
+    calls fail fast with CircuitOpenError. Once `reset_timeout` seconds have
+    passed a single trial call is let through (half-open); its success closes
+    the circuit and its failure opens it again.
+    """
+
+    CLOSED, OPEN, HALF_OPEN = 0, 1, 2
+
+    def __init__(self, name, failure_threshold=5, reset_timeout=120, clock=time.monotonic):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0
+        self._trial_running = False
+        self._lock = threading.Lock()
+        CIRCUIT_STATE.labels(region=name).set(self.state)
+
+    def before_call(self):
+        with self._lock:
+            if self.state == self.OPEN:
+                retry_after = self._opened_at + self.reset_timeout - self.clock()
+                if retry_after > 0:
+                    raise CircuitOpenError(f"Circuit for {self.name} is open", retry_after)
+                self._set_state(self.HALF_OPEN)
+            if self.state == self.HALF_OPEN:
+                if self._trial_running:
+                    raise CircuitOpenError(
+                        f"Circuit for {self.name} is half-open", self.reset_timeout
+                    )
+                self._trial_running = True
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._trial_running = False
+            if self.state != self.CLOSED:
+                logger.info(f"Circuit for {self.name} closed")
+                self._set_state(self.CLOSED)
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._trial_running = False
+            if self.state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    logger.warning(
+                        f"Circuit for {self.name} opened after {self._failures} failures"
+                    )
+                self._opened_at = self.clock()
+                self._set_state(self.OPEN)
+
+    def _set_state(self, state):
+        self.state = state
+        CIRCUIT_STATE.labels(region=self.name).set(state)
+
+
+class LatencyTracker:
+    """Recent request latencies, for picking the hedging delay."""
+
+    def __init__(self, size=200, min_samples=20):
+        self.min_samples = min_samples
+        self._samples = deque(maxlen=size)
+
+    def add(self, seconds):
+        self._samples.append(seconds)
+
+    def percentile(self, q):
+        """Returns the q-th percentile, or None until enough samples are in."""
+        if len(self._samples) < self.min_samples:
+            return None
+        ordered = sorted(self._samples)
+        return ordered[min(int(len(ordered) * q / 100), len(ordered) - 1)]
+
+
+class Hedger:
+    """Sends a duplicate of a request that is slower than usual.
+
+    The duplicate goes out once the first attempt has taken longer than the
+    recent p95 latency, and whichever attempt succeeds first wins: an attempt
+    that raises, or whose result `accept` rejects, waits for the other one.
+    Only when both fail is the last rejected result returned, or else the
+    last error raised. The loser is left to finish on its own and bounded by
+    the request timeout.
+    """
+
+    def __init__(self, max_workers=8, percentile=95):
+        self.percentile = percentile
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="hedge")
+
+    def call(self, func, latencies, region, accept=lambda result: True):
+        delay = latencies.percentile(self.percentile)
+        if delay is None:
+            return func()
+
+        first = self._executor.submit(func)
+        done, _ = wait([first], timeout=delay)
+        if done:
+            return first.result()
+
+        HEDGED_REQUESTS.labels(region=region).inc()
+        pending = {first, self._executor.submit(func)}
+        rejected, error = None, None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is not None:
+                    error = future.exception()
+                elif accept(future.result()):
+                    return future.result()
+                else:
+                    rejected = future.result()
+        if rejected is not None:
+            return rejected
+        raise error
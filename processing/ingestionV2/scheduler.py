@@ -0,0 +1,146 @@
+import math
+import time
+from datetime import datetime
+from logger import get_logger
+from metrics import POLL_INTERVAL_SECONDS
+
+logger = get_logger(__name__)
+
+
+class FixedScheduler:
+    """Polls every region each cycle and sleeps RUN_INTERVAL in between.
+
+    With webhook notifications on, polling is only a reconciliation sweep and
+    runs every RECONCILE_INTERVAL instead. The loop may wake up earlier to
+    renew region leases; regions are only handed out again once the interval
+    has passed since the previous cycle started, or after a failed cycle.
+    """
+
+    def __init__(self, config, clock=time.monotonic):
+        self.regions = list(config.regions)
+        self.run_interval = (
+            config.reconcile_interval if config.webhook_port else config.run_interval
+        )
+        self.clock = clock
+        self._next_cycle = clock()
+
+    def due_regions(self):
+        now = self.clock()
+        if now < self._next_cycle:
+            return []
+        self._next_cycle = now + self.run_interval
+        return list(self.regions)
+
+    def record(self, region, jobs, workflows):
+        pass
+
+    def defer(self, region, seconds):
+        """A skipped region is polled again next cycle."""
+        pass
+
+    def retry(self, regions):
+        """Hands the regions of a failed cycle out again straight away."""
+        if regions:
+            self._next_cycle = self.clock()
+
+    def sleep_time(self, regions):
+        return max(self._next_cycle - self.clock(), 0)
+
+
+class AdaptiveScheduler:
+    """Sets each region's next poll from its recent activity.
+
+    A region with in-progress workflows is polled every `min_interval`.
+    Otherwise the interval aims at `target_jobs_per_poll` new jobs per poll,
+    using a moving average of the job arrival rate, and doubles after every
+    poll that found nothing new. Intervals stay within
+    [min_interval, max_interval].
+    """
+
+    # Weight of the latest poll in the arrival rate average
+    _RATE_SMOOTHING = 0.5
+
+    def __init__(self, config, clock=time.monotonic):
+        self.regions = list(config.regions)
+        self.min_interval = config.min_poll_interval
+        self.max_interval = config.max_poll_interval
+        self.target_jobs_per_poll = config.target_jobs_per_poll
+        self.clock = clock
+
+        now = clock()
+        self._next_poll = {region: now for region in self.regions}
+        self._last_poll = {}
+        self._interval = {region: self.min_interval for region in self.regions}
+        self._rate = {region: 0.0 for region in self.regions}
+        self._newest_created = {}
+
+    def due_regions(self):
+        now = self.clock()
+        return [region for region in self.regions if self._next_poll[region] <= now]
+
+    def record(self, region, jobs, workflows):
+        """Schedules the region's next poll after it was polled."""
+        now = self.clock()
+        new_jobs = self._count_new_jobs(region, jobs)
+        in_progress = sum(1 for w in workflows if w["status"] == "in_progress")
+
+        if region in self._last_poll:
+            elapsed = max(now - self._last_poll[region], 1e-3)
+            self._rate[region] = (
+                self._RATE_SMOOTHING * new_jobs / elapsed
+                + (1 - self._RATE_SMOOTHING) * self._rate[region]
+            )
+        self._last_poll[region] = now
+
+        if in_progress:
+            interval = self.min_interval
+        elif new_jobs == 0:
+            interval = self._interval[region] * 2
+        elif self._rate[region] > 0:
+            interval = self.target_jobs_per_poll / self._rate[region]
+        else:
+            interval = self.min_interval
+        interval = min(max(interval, self.min_interval), self.max_interval)
+
+        self._interval[region] = interval
+        self._next_poll[region] = now + interval
+        POLL_INTERVAL_SECONDS.labels(region=region).set(interval)
+        logger.info(
+            f"Next poll for {region} in {interval:.0f}s "
+            f"({new_jobs} new jobs, {in_progress} in progress)"
+        )
+
+    def defer(self, region, seconds):
+        """Keeps a region that could not be polled from being due for `seconds`."""
+        self._next_poll[region] = self.clock() + max(seconds, self.min_interval)
+
+    def retry(self, regions):
+        """Makes the regions of a failed cycle due again straight away."""
+        now = self.clock()
+        for region in regions:
+            self._next_poll[region] = min(self._next_poll[region], now)
+
+    def sleep_time(self, regions):
+        """Seconds until the first of `regions` is due."""
+        next_poll = min((self._next_poll[region] for region in regions), default=math.inf)
+        return max(next_poll - self.clock(), 0)
+
+    def _count_new_jobs(self, region, jobs):
+        """Counts jobs created after the newest one seen by the previous poll.
+
+        get_new_jobs re-reads an overlapping window, so the number of jobs it
+        returns is not the number of new arrivals.
+        """
+        newest = self._newest_created.get(region)
+        created = [datetime.fromisoformat(job["created"]) for job in jobs]
+        if created:
+            self._newest_created[region] = max(created + ([newest] if newest else []))
+        if newest is None:
+            return len(created)
+        return sum(1 for c in created if c > newest)
+
+
+def create_scheduler(config):
+    if config.adaptive_polling:
+        return AdaptiveScheduler(config)
+    return FixedScheduler(config)
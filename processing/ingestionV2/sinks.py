@@ -0,0 +1,209 @@
+import gzip
+import json
+import os
+from datetime import date, datetime, timezone
+from elasticsearch import helpers
+from logger import get_logger
+from metrics import record_bulk
+from tracing import span
+from utils import retry_with_backoff
+
+logger = get_logger(__name__)
+
+
+def _json_default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(value):
+    return json.dumps(value, default=_json_default, separators=(",", ":"))
+
+
+def to_bulk_lines(action):
+    """Turns a bulk helper action into its `_bulk` action and source lines.
+
+    The source line is None for delete actions.
+    """
+    meta, source = helpers.expand_action(dict(action))
+    return dumps(meta), None if source is None else dumps(source)
+
+
+def raise_for_bulk_errors(errors):
+    """Raises BulkIndexError for failed bulk items.
+
+    A `create` rejected with a version conflict means the immutable document
+    already exists, so it is not treated as an error.
+
+    @Return: int - number of conflicting creates that were ignored
+    """
+    conflicts = 0
+    failed = []
+    for error in errors:
+        if error.get("create", {}).get("status") == 409:
+            conflicts += 1
+        else:
+            failed.append(error)
+    if failed:
+        record_bulk(failed=len(failed))
+        raise helpers.BulkIndexError(f"{len(failed)} document(s) failed to index.", failed)
+    return conflicts
+
+
+class ElasticsearchSink:
+    # Same as the helpers.bulk default, chunked here so each chunk gets a span
+    _CHUNK_SIZE = 500
+
+    def __init__(self, es):
+        self.es = es
+
+    # Retried here rather than around update_workflows so that file sinks,
+    # whose writes are not idempotent, never see the same actions twice
+    @retry_with_backoff(max_retries=3, backoff_in_seconds=1)
+    def write(self, actions):
+        success, errors = 0, []
+        for number, start in enumerate(range(0, len(actions), self._CHUNK_SIZE), 1):
+            chunk = actions[start:start + self._CHUNK_SIZE]
+            with span("es.bulk_chunk", chunk=number, actions=len(chunk)):
+                chunk_success, chunk_errors = helpers.bulk(
+                    self.es, chunk, chunk_size=self._CHUNK_SIZE, raise_on_error=False
+                )
+            success += chunk_success
+            errors.extend(chunk_errors)
+        success += raise_for_bulk_errors(errors)
+        record_bulk(success=success)
+        logger.info(f"Bulk operation completed. Successful: {success}")
+        return success, 0
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class NdjsonSink:
+    """Writes actions as compressed `_bulk` request bodies.
+
+    Every flush() closes the current file, so one ingestion cycle produces one
+    file that replay.py can POST back to Elasticsearch without re-encoding.
+    """
+
+    _EXTENSIONS = {"gzip": ".ndjson.gz", "zstd": ".ndjson.zst", "none": ".ndjson"}
+
+    def __init__(self, directory, compression="gzip", prefix="workflows"):
+        if compression not in self._EXTENSIONS:
+            raise ValueError(f"Unsupported compression: {compression}")
+        self.directory = directory
+        self.compression = compression
+        self.prefix = prefix
+        self._file = None
+        self._path = None
+        self._count = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def _open(self):
+        timestamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%f")
+        self._path = os.path.join(
+            self.directory,
+            f"{self.prefix}-{timestamp}{self._EXTENSIONS[self.compression]}",
+        )
+        if self.compression == "gzip":
+            self._file = gzip.open(self._path, "wt", encoding="utf-8")
+        elif self.compression == "zstd":
+            import zstandard
+
+            self._file = zstandard.open(self._path, "wt", encoding="utf-8")
+        else:
+            self._file = open(self._path, "w", encoding="utf-8")
+
+    def write(self, actions):
+        written = 0
+        for action in actions:
+            if self._file is None:
+                self._open()
+            meta, source = to_bulk_lines(action)
+            self._file.write(meta + "\n")
+            if source is not None:
+                self._file.write(source + "\n")
+            written += 1
+        self._count += written
+        return written, 0
+
+    def flush(self):
+        if self._file is not None:
+            self._file.close()
+            logger.info(f"Wrote {self._count} actions to {self._path}")
+            self._file = None
+            self._count = 0
+
+    def close(self):
+        self.flush()
+
+
+class ParquetSink:
+    """Writes actions to a Parquet dataset partitioned by day.
+
+    Each row keeps the bulk operation, target index, document id and the
+    request body as JSON, which is all replay.py needs to rebuild the action.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._rows = []
+
+    def write(self, actions):
+        for action in actions:
+            meta, source = helpers.expand_action(dict(action))
+            ((op_type, params),) = meta.items()
+            self._rows.append(
+                {
+                    "op_type": op_type,
+                    "index": params.get("_index"),
+                    "id": None if params.get("_id") is None else str(params["_id"]),
+                    "body": None if source is None else dumps(source),
+                }
+            )
+        return len(actions), 0
+
+    def flush(self):
+        if not self._rows:
+            return
+
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        now = datetime.now(timezone.utc)
+        table = pa.Table.from_pylist(self._rows).append_column(
+            "day", pa.array([now.strftime("%Y-%m-%d")] * len(self._rows))
+        )
+        pq.write_to_dataset(
+            table,
+            root_path=self.directory,
+            partition_cols=["day"],
+            basename_template=f"part-{now.strftime('%H%M%S%f')}-{{i}}.parquet",
+            compression="zstd",
+        )
+        logger.info(f"Wrote {len(self._rows)} actions to {self.directory}")
+        self._rows = []
+
+    def close(self):
+        self.flush()
+
+
+def create_sink(config, es=None):
+    """Builds the sink selected by `OUTPUT_SINK`.
+
+    Every sink has write(actions), flush() and close(), and receives the same
+    action dicts that would otherwise be passed to `helpers.bulk`, so the
+    ingestion code builds its actions once and does not care whether they end
+    up in Elasticsearch or on disk.
+    """
+    if config.output_sink == "elasticsearch":
+        return ElasticsearchSink(es)
+    if config.output_sink == "ndjson":
+        return NdjsonSink(config.output_dir, compression=config.output_compression)
+    if config.output_sink == "parquet":
+        return ParquetSink(config.output_dir)
+    raise ValueError(f"Unknown OUTPUT_SINK: {config.output_sink}")
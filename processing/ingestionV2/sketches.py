@@ -0,0 +1,337 @@
+import math
+import uuid
+from datetime import datetime, timezone
+from elasticsearch import NotFoundError
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+
+class DDSketch:
+    """Mergeable quantile sketch with bounded relative error.
+
+    Values are counted in logarithmic bins, so any quantile is returned within
+    `relative_accuracy` of the true value, and two sketches with the same
+    accuracy merge by adding their bin counts. Durations of a few seconds to a
+    few days fit in a few hundred bins at the default 1% accuracy.
+    """
+
+    # Values at or below this are counted as zero
+    _MIN_VALUE = 1e-9
+
+    def __init__(self, relative_accuracy=0.01):
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self.gamma)
+        self.bins = {}
+        self.zero_count = 0
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, value, count=1):
+        if value <= self._MIN_VALUE:
+            self.zero_count += count
+        else:
+            index = math.ceil(math.log(value) / self._log_gamma)
+            self.bins[index] = self.bins.get(index, 0) + count
+        self.count += count
+        self.sum += value * count
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def merge(self, other):
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError("Cannot merge sketches with different accuracies")
+        for index, count in other.bins.items():
+            self.bins[index] = self.bins.get(index, 0) + count
+        self.zero_count += other.zero_count
+        self.count += other.count
+        self.sum += other.sum
+        if other.min is not None:
+            self.min = other.min if self.min is None else min(self.min, other.min)
+            self.max = other.max if self.max is None else max(self.max, other.max)
+
+    def quantile(self, q):
+        """Returns the q-quantile (0 <= q <= 1), or None for an empty sketch."""
+        if self.count == 0:
+            return None
+        rank = q * (self.count - 1)
+        seen = self.zero_count
+        if rank < seen:
+            return 0.0
+        for index in sorted(self.bins):
+            seen += self.bins[index]
+            if rank < seen:
+                value = 2 * self.gamma**index / (self.gamma + 1)
+                return min(max(value, self.min), self.max)
+        return self.max
+
+    def to_doc(self):
+        """Compact form stored in Elasticsearch."""
+        return {
+            "relative_accuracy": self.relative_accuracy,
+            "bins": {str(index): count for index, count in self.bins.items()},
+            "zero_count": self.zero_count,
+            "count": self.count,
+            "sum": self.sum,
+            "min": self.min,
+            "max": self.max,
+        }
+
+    @classmethod
+    def from_doc(cls, doc):
+        sketch = cls(doc["relative_accuracy"])
+        sketch.bins = {int(index): count for index, count in doc["bins"].items()}
+        sketch.zero_count = doc["zero_count"]
+        sketch.count = doc["count"]
+        sketch.sum = doc["sum"]
+        sketch.min = doc["min"]
+        sketch.max = doc["max"]
+        return sketch
+
+
+# Adds a sketch to the stored one: bins and counts add up, min/max widen.
+# The last few batch ids are kept in the document, so a retried bulk request
+# that reaches a sketch it already merged leaves it untouched.
+_MERGE_SCRIPT = """
+def s = ctx._source;
+def d = params.sketch;
+if (s.count == null) {
+  s.putAll(params.key);
+  s.relative_accuracy = d.relative_accuracy;
+  s.bins = [:];
+  s.zero_count = 0;
+  s.count = 0;
+  s.sum = 0.0;
+  s.min = d.min;
+  s.max = d.max;
+}
+if (s.batches == null) {
+  s.batches = [];
+}
+if (s.batches.contains(params.batch)) {
+  ctx.op = 'noop';
+} else {
+  for (entry in d.bins.entrySet()) {
+    def current = s.bins.containsKey(entry.getKey()) ? s.bins[entry.getKey()] : 0;
+    s.bins[entry.getKey()] = current + entry.getValue();
+  }
+  s.zero_count += d.zero_count;
+  s.count += d.count;
+  s.sum += d.sum;
+  s.min = Math.min(s.min, d.min);
+  s.max = Math.max(s.max, d.max);
+  s.batches.add(params.batch);
+  while (s.batches.size() > params.keep_batches) {
+    s.batches.remove(0);
+  }
+}
+"""
+
+# Batch ids remembered per sketch; retries happen within a few cycles
+_KEEP_BATCHES = 32
+
+
+def _parse(value):
+    if value is None or isinstance(value, datetime):
+        return value
+    parsed = datetime.fromisoformat(value)
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+class DurationSketcher:
+    """Turns processed workflows into sketch merge actions.
+
+    Keeps one sketch of job `elapsed` per region, workflow_type, job name,
+    release and day, and one of workflow duration per region, workflow_type,
+    release and day. The fetch window overlaps between cycles, so each region
+    keeps a watermark of the newest `finished` time already sketched and
+    only jobs and finished workflows past it are added. The watermark is
+    stored next to the sketches so a restart does not count jobs twice, and
+    only moves once remember() is told the write went through, so a retried
+    write rebuilds the same actions. Every actions() call tags its merges with
+    a batch id that the stored sketch remembers, so resending them merges
+    nothing twice.
+
+    The watermark assumes workflows arrive in `finished` order, as the
+    polling sweeps deliver them. Notified workflows are written without
+    sketching and counted by the sweep that covers them.
+    """
+
+    # Bins are only read back whole, so they are stored but not indexed
+    _MAPPINGS = {
+        "properties": {
+            "kind": {"type": "keyword"},
+            "region": {"type": "keyword"},
+            "workflow_type": {"type": "keyword"},
+            "job_name": {"type": "keyword"},
+            "release": {"type": "keyword"},
+            "day": {"type": "date", "format": "yyyy-MM-dd"},
+            "bins": {"type": "object", "enabled": False},
+            "batches": {"type": "keyword", "index": False},
+            "finished": {"type": "date"},
+        }
+    }
+
+    def __init__(self, index, es=None, relative_accuracy=0.01):
+        self.index = index
+        self.es = es
+        self.relative_accuracy = relative_accuracy
+        self._watermarks = {}
+        if es is not None and not es.indices.exists(index=index):
+            try:
+                es.indices.create(index=index, mappings=self._MAPPINGS)
+            except Exception as e:
+                # Another worker created it first
+                if not es.indices.exists(index=index):
+                    raise e
+
+    def _watermark(self, region):
+        if region not in self._watermarks:
+            watermark = None
+            if self.es is not None:
+                # Other errors propagate so the next attempt reads it again
+                try:
+                    doc = self.es.get(index=self.index, id=f"watermark:{region}")
+                    watermark = _parse(doc["_source"]["finished"])
+                except NotFoundError:
+                    logger.info(f"No duration sketch watermark for region {region}")
+            self._watermarks[region] = watermark
+        return self._watermarks[region]
+
+    def actions(self, workflows):
+        sketches = {}
+        batch = uuid.uuid4().hex
+
+        def add(key, value):
+            doc_id = "|".join(str(v) for v in key.values())
+            if doc_id not in sketches:
+                sketches[doc_id] = (key, DDSketch(self.relative_accuracy))
+            sketches[doc_id][1].add(value)
+
+        newest = {}
+        for workflow in workflows:
+            region = workflow["region"]
+            watermark = self._watermark(region)
+            release = None
+            for job in workflow["jobs"]:
+                finished = _parse(job["finished"])
+                release = job["name"].split("_")[-1]
+                if finished is None or (watermark and finished <= watermark):
+                    continue
+                add(
+                    {
+                        "kind": "job",
+                        "region": region,
+                        "workflow_type": workflow["workflow_type"],
+                        "job_name": job["name"],
+                        "release": release,
+                        "day": finished.date().isoformat(),
+                    },
+                    job["elapsed"],
+                )
+                if region not in newest or finished > newest[region]:
+                    newest[region] = finished
+
+            finished = _parse(workflow["finished"])
+            if (
+                workflow["status"] != "in_progress"
+                and finished is not None
+                and not (watermark and finished <= watermark)
+            ):
+                add(
+                    {
+                        "kind": "workflow",
+                        "region": region,
+                        "workflow_type": workflow["workflow_type"],
+                        "job_name": None,
+                        "release": release,
+                        "day": finished.date().isoformat(),
+                    },
+                    (finished - _parse(workflow["started"])).total_seconds(),
+                )
+
+        actions = [
+            {
+                "_op_type": "update",
+                "_index": self.index,
+                "_id": doc_id,
+                "scripted_upsert": True,
+                "upsert": {},
+                "script": {
+                    "source": _MERGE_SCRIPT,
+                    "lang": "painless",
+                    "params": {
+                        "key": key,
+                        "sketch": sketch.to_doc(),
+                        "batch": batch,
+                        "keep_batches": _KEEP_BATCHES,
+                    },
+                },
+            }
+            for doc_id, (key, sketch) in sketches.items()
+        ]
+        for region, finished in newest.items():
+            actions.append(
+                {
+                    "_op_type": "index",
+                    "_index": self.index,
+                    "_id": f"watermark:{region}",
+                    "_source": {"kind": "watermark", "region": region, "finished": finished.isoformat()},
+                }
+            )
+        return actions
+
+    def remember(self, actions):
+        """Moves the watermarks past written actions."""
+        for action in actions:
+            if action["_index"] == self.index and action["_id"].startswith("watermark:"):
+                source = action["_source"]
+                self._watermarks[source["region"]] = _parse(source["finished"])
+
+
+def duration_percentiles(es, index, quantiles=(0.5, 0.95, 0.99), group_by=(), **filters):
+    """Merges stored sketches and returns their quantiles.
+
+        duration_percentiles(es, "rhel_upgrade_reporting_duration_sketches",
+                             group_by=("job_name",), kind="job", region="amrs",
+                             workflow_type="upgrade_8_to_9")
+
+    @Param: group_by - tuple - Key fields to keep apart; everything else is merged
+    @Param: filters - Exact values for key fields; `day_from`/`day_to` bound the day
+    @Return: dict - {group values: {"count": int, "p50": float, ...}}
+    """
+    must = [{"term": {"kind": filters.pop("kind", "job")}}]
+    day_range = {}
+    if "day_from" in filters:
+        day_range["gte"] = filters.pop("day_from")
+    if "day_to" in filters:
+        day_range["lte"] = filters.pop("day_to")
+    if day_range:
+        must.append({"range": {"day": day_range}})
+    must.extend({"term": {field: value}} for field, value in filters.items())
+
+    merged = {}
+    result = es.search(
+        index=index, query={"bool": {"filter": must}}, size=10000, scroll="1m"
+    )
+    while result["hits"]["hits"]:
+        for hit in result["hits"]["hits"]:
+            doc = hit["_source"]
+            group = tuple(doc.get(field) for field in group_by)
+            if group in merged:
+                merged[group].merge(DDSketch.from_doc(doc))
+            else:
+                merged[group] = DDSketch.from_doc(doc)
+        result = es.scroll(scroll_id=result["_scroll_id"], scroll="1m")
+    es.clear_scroll(scroll_id=result["_scroll_id"])
+
+    return {
+        group: dict(
+            {"count": sketch.count},
+            **{f"p{round(q * 100):g}": sketch.quantile(q) for q in quantiles},
+        )
+        for group, sketch in merged.items()
+    }
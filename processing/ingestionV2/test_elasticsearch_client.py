@@ -0,0 +1,85 @@
+from config import Config
+from elasticsearch_client import ElasticsearchClient
+
+
+class ListSink:
+    def __init__(self):
+        self.actions = []
+
+    def write(self, actions):
+        self.actions.extend(actions)
+        return len(actions), 0
+
+
+def _workflow(region):
+    return {
+        "id": f"tx-{region}-host",
+        "region": region,
+        "status": "failed",
+        "jobs": [{"id": 42, "status": "failed", "failed_tasks": [{"id": 7, "task": "upgrade"}]}],
+    }
+
+
+def _client(**settings):
+    config = Config()
+    config.es_url = None
+    config.output_sink = "elasticsearch"
+    config.es_split_jobs = True
+    config.es_host_state = False
+    config.es_duration_sketches = False
+    config.analytics_dir = ""
+    for name, value in settings.items():
+        setattr(config, name, value)
+    client = ElasticsearchClient(config)
+    client.sink = ListSink()
+    return client
+
+
+def test_split_documents_of_regions_sharing_an_aap_id():
+    client = _client()
+
+    client.update_workflows([_workflow("amrs"), _workflow("emea")])
+
+    created = {
+        (action["_index"], action["_id"])
+        for action in client.sink.actions
+        if action["_op_type"] == "create"
+    }
+    jobs, tasks = client.config.es_jobs_index, client.config.es_failed_tasks_index
+    assert created == {
+        (jobs, "amrs-42"),
+        (jobs, "emea-42"),
+        (tasks, "amrs-7"),
+        (tasks, "emea-7"),
+    }
+    summaries = [a["doc"] for a in client.sink.actions if a["_op_type"] == "update"]
+    assert [s["job_ids"] for s in summaries] == [["amrs-42"], ["emea-42"]]
+
+
+def test_written_jobs_are_remembered_per_region():
+    client = _client()
+    client.update_workflows([_workflow("amrs")])
+    client.sink.actions.clear()
+
+    client.update_workflows([_workflow("amrs"), _workflow("emea")])
+
+    created = [a["_id"] for a in client.sink.actions if a["_op_type"] == "create"]
+    assert created == ["emea-42", "emea-7"]
+
+
+def test_unsketched_writes_leave_the_watermark_alone():
+    client = _client(es_split_jobs=False, es_duration_sketches=True)
+    workflow = dict(
+        _workflow("amrs"),
+        workflow_type="upgrade_8_to_9",
+        started="2024-06-01T00:00:00",
+        finished="2024-06-01T02:00:00",
+    )
+    workflow["jobs"][0].update(
+        name="leapp_upgrade_9.4", elapsed=7200.0, finished="2024-06-01T02:00:00"
+    )
+
+    client.update_workflows([workflow], sketch=False)
+
+    assert [a["_index"] for a in client.sink.actions] == [client.index]
+    assert client.sketcher._watermark("amrs") is None
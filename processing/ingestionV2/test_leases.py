@@ -0,0 +1,44 @@
+import time
+
+import pytest
+
+from leases import FileLeaseStore, LeaseLostError, RegionLeases
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_keep_renews_once_per_heartbeat_interval(tmp_path):
+    clock = FakeClock()
+    store = FileLeaseStore(str(tmp_path))
+    leases = RegionLeases(store, ["amrs"], "worker-a", ttl=900, clock=clock)
+    assert leases.claim() == ["amrs"]
+    expires = store._read(store._path("region", "amrs"))["expires"]
+
+    leases.keep("amrs")
+    assert store._read(store._path("region", "amrs"))["expires"] == expires
+
+    clock.now += leases.heartbeat_interval
+    leases.keep("amrs")
+    assert store._read(store._path("region", "amrs"))["expires"] > expires
+
+
+def test_keep_raises_once_another_worker_took_the_region(tmp_path):
+    clock = FakeClock()
+    store = FileLeaseStore(str(tmp_path))
+    first = RegionLeases(store, ["amrs"], "worker-a", ttl=0.05, clock=clock)
+    second = RegionLeases(store, ["amrs"], "worker-b", ttl=900)
+    assert first.claim() == ["amrs"]
+
+    # The first worker's run outlives its lease
+    time.sleep(0.1)
+    assert second.claim() == ["amrs"]
+
+    clock.now += first.heartbeat_interval
+    with pytest.raises(LeaseLostError):
+        first.keep("amrs")
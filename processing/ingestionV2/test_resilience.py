@@ -0,0 +1,49 @@
+import itertools
+import time
+
+import pytest
+
+from resilience import Hedger, LatencyTracker
+
+
+def _latencies(seconds):
+    latencies = LatencyTracker(min_samples=1)
+    latencies.add(seconds)
+    return latencies
+
+
+def _attempts(*outcomes):
+    """Returns a func whose n-th call sleeps and returns (or raises) outcomes[n]."""
+    calls = itertools.count()
+
+    def func():
+        delay, outcome = outcomes[next(calls)]
+        time.sleep(delay)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    return func
+
+
+def test_fast_rejected_duplicate_waits_for_slow_success():
+    func = _attempts((0.3, "ok"), (0.0, "throttled"))
+
+    result = Hedger().call(func, _latencies(0.05), "amrs", accept=lambda r: r == "ok")
+
+    assert result == "ok"
+
+
+def test_rejected_result_returned_when_both_attempts_fail():
+    func = _attempts((0.2, "throttled"), (0.0, ConnectionError("reset")))
+
+    result = Hedger().call(func, _latencies(0.05), "amrs", accept=lambda r: r == "ok")
+
+    assert result == "throttled"
+
+
+def test_error_raised_when_both_attempts_raise():
+    func = _attempts((0.2, ConnectionError("first")), (0.0, ConnectionError("second")))
+
+    with pytest.raises(ConnectionError):
+        Hedger().call(func, _latencies(0.05), "amrs")
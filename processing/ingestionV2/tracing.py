@@ -0,0 +1,172 @@
+"""Per-cycle tracing spans and an on-demand sampling profiler.
+
+Spans are written as Chrome trace event files (`trace-<time>.json`, one per
+cycle) that open in Perfetto or chrome://tracing. Profiles are written as
+folded stacks (`profile-<time>.folded`) for flamegraph.pl or speedscope.
+
+Profiling the next cycle is armed with PROFILE_NEXT_CYCLE=true at start-up or
+at any time with `kill -USR2 <pid>`.
+"""
+
+import json
+import os
+import signal
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+from datetime import datetime, timezone
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+
+def _now_us():
+    return time.time_ns() // 1000
+
+
+def _file_stamp():
+    return datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%f")
+
+
+class SamplingProfiler:
+    """Samples the stacks of every other thread at a fixed interval."""
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.samples = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(
+                        f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})"
+                    )
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, str(thread_id)))
+                self.samples[";".join(reversed(stack))] += 1
+
+    def write(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in self.samples.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+class Tracer:
+    """Collects spans for the current cycle and writes them when it ends.
+
+    @Param: directory - string - Where trace and profile files go; tracing is
+        off when it is empty, profiling still writes to the working directory
+    @Param: profile_next_cycle - bool - Profile the first cycle
+    @Param: profile_interval - float - Seconds between profiler samples
+    """
+
+    def __init__(self, directory=None, profile_next_cycle=False, profile_interval=0.005):
+        self.directory = directory
+        self.profile_interval = profile_interval
+        self._profile_requested = threading.Event()
+        if profile_next_cycle:
+            self._profile_requested.set()
+        self._events = []
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    @property
+    def enabled(self):
+        return bool(self.directory)
+
+    def request_profile(self, *_):
+        """Arms the profiler for the next cycle (also the SIGUSR2 handler)."""
+        self._profile_requested.set()
+
+    @contextmanager
+    def span(self, name, **attrs):
+        if not self.enabled:
+            yield
+            return
+        start = _now_us()
+        try:
+            yield
+        finally:
+            event = {
+                "name": name,
+                "ph": "X",
+                "ts": start,
+                "dur": _now_us() - start,
+                "pid": self._pid,
+                "tid": threading.get_ident(),
+                "args": attrs,
+            }
+            with self._lock:
+                self._events.append(event)
+
+    @contextmanager
+    def cycle(self):
+        """Wraps one ingestion cycle, writing its trace and optional profile."""
+        profiler = None
+        if self._profile_requested.is_set():
+            self._profile_requested.clear()
+            profiler = SamplingProfiler(self.profile_interval)
+            profiler.start()
+        try:
+            with self.span("cycle"):
+                yield
+        finally:
+            stamp = _file_stamp()
+            if profiler is not None:
+                profiler.stop()
+                path = os.path.join(self.directory or ".", f"profile-{stamp}.folded")
+                profiler.write(path)
+                logger.info(f"Wrote profile of {sum(profiler.samples.values())} samples to {path}")
+            self._write_trace(stamp)
+
+    def _write_trace(self, stamp):
+        with self._lock:
+            events, self._events = self._events, []
+        if not self.enabled or not events:
+            return
+        path = os.path.join(self.directory, f"trace-{stamp}.json")
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f, default=str)
+
+
+_tracer = Tracer()
+
+
+def configure(directory=None, profile_next_cycle=False):
+    """Replaces the process-wide tracer and hooks SIGUSR2 up to its profiler."""
+    global _tracer
+    _tracer = Tracer(directory, profile_next_cycle)
+    if hasattr(signal, "SIGUSR2") and threading.current_thread() is threading.main_thread():
+        signal.signal(signal.SIGUSR2, _tracer.request_profile)
+    return _tracer
+
+
+def span(name, **attrs):
+    """Times a block as a span of the current cycle."""
+    if not _tracer.enabled:
+        return nullcontext()
+    return _tracer.span(name, **attrs)
+
+
+def cycle():
+    return _tracer.cycle()
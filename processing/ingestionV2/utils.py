@@ -1,11 +1,20 @@
+import random
 import time
 from functools import wraps
 from logger import get_logger
+from metrics import RETRIES
 
 logger = get_logger(__name__)
 
 
-def retry_with_backoff(max_retries=3, backoff_in_seconds=1):
+def retry_with_backoff(max_retries=3, backoff_in_seconds=1, jitter=False, no_retry_on=()):
+    """Retries func with exponential backoff.
+
+    With jitter, each wait is drawn from [0.5, 1.5) times the backoff so that
+    callers failing together do not retry in lockstep. Exceptions listed in
+    no_retry_on are raised straight away.
+    """
+
     def decorator(func):
         @wraps(func)
         def wrapper(*args, **kwargs):
@@ -13,11 +22,16 @@ def retry_with_backoff(max_retries=3, backoff_in_seconds=1):
             while retries < max_retries:
                 try:
                     return func(*args, **kwargs)
+                except no_retry_on:
+                    raise
                 except Exception as e:
                     wait_time = backoff_in_seconds * (2**retries)
+                    if jitter:
+                        wait_time = round(wait_time * random.uniform(0.5, 1.5), 2)
                     logger.warning(
                         f"Error in {func.__name__}, retrying in {wait_time} seconds... Error: {str(e)}"
                     )
+                    RETRIES.labels(function=func.__name__).inc()
                     time.sleep(wait_time)
                     retries += 1
             return func(*args, **kwargs)
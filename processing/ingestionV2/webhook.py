@@ -0,0 +1,109 @@
+import hmac
+import json
+import queue
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from logger import get_logger
+from metrics import WEBHOOK_NOTIFICATIONS
+
+logger = get_logger(__name__)
+
+# AAP statuses of a job that has not finished yet
+_UNFINISHED = {"new", "pending", "waiting", "running"}
+
+
+class WebhookReceiver:
+    """Receives AAP job notifications and queues the finished leapp jobs.
+
+    Each tower posts its webhook notifications to `/<region>`. When `token`
+    is set, requests must carry it as `Authorization: Bearer <token>` and the
+    receiver listens on every interface; without one it only listens on
+    127.0.0.1, so nothing else can make the daemon fetch and write jobs. The
+    handler only validates and queues the job id; fetching happens on the
+    ingestion loop through take().
+    """
+
+    def __init__(self, port, regions, token=""):
+        self.regions = set(regions)
+        self.token = token
+        self._queue = queue.Queue()
+        host = "" if token else "127.0.0.1"
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, name="webhook", daemon=True
+        )
+        self._thread.start()
+        if token:
+            logger.info(f"Receiving AAP notifications on port {port}")
+        else:
+            logger.warning(
+                f"No WEBHOOK_TOKEN; receiving AAP notifications on 127.0.0.1:{port} only"
+            )
+
+    def _handler(self):
+        receiver = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                region = self.path.strip("/")
+                code, result = receiver._accept(region, self)
+                WEBHOOK_NOTIFICATIONS.labels(
+                    region=region if region in receiver.regions else "", result=result
+                ).inc()
+                self.send_response(code)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def log_message(self, format, *args):
+                logger.debug(format % args)
+
+        return Handler
+
+    def _accept(self, region, request):
+        if region not in self.regions:
+            return 404, "unknown_region"
+        if self.token:
+            expected = f"Bearer {self.token}"
+            if not hmac.compare_digest(request.headers.get("Authorization", ""), expected):
+                return 401, "unauthorized"
+        try:
+            length = int(request.headers.get("Content-Length", 0))
+            body = json.loads(request.rfile.read(length))
+        except ValueError:
+            return 400, "invalid"
+
+        # Test notifications and non-leapp jobs have nothing to ingest
+        if not isinstance(body, dict) or "id" not in body:
+            return 204, "ignored"
+        if "leapp" not in str(body.get("name", "")).lower() or body.get("status") in _UNFINISHED:
+            return 204, "ignored"
+
+        self._queue.put((region, body["id"]))
+        return 202, "queued"
+
+    def take(self, timeout, settle=2.0):
+        """Waits up to `timeout` seconds for notifications.
+
+        Once one arrives, keeps collecting for `settle` seconds so jobs that
+        finish together are fetched in one batch. Returns {region: [job ids]},
+        empty if nothing arrived.
+        """
+        batch = {}
+        try:
+            region, job_id = self._queue.get(timeout=max(timeout, 0))
+        except queue.Empty:
+            return batch
+        deadline = time.monotonic() + settle
+        while True:
+            if job_id not in batch.setdefault(region, []):
+                batch[region].append(job_id)
+            try:
+                region, job_id = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+            except queue.Empty:
+                return batch
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
@@ -1,4 +1,5 @@
 from datetime import datetime, timezone
+from failure_clusters import FailureClusters
 from logger import get_logger
 
 logger = get_logger(__name__)
@@ -20,6 +21,8 @@ class WorkflowProcessor:
 
     def __init__(self, config):
         self.config = config
+        cluster_dir = getattr(config, "failure_cluster_dir", "")
+        self.failure_clusters = FailureClusters(cluster_dir) if cluster_dir else None
 
     def process_jobs(self, jobs):
         workflows = {}
@@ -42,6 +45,10 @@ class WorkflowProcessor:
 
             workflows[workflow_id]["jobs"].append(job)
 
+            if self.failure_clusters is not None:
+                for failed_task in job.get("failed_tasks", []):
+                    failed_task["cluster_id"] = self.failure_clusters.assign(failed_task)
+
             # Update workflow status
             if job["status"] == "failed":
                 workflows[workflow_id]["failed"] = True
@@ -64,6 +71,9 @@ class WorkflowProcessor:
             elif any(job["status"] == "failed" for job in workflow["jobs"]):
                 workflow["status"] = "failed"
 
+        if self.failure_clusters is not None:
+            self.failure_clusters.save()
+
         logger.info(f"Processed {len(workflows)} workflows")
         return list(workflows.values())
 
@@ -5,16 +5,24 @@ Validates them and uploads them to Elasticsearch.
 It now includes support for in-progress workflows and changes to data fetching logic.
 """
 
+import gzip
+import hashlib
 import json
-from datetime import datetime, timedelta
-import pytz
-
-import requests
-import urllib3
-from elasticsearch import helpers, Elasticsearch
-import pandas as pd
-
-urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+import math
+import os
+import pickle
+import random
+import queue
+import sqlite3
+import tempfile
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import nullcontext
+from datetime import datetime, timedelta, timezone
+
+# requests and elasticsearch are imported on first use (see _requests and
+# _elasticsearch) so that importing this module, and cli.py, stays fast.
 
 _ES_INDEX = "rhel_upgrade_reporting_test_processing"
 
@@ -70,6 +78,35 @@ _FAILED_TASKS_EVENT_DATA_KEYS = set(
     ]
 )
 
+# Job event types AAP reports at event_level 0 or 3, requested server side
+# so the play and task start events of a failed host are not downloaded
+_FAILED_TASK_EVENTS = [
+    "playbook_on_start",
+    "debug",
+    "verbose",
+    "deprecated",
+    "warning",
+    "system_warning",
+    "error",
+    "runner_on_failed",
+    "runner_on_start",
+    "runner_on_ok",
+    "runner_on_error",
+    "runner_on_skipped",
+    "runner_on_unreachable",
+    "runner_on_no_hosts",
+    "runner_on_async_poll",
+    "runner_on_async_ok",
+    "runner_on_async_failed",
+    "runner_on_file_diff",
+    "runner_item_on_ok",
+    "runner_item_on_failed",
+    "runner_item_on_skipped",
+    "runner_retry",
+]
+
+_EVENTS_PAGE_SIZE = 50
+
 _NON_AUTOMATION_FAILURES = {
     "Check for NFS mounts": [],
     "Ensure Changefile Directory Exists": [],
@@ -118,6 +155,28 @@ _ENVIRONMENTS = {
 
 _PAGES = "200"
 
+# Jobs per page of the keyset-paginated job listing (AAP's maximum)
+_JOBS_PAGE_SIZE = 200
+
+# Retries of a single AAP page and the base of their exponential backoff
+_PAGE_RETRIES = 3
+_PAGE_BACKOFF = 1
+
+# Connect and read timeouts of every AAP request, in seconds
+_AAP_TIMEOUT = (10, 60)
+
+# A tower whose pages failed this many times in a row is skipped for
+# _BREAKER_RESET seconds
+_BREAKER_FAILURES = 5
+_BREAKER_RESET = 120
+_TOWER_FAILURES = {}
+
+# Optional tracer, see set_tracer
+_TRACER = None
+
+# Optional archive of raw AAP responses, see set_archive
+_ARCHIVE = None
+
 
 def _mode(l):
     """Calculates mode from a set of values."""
@@ -136,6 +195,54 @@ def _mode(l):
     return ret
 
 
+def set_tracer(tracer):
+    """Records spans around every stage and external call with `tracer`.
+
+    Any object with a span(name, **attrs) context manager works, such as the
+    V2 tracing.Tracer; wrap a run in its cycle() to write the trace file.
+    """
+    global _TRACER
+    _TRACER = tracer
+
+
+def set_archive(archive):
+    """Keeps every raw job and job_events page fetched from AAP in `archive`,
+    a ResponseArchive, so revalidate_region can rebuild workflows offline."""
+    global _ARCHIVE
+    _ARCHIVE = archive
+
+
+def _span(name, **attrs):
+    if _TRACER is None:
+        return nullcontext()
+    return _TRACER.span(name, **attrs)
+
+
+def _requests():
+    """Imports requests on first use"""
+    import requests
+    import urllib3
+
+    urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+    return requests
+
+
+# One client, and so one connection pool, per cluster
+_ES_CLIENTS = {}
+_ES_CLIENTS_LOCK = threading.Lock()
+
+
+def _elasticsearch(url):
+    """Imports the Elasticsearch client on first use and returns the shared
+    client of the cluster at url"""
+    with _ES_CLIENTS_LOCK:
+        if url not in _ES_CLIENTS:
+            from elasticsearch import Elasticsearch
+
+            _ES_CLIENTS[url] = Elasticsearch(url)
+        return _ES_CLIENTS[url]
+
+
 def _get_auth(cookie):
     """Returns authentication token from cookie"""
     tmp = cookie.strip().split("=")
@@ -143,59 +250,219 @@ def _get_auth(cookie):
     return auth
 
 
-def scrape(baseurl, endpoint, query, auth, data):
-    """Generalized function for scraping paginated data from AAP"""
-    print("Scrapping: {}{}{}".format(baseurl, endpoint, query))
-    try:
-        response = requests.get(
-            "{}{}{}".format(baseurl, endpoint, query), cookies=auth, verify=False
-        )
-        tmp = response.json()
+def iter_scrape(baseurl, endpoint, query, auth):
+    """Yields the results of each page of paginated data from AAP
+
+    Each page is retried on its own with jittered backoff, so a failing page
+    does not restart the listing. A page that keeps failing raises its last
+    error rather than ending the listing early, so the region fails instead
+    of ingesting part of its data. A tower failing _BREAKER_FAILURES requests
+    in a row is not called again for _BREAKER_RESET seconds.
+    """
+    requests = _requests()
+    while endpoint:
+        failures, failed_at = _TOWER_FAILURES.get(baseurl, (0, 0))
+        if failures >= _BREAKER_FAILURES and time.monotonic() - failed_at < _BREAKER_RESET:
+            raise Exception(f"Not fetching {baseurl}{endpoint}, tower circuit is open")
+        print("Scrapping: {}{}{}".format(baseurl, endpoint, query))
+        for attempt in range(_PAGE_RETRIES + 1):
+            try:
+                with _span("aap.get", endpoint=endpoint, query=query, attempt=attempt):
+                    response = requests.get(
+                        "{}{}{}".format(baseurl, endpoint, query),
+                        cookies=auth,
+                        verify=False,
+                        timeout=_AAP_TIMEOUT,
+                    )
+                    response.raise_for_status()
+                    tmp = response.json()
+                _TOWER_FAILURES.pop(baseurl, None)
+                break
+            except Exception as e:
+                failures, _ = _TOWER_FAILURES.get(baseurl, (0, 0))
+                _TOWER_FAILURES[baseurl] = (failures + 1, time.monotonic())
+                if attempt == _PAGE_RETRIES or failures + 1 >= _BREAKER_FAILURES:
+                    print("Error: {}".format(e))
+                    raise
+                wait_time = _PAGE_BACKOFF * (2**attempt) * random.uniform(0.5, 1.5)
+                print(f"Error: {e}, retrying page in {wait_time:.1f} seconds")
+                time.sleep(wait_time)
         if "results" in tmp:
-            data.extend(tmp["results"])
+            yield tmp["results"]
+        endpoint, query = None, ""
         if "next" in tmp and tmp["next"]:
             if f"page={_PAGES}" not in tmp["next"]:
-                scrape(baseurl, tmp["next"], "", auth, data)
-    except Exception as e:
-        print("Error: {}".format(e))
+                endpoint = tmp["next"]
 
 
-def get_playbooks(region, start_time, auth):
-    """Gathers playbook information from AAP"""
+def scrape(baseurl, endpoint, query, auth, data):
+    """Generalized function for scraping paginated data from AAP"""
+    for results in iter_scrape(baseurl, endpoint, query, auth):
+        data.extend(results)
+
+
+class JobCursor:
+    """Keyset cursor over a region's job listing.
+
+    The listing is ordered by job id and each page asks for ids above the
+    last one seen, so every page costs the tower the same and there is no
+    page limit. With a directory, the cursor is kept in <region>.cursor.json
+    and the next run starts after it.
+
+    The saved cursor never passes a job the next run still needs: a job that
+    has not finished yet, or any job of an in-progress workflow that later
+    jobs could still complete (see _may_complete), since its workflow is
+    rebuilt from all of its jobs.
+    """
+
+    def __init__(self, region, directory=None):
+        self.path = os.path.join(directory, f"{region}.cursor.json") if directory else None
+        self.after_id = 0
+        if self.path and os.path.exists(self.path):
+            with open(self.path, "r", encoding="utf-8") as f:
+                self.after_id = json.load(f)["after_id"]
+        self.last_id = self.after_id
+        self._floor = None
+
+    def hold(self, job_id):
+        """Keeps the saved cursor below job_id"""
+        if self._floor is None or job_id - 1 < self._floor:
+            self._floor = job_id - 1
+
+    def hold_workflows(self, workflows):
+        """Holds the jobs of every in-progress workflow that can still change"""
+        now = datetime.now(timezone.utc)
+        for workflow in workflows.values():
+            if workflow["workflow_status"] == "in_progress" and _may_complete(workflow, now):
+                self.hold(min(job["id"] for job in workflow["jobs"]))
+
+    def save(self):
+        if not self.path:
+            return
+        after_id = self.last_id if self._floor is None else min(self.last_id, self._floor)
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"after_id": after_id}, f)
+        os.replace(tmp_path, self.path)
+
+
+# Workflow types whose invalid groups may still become valid with more jobs,
+# and how many jobs they can have while doing so
+_GROWING_WORKFLOWS = {
+    "inhibitor_check_7_to_8": 2,
+    "inhibitor_check_8_to_9": 2,
+    "upgrade_7_to_8": None,
+    "upgrade_8_to_9": None,
+    "upgrade_7_to_9": None,
+}
+
+# An in-progress workflow with no new job for this long is not waited for
+_HOLD_WINDOW = timedelta(days=7)
+
+
+def _may_complete(workflow, now):
+    """Whether a workflow that failed validation could pass with later jobs
+
+    Unknown or non-deterministic workflow types, operational checks with
+    several jobs and inhibitor checks past three jobs never pass, whatever
+    comes next; neither, in practice, does a workflow idle for _HOLD_WINDOW.
+    """
+    jobs = workflow["jobs"]
+    if workflow["workflow_type"] not in _GROWING_WORKFLOWS:
+        return False
+    if len(_mode([job["extra_vars"]["major_workflow"] for job in jobs])) > 1:
+        return False
+    max_jobs = _GROWING_WORKFLOWS[workflow["workflow_type"]]
+    if max_jobs is not None and len(jobs) > max_jobs:
+        return False
+    return now - max(job["finished"] for job in jobs) < _HOLD_WINDOW
+
+
+def iter_playbooks(region, start_time, auth, cursor=None):
+    """Yields finished playbooks from AAP one page at a time
+
+    Pages are fetched by job id (see JobCursor) rather than by page number.
+    Unfinished jobs are listed too so the cursor can hold below them, but
+    are not yielded.
+    """
+    cursor = cursor or JobCursor(region)
     baseurl = _ENVIRONMENTS[region]["tower"]
     endpoint = "/api/v2/jobs/"
-    query = (
-        '?format=json&name__icontains=leapp&not__finished__isnull=true'
-        '&type=job'
-        f'&created__gt={start_time.strftime("%Y-%m-%dT%H:%M:%SZ")}'
-    )
+    while True:
+        query = (
+            '?format=json&name__icontains=leapp&type=job'
+            f'&created__gt={start_time.strftime("%Y-%m-%dT%H:%M:%SZ")}'
+            f'&id__gt={cursor.last_id}&order_by=id&page_size={_JOBS_PAGE_SIZE}'
+        )
+        results = next(iter_scrape(baseurl, endpoint, query, auth), None)
+        if not results:
+            return
+        if _ARCHIVE is not None:
+            _ARCHIVE.add_jobs(region, results)
+        cursor.last_id = results[-1]["id"]
+        finished = []
+        for playbook in results:
+            if playbook["finished"] is None:
+                cursor.hold(playbook["id"])
+            else:
+                finished.append(playbook)
+        yield finished
+        if len(results) < _JOBS_PAGE_SIZE:
+            return
+
+
+def get_playbooks(region, start_time, auth, cursor=None):
+    """Gathers playbook information from AAP"""
     data = []
-    scrape(baseurl, endpoint, query, auth, data)
+    with _span("get_playbooks", region=region):
+        for results in iter_playbooks(region, start_time, auth, cursor):
+            data.extend(results)
     return data
 
 
 def get_failed_tasks(playbook, region, auth):
-    """Gathers failed_task information from AAP"""
+    """Gathers failed_task information from AAP
+
+    The listing is read to its end on purpose: the host's failure that ends
+    its run is already among the last failed events, so stopping at it would
+    save no request but could miss a later error event.
+    """
     if not playbook["failed"]:
         return []
     baseurl = _ENVIRONMENTS[region]["tower"]
-    job_filter = "?failed=true"
-    failed_tasks = []
-    scrape(
-        baseurl,
-        f"/api/v2/jobs/{playbook['id']}/job_events/",
-        job_filter,
-        auth,
-        failed_tasks,
+    job_filter = (
+        f"?failed=true&event__in={','.join(_FAILED_TASK_EVENTS)}"
+        f"&order_by=counter&page_size={_EVENTS_PAGE_SIZE}"
     )
-    failed_tasks = list(filter(lambda x: x["event_level"] in [0, 3], failed_tasks))
-    return failed_tasks
+    failed_tasks = []
+    with _span("get_failed_tasks", job_id=playbook["id"]):
+        for results in iter_scrape(
+            baseurl, f"/api/v2/jobs/{playbook['id']}/job_events/", job_filter, auth
+        ):
+            failed_tasks.extend(results)
+    if _ARCHIVE is not None:
+        _ARCHIVE.add_events(region, playbook["id"], failed_tasks)
+    return filter_failed_tasks(failed_tasks)
+
 
+def filter_failed_tasks(events):
+    """Keeps the job events counted as failed tasks"""
+    return list(filter(lambda x: x["event_level"] in [0, 3], events))
 
-def generate_workflows(playbooks, region, auth, existing_ids):
-    """Group playbooks into proposed workflows by txId and limit"""
+
+def generate_workflows(playbooks, region, auth, existing_ids, fetch_failed_tasks=None):
+    """Group playbooks into proposed workflows by txId and limit
+
+    fetch_failed_tasks(playbook) replaces the AAP lookup of failed tasks,
+    as when revalidating from a ResponseArchive.
+    """
     workflows = {}
+    if fetch_failed_tasks is None:
+
+        def fetch_failed_tasks(playbook):
+            return get_failed_tasks(playbook, region, auth)
 
+    grouped = []
     for playbook in playbooks:
         playbook["created"] = datetime.strptime(
             playbook["created"], "%Y-%m-%dT%H:%M:%S.%f%z"
@@ -217,9 +484,15 @@ def generate_workflows(playbooks, region, auth, existing_ids):
             print(e)
             print(playbook)
             continue
+        grouped.append((play_id, playbook))
 
+    # Confirm the page's filter hits in one round-trip
+    if isinstance(existing_ids, WorkflowIdFilter):
+        existing_ids.prefetch([play_id for play_id, _ in grouped])
+
+    for play_id, playbook in grouped:
         if play_id not in existing_ids:
-            playbook["failed_tasks"] = get_failed_tasks(playbook, region, auth)
+            playbook["failed_tasks"] = fetch_failed_tasks(playbook)
 
             for failed_task in playbook["failed_tasks"]:
                 if failed_task["task"] in _NON_AUTOMATION_FAILURES:
@@ -551,29 +824,291 @@ def get_existing_workflow_ids(es_client, region, start_time):
         return set()
 
 
-def gather_region_data(region, cookie):
-    """Gathers data for a given region and uploads it to Elasticsearch."""
-    es_client = Elasticsearch(_ENVIRONMENTS[region]["elk"])
-
-    # Get the start time for data fetching
-    start_time = get_data_fetch_start_time(es_client, region)
+class WorkflowIdFilter:
+    """Workflow IDs already in Elasticsearch for one region, as a Bloom filter
+
+    Stands in for the existing_ids set without its 10k-hit ceiling: the
+    filter takes a few bits per workflow, so it stays small at millions of
+    workflows. A negative answer is certain; a positive one is confirmed with
+    an _mget of the IDs, batched per page by prefetch().
+
+    The filter is kept in <directory>/<region>.bloom. When that file is
+    missing, or holds more IDs than it was sized for, it is rebuilt by
+    scanning the region's workflow IDs. add() records uploaded workflows and
+    save() writes the file back.
+    """
+
+    def __init__(self, es_client, region, directory, capacity=1000000, error_rate=0.001):
+        self.es_client = es_client
+        self.region = region
+        self.error_rate = error_rate
+        self.path = os.path.join(directory, f"{region}.bloom")
+        self._confirmed = {}
+        os.makedirs(directory, exist_ok=True)
+        if not self._load() or self.count > self.capacity:
+            self._rebuild(max(capacity, 2 * getattr(self, "count", 0)))
+
+    def _size(self, capacity):
+        self.capacity = capacity
+        self.bits = math.ceil(-capacity * math.log(self.error_rate) / math.log(2) ** 2)
+        self.hashes = max(1, round(self.bits / capacity * math.log(2)))
+        self.array = bytearray((self.bits + 7) // 8)
+        self.count = 0
+
+    def _load(self):
+        try:
+            with open(self.path, "rb") as f:
+                header = json.loads(f.readline())
+                self._size(header["capacity"])
+                self.count = header["count"]
+                self.array = bytearray(f.read())
+            return len(self.array) == (self.bits + 7) // 8
+        except (FileNotFoundError, ValueError, KeyError):
+            return False
+
+    def _rebuild(self, capacity):
+        from elasticsearch import helpers
+
+        self._size(capacity)
+        with _span("rebuild_id_filter", region=self.region):
+            for hit in helpers.scan(
+                self.es_client,
+                index=_ES_INDEX,
+                query={"query": {"match": {"region": self.region}}},
+                _source=False,
+            ):
+                self._insert(hit["_id"])
+        print(f"Rebuilt workflow ID filter for {self.region} with {self.count} IDs")
+        self.save()
+
+    def _positions(self, workflow_id):
+        digest = hashlib.blake2b(workflow_id.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "big")
+        h2 = int.from_bytes(digest[8:], "big") | 1
+        return [(h1 + i * h2) % self.bits for i in range(self.hashes)]
+
+    def might_contain(self, workflow_id):
+        return all(self.array[p >> 3] & (1 << (p & 7)) for p in self._positions(workflow_id))
+
+    def _insert(self, workflow_id):
+        if not self.might_contain(workflow_id):
+            self.count += 1
+        for p in self._positions(workflow_id):
+            self.array[p >> 3] |= 1 << (p & 7)
+
+    def add(self, workflow_ids):
+        for workflow_id in workflow_ids:
+            self._insert(workflow_id)
+            self._confirmed[workflow_id] = True
+
+    def prefetch(self, workflow_ids):
+        """Confirms the positive IDs among workflow_ids in _mget batches"""
+        pending = [
+            i for i in set(workflow_ids)
+            if i not in self._confirmed and self.might_contain(i)
+        ]
+        for start in range(0, len(pending), 1000):
+            docs = self.es_client.mget(
+                index=_ES_INDEX, ids=pending[start : start + 1000], _source=False
+            )["docs"]
+            for doc in docs:
+                self._confirmed[doc["_id"]] = doc.get("found", False)
+
+    def __contains__(self, workflow_id):
+        if not self.might_contain(workflow_id):
+            return False
+        if workflow_id not in self._confirmed:
+            self.prefetch([workflow_id])
+        return self._confirmed.get(workflow_id, False)
+
+    def save(self):
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(json.dumps({"capacity": self.capacity, "count": self.count}).encode())
+            f.write(b"\n")
+            f.write(self.array)
+        os.replace(tmp_path, self.path)
+
+
+def _msearch(es_client, bodies):
+    """Run several searches against _ES_INDEX in one _msearch round-trip"""
+    searches = []
+    for body in bodies:
+        searches.append({"index": _ES_INDEX})
+        searches.append(body)
+    responses = es_client.msearch(searches=searches)["responses"]
+    for response in responses:
+        if "error" in response:
+            raise Exception(response["error"])
+    return responses
+
+
+def _agg_datetime(agg):
+    """Convert a min/max date aggregation value to a datetime"""
+    if agg["value"] is None:
+        return None
+    return datetime.fromtimestamp(agg["value"] / 1000, tz=timezone.utc)
+
+
+def plan_fetch_windows(es_client, regions, with_ids=True):
+    """Determine fetch windows and existing IDs for several regions at once
+
+    Does the work of get_data_fetch_start_time and get_existing_workflow_ids
+    for every region in two _msearch round-trips: one to find the oldest
+    in-progress and newest completed workflow of each region (as filtered
+    min/max aggregations), and one to preload the existing IDs.
+
+    Returns {region: {"start_time": datetime, "existing_ids": set}}, or an
+    empty dict if planning failed, in which case callers fall back to the
+    per-region queries. Without with_ids only start times are planned.
+    """
+    window_bodies = [
+        {
+            "size": 0,
+            "query": {"match": {"region": region}},
+            "aggs": {
+                "in_progress": {
+                    "filter": {"match": {"workflow_status": "in_progress"}},
+                    "aggs": {"oldest_started": {"min": {"field": "started"}}},
+                },
+                "completed": {
+                    "filter": {"match": {"workflow_status": "completed"}},
+                    "aggs": {"newest_finished": {"max": {"field": "finished"}}},
+                },
+            },
+        }
+        for region in regions
+    ]
 
-    # Add 6-hour buffer
-    start_time -= timedelta(hours=6)
+    try:
+        plan = {}
+        for region, response in zip(regions, _msearch(es_client, window_bodies)):
+            aggs = response["aggregations"]
+            start_time = (
+                _agg_datetime(aggs["in_progress"]["oldest_started"])
+                or _agg_datetime(aggs["completed"]["newest_finished"])
+                or datetime.strptime(
+                    "2024-02-01T06:00:00.000000Z", "%Y-%m-%dT%H:%M:%S.%f%z"
+                )
+            )
+            # Add 6-hour buffer
+            plan[region] = {"start_time": start_time - timedelta(hours=6)}
+        if not with_ids:
+            return plan
+
+        id_bodies = [
+            {
+                "size": 10000,
+                "query": {
+                    "bool": {
+                        "must": [
+                            {"match": {"region": region}},
+                            {
+                                "range": {
+                                    "started": {
+                                        "gte": plan[region]["start_time"].isoformat()
+                                    }
+                                }
+                            },
+                        ]
+                    }
+                },
+                "_source": ["id"],
+            }
+            for region in regions
+        ]
+        for region, response in zip(regions, _msearch(es_client, id_bodies)):
+            plan[region]["existing_ids"] = set(
+                hit["_source"]["id"]
+                for hit in response["hits"]["hits"]
+                if "id" in hit["_source"]
+            )
+        return plan
+    except Exception as e:
+        print(f"Error planning fetch windows for {regions}: {e}")
+        return {}
+
+
+def gather_region_data(
+    region,
+    cookie,
+    sink=None,
+    plan=None,
+    memory_budget_mb=None,
+    spill_dir=None,
+    cursor_dir=None,
+    id_filter_dir=None,
+):
+    """Gathers data for a given region and uploads it to Elasticsearch.
+
+    If a sink (any object with a write(actions) method, such as the V2
+    NdjsonSink or ParquetSink) is given, the bulk actions go there instead.
+    A plan entry from plan_fetch_windows skips the per-region start time and
+    existing ID queries. With a memory_budget_mb, playbooks are spilled to
+    disk under spill_dir (see gather_region_data_bounded). With a cursor_dir,
+    the job listing starts after the region's saved JobCursor, which is moved
+    forward once the workflows are written. With an id_filter_dir, existing
+    workflows are looked up through a WorkflowIdFilter instead of a 10k-hit
+    ID query.
+    """
+    es_client = _elasticsearch(_ENVIRONMENTS[region]["elk"])
+
+    if plan:
+        start_time = plan["start_time"]
+    else:
+        # Get the start time for data fetching
+        with _span("get_data_fetch_start_time", region=region):
+            start_time = get_data_fetch_start_time(es_client, region)
+
+        # Add 6-hour buffer
+        start_time -= timedelta(hours=6)
 
     print(f"Fetching data for {region} from {start_time}")
 
     auth = _get_auth(cookie)
-    playbooks = get_playbooks(region, start_time, auth)
 
     # Get existing workflow IDs to avoid duplicates
-    existing_ids = get_existing_workflow_ids(es_client, region, start_time)
+    if id_filter_dir:
+        existing_ids = WorkflowIdFilter(es_client, region, id_filter_dir)
+    elif plan:
+        existing_ids = plan["existing_ids"]
+    else:
+        with _span("get_existing_workflow_ids", region=region):
+            existing_ids = get_existing_workflow_ids(es_client, region, start_time)
+
+    cursor = JobCursor(region, cursor_dir)
+    if memory_budget_mb:
+        res = gather_region_data_bounded(
+            region, auth, start_time, existing_ids, es_client, sink,
+            memory_budget_mb, spill_dir, cursor,
+        )
+        cursor.save()
+        if id_filter_dir:
+            existing_ids.add(res["uploaded_workflows"])
+            existing_ids.save()
+        return res
+
+    playbooks = get_playbooks(region, start_time, auth, cursor)
+
+    with _span("generate_workflows", region=region, playbooks=len(playbooks)):
+        playbook_groups = generate_workflows(playbooks, region, auth, existing_ids)
+    with _span("validate_workflows", region=region, groups=len(playbook_groups)):
+        workflows = validate_workflows(
+            playbook_groups, region, playbooks[-1]["finished"] if playbooks else None
+        )
 
-    playbook_groups = generate_workflows(playbooks, region, auth, existing_ids)
-    workflows = validate_workflows(
-        playbook_groups, region, playbooks[-1]["finished"] if playbooks else None
-    )
+    res = workflow_actions(workflows, existing_ids)
+    write_actions(es_client, sink, res, region)
+    cursor.hold_workflows(workflows)
+    cursor.save()
+    if id_filter_dir:
+        existing_ids.add(action["_id"] for action in res["uploaded_workflows"])
+        existing_ids.save()
+    return res
 
+
+def workflow_actions(workflows, existing_ids):
+    """Builds update actions for known workflows and index actions for new ones"""
     res = {"uploaded_workflows": [], "updated_workflows": []}
     for workflow_id, workflow in workflows.items():
         if workflow_id in existing_ids:
@@ -594,16 +1129,486 @@ def gather_region_data(region, cookie):
                     "_source": workflow,
                 }
             )
+    return res
 
-    # Perform bulk operation for both updates and new inserts
+
+def write_actions(es_client, sink, res, region):
+    """Perform bulk operation for both updates and new inserts"""
     if res["updated_workflows"] or res["uploaded_workflows"]:
         actions = res["updated_workflows"] + res["uploaded_workflows"]
-        success, failed = helpers.bulk(es_client, actions, stats_only=True)
+        with _span("bulk", region=region, actions=len(actions)):
+            if sink is not None:
+                success, failed = sink.write(actions)
+            else:
+                from elasticsearch import helpers
+
+                success, failed = helpers.bulk(es_client, actions, stats_only=True)
         print(f"Bulk operation completed. Successful: {success}, Failed: {failed}")
 
+
+class ClusterWriter:
+    """Bulk writer with one stream per Elasticsearch cluster
+
+    Regions that share a cluster write through the same sink(url). A
+    background thread per cluster merges whatever the regions have queued,
+    waiting up to `linger` seconds for more when its batch is small, and
+    sends it through the cluster's shared client in bulk requests of
+    `chunk_size` actions or `max_chunk_bytes`. write() blocks until its own
+    actions are written and returns their (success, failed) counts, like
+    helpers.bulk with stats_only, and like it raises BulkIndexError with the
+    failed items when any of its own actions failed, so the caller does not
+    save a cursor or ID filter past them.
+    """
+
+    def __init__(self, chunk_size=1000, max_chunk_bytes=10 * 1024 * 1024, linger=0.2):
+        self.chunk_size = chunk_size
+        self.max_chunk_bytes = max_chunk_bytes
+        self.linger = linger
+        self._streams = {}
+        self._lock = threading.Lock()
+
+    def sink(self, url):
+        with self._lock:
+            if url not in self._streams:
+                stream = _ClusterStream(self, url)
+                self._streams[url] = stream
+            return self._streams[url]
+
+    def close(self):
+        for stream in self._streams.values():
+            stream.close()
+
+
+class _ClusterStream:
+    """Queue and writer thread of one cluster, see ClusterWriter"""
+
+    def __init__(self, writer, url):
+        self.writer = writer
+        self.url = url
+        self.client = _elasticsearch(url)
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name=f"bulk-{url}", daemon=True)
+        self._thread.start()
+
+    def write(self, actions):
+        future = Future()
+        self._queue.put((list(actions), future))
+        return future.result()
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            batch = [item]
+            queued = len(item[0])
+            deadline = time.monotonic() + self.writer.linger
+            while queued < self.writer.chunk_size:
+                try:
+                    item = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+                if item is None:
+                    self._queue.put(None)
+                    break
+                batch.append(item)
+                queued += len(item[0])
+            self._send(batch)
+
+    def _send(self, batch):
+        from elasticsearch import helpers
+
+        actions = [action for actions, _ in batch for action in actions]
+        try:
+            with _span("cluster_bulk", cluster=self.url, actions=len(actions), writers=len(batch)):
+                results = helpers.streaming_bulk(
+                    self.client,
+                    actions,
+                    chunk_size=self.writer.chunk_size,
+                    max_chunk_bytes=self.writer.max_chunk_bytes,
+                    raise_on_error=False,
+                )
+                results = list(results)
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        start = 0
+        for own, future in batch:
+            own_results = results[start : start + len(own)]
+            start += len(own)
+            errors = [item for ok, item in own_results if not ok]
+            if errors:
+                future.set_exception(
+                    helpers.BulkIndexError(f"{len(errors)} document(s) failed to index.", errors)
+                )
+            else:
+                future.set_result((len(own_results), 0))
+
+
+class ResponseArchive:
+    """Local, compressed archive of raw AAP responses
+
+    Every job from a job listing page and every job's failed events are
+    stored as gzipped JSON objects named by the SHA-256 of their content, so
+    a job fetched again unchanged takes no more space. archive.sqlite indexes
+    them by region, kind ("job" or "events"), job ID, workflow ID and fetch
+    time.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(os.path.join(directory, "objects"), exist_ok=True)
+        self._db = sqlite3.connect(
+            os.path.join(directory, "archive.sqlite"), check_same_thread=False
+        )
+        self._lock = threading.Lock()
+        with self._lock:
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS records (region TEXT, kind TEXT, "
+                "job_id INTEGER, play_id TEXT, fetched_at TEXT, digest TEXT)"
+            )
+            # Job IDs are only unique within a region's tower
+            self._db.execute(
+                "CREATE INDEX IF NOT EXISTS records_region_job "
+                "ON records (region, kind, job_id, fetched_at)"
+            )
+            self._db.execute(
+                "CREATE INDEX IF NOT EXISTS records_play ON records (region, play_id)"
+            )
+            self._db.commit()
+
+    def _object_path(self, digest):
+        return os.path.join(self.directory, "objects", digest[:2], f"{digest}.json.gz")
+
+    def _put(self, content):
+        data = json.dumps(content, sort_keys=True).encode()
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._object_path(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with gzip.open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        return digest
+
+    def _get(self, digest):
+        with gzip.open(self._object_path(digest), "rb") as f:
+            return json.loads(f.read())
+
+    def _record(self, region, kind, job_id, play_id, content):
+        digest = self._put(content)
+        fetched_at = datetime.now(timezone.utc).isoformat()
+        with self._lock:
+            latest = self._db.execute(
+                "SELECT digest FROM records WHERE region = ? AND kind = ? AND job_id = ? "
+                "ORDER BY fetched_at DESC LIMIT 1",
+                (region, kind, job_id),
+            ).fetchone()
+            if latest is None or latest[0] != digest:
+                self._db.execute(
+                    "INSERT INTO records VALUES (?, ?, ?, ?, ?, ?)",
+                    (region, kind, job_id, play_id, fetched_at, digest),
+                )
+                self._db.commit()
+
+    def add_jobs(self, region, jobs):
+        for job in jobs:
+            try:
+                extra_vars = json.loads(job["extra_vars"])
+                play_id = "{}-{}".format(extra_vars["txId"], job["limit"])
+            except Exception:
+                play_id = None
+            self._record(region, "job", job["id"], play_id, job)
+
+    def add_events(self, region, job_id, events):
+        self._record(region, "events", job_id, None, events)
+
+    def play_ids(self, region):
+        rows = self._db.execute(
+            "SELECT DISTINCT play_id FROM records "
+            "WHERE region = ? AND kind = 'job' AND play_id IS NOT NULL",
+            (region,),
+        )
+        return [row[0] for row in rows]
+
+    def jobs(self, region, play_id):
+        """Latest archived version of each job of a workflow, by job ID"""
+        rows = self._db.execute(
+            "SELECT job_id, digest FROM records WHERE region = ? AND play_id = ? "
+            "AND kind = 'job' ORDER BY job_id, fetched_at",
+            (region, play_id),
+        ).fetchall()
+        latest = dict(rows)
+        return [self._get(latest[job_id]) for job_id in sorted(latest)]
+
+    def events(self, region, job_id):
+        """Latest archived events of a job, or None if none were archived"""
+        row = self._db.execute(
+            "SELECT digest FROM records WHERE region = ? AND kind = 'events' AND job_id = ? "
+            "ORDER BY fetched_at DESC LIMIT 1",
+            (region, job_id),
+        ).fetchone()
+        return self._get(row[0]) if row else None
+
+    def close(self):
+        self._db.close()
+
+
+def _as_document(workflow):
+    """The workflow as Elasticsearch stores it, for comparisons"""
+    return json.loads(json.dumps(workflow, default=lambda o: o.isoformat()))
+
+
+def _revalidate_batch(archive_dir, region, play_ids):
+    """Rebuilds the given workflows from the archive (a worker process)"""
+    archive = ResponseArchive(archive_dir)
+    playbooks, skipped = [], 0
+    for play_id in play_ids:
+        jobs = archive.jobs(region, play_id)
+        # Unfinished jobs are archived too, see iter_playbooks
+        if any(job["finished"] is None for job in jobs) or any(
+            job["failed"] and archive.events(region, job["id"]) is None for job in jobs
+        ):
+            skipped += 1
+            continue
+        playbooks.extend(jobs)
+    groups = generate_workflows(
+        playbooks,
+        region,
+        None,
+        set(),
+        fetch_failed_tasks=lambda playbook: filter_failed_tasks(
+            archive.events(region, playbook["id"]) or []
+        ),
+    )
+    workflows = validate_workflows(groups, region, None)
+    archive.close()
+    return {play_id: _as_document(w) for play_id, w in workflows.items()}, skipped
+
+
+def revalidate_region(region, archive_dir, sink=None, workers=4, batch_size=500):
+    """Re-runs grouping, validation and classification over archived responses
+
+    Workflows are rebuilt from the ResponseArchive in batches of batch_size
+    across `workers` processes, with the current validate_workflows and
+    _NON_AUTOMATION_FAILURES rules, and compared with their Elasticsearch
+    documents. Only the changed ones are rewritten. Workflows with a job
+    that was still running when last archived, or with a failed job whose
+    events were never archived, are skipped. AAP is not called.
+
+    Returns {"changed": int, "unchanged": int, "skipped": int}.
+    """
+    es_client = _elasticsearch(_ENVIRONMENTS[region]["elk"])
+    archive = ResponseArchive(archive_dir)
+    play_ids = archive.play_ids(region)
+    archive.close()
+    batches = [play_ids[i : i + batch_size] for i in range(0, len(play_ids), batch_size)]
+    print(f"Revalidating {len(play_ids)} archived workflows of {region}")
+
+    stats = {"changed": 0, "unchanged": 0, "skipped": 0}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [
+            pool.submit(_revalidate_batch, archive_dir, region, batch) for batch in batches
+        ]
+        for future in futures:
+            workflows, skipped = future.result()
+            stats["skipped"] += skipped
+            if not workflows:
+                continue
+            current = es_client.mget(index=_ES_INDEX, ids=list(workflows))["docs"]
+            actions = [
+                {
+                    "_op_type": "index",
+                    "_index": _ES_INDEX,
+                    "_id": doc["_id"],
+                    "_source": workflows[doc["_id"]],
+                }
+                for doc in current
+                if doc.get("_source") != workflows[doc["_id"]]
+            ]
+            stats["changed"] += len(actions)
+            stats["unchanged"] += len(workflows) - len(actions)
+            write_actions(
+                es_client,
+                sink,
+                {"uploaded_workflows": [], "updated_workflows": actions},
+                region,
+            )
+    print(f"Revalidated {region}: {stats}")
+    return stats
+
+
+class PlaybookSpill:
+    """Playbook groups spilled to a temporary SQLite database.
+
+    Playbooks are pickled as soon as they are grouped and buffered until the
+    buffer reaches buffer_bytes, then written out. groups() reads them back
+    ordered by workflow ID, so a workflow whose playbooks arrived on different
+    pages comes back whole, in batches of about batch_bytes of playbooks.
+    """
+
+    def __init__(self, buffer_bytes, batch_bytes, directory=None):
+        self.buffer_bytes = buffer_bytes
+        self.batch_bytes = batch_bytes
+        fd, self.path = tempfile.mkstemp(prefix="playbooks-", suffix=".sqlite", dir=directory)
+        os.close(fd)
+        self._db = sqlite3.connect(self.path)
+        self._db.execute("PRAGMA journal_mode=OFF")
+        self._db.execute("PRAGMA synchronous=OFF")
+        self._db.execute("CREATE TABLE playbooks (play_id TEXT, seq INTEGER, playbook BLOB)")
+        self._buffer = []
+        self._buffered = 0
+        self._seq = 0
+
+    def add(self, playbook_groups):
+        """Spills the output of generate_workflows"""
+        for play_id, playbooks in playbook_groups.items():
+            for playbook in playbooks:
+                blob = pickle.dumps(playbook, protocol=pickle.HIGHEST_PROTOCOL)
+                self._buffer.append((play_id, self._seq, blob))
+                self._buffered += len(blob)
+                self._seq += 1
+        if self._buffered >= self.buffer_bytes:
+            self._flush()
+
+    def _flush(self):
+        self._db.executemany("INSERT INTO playbooks VALUES (?, ?, ?)", self._buffer)
+        self._db.commit()
+        self._buffer = []
+        self._buffered = 0
+
+    def groups(self):
+        """Yields {play_id: [playbooks]} batches of complete workflows"""
+        self._flush()
+        self._db.execute("CREATE INDEX playbooks_order ON playbooks (play_id, seq)")
+        batch, size, current = {}, 0, None
+        rows = self._db.execute(
+            "SELECT play_id, playbook FROM playbooks ORDER BY play_id, seq"
+        )
+        for play_id, blob in rows:
+            if play_id != current and size >= self.batch_bytes:
+                yield batch
+                batch, size = {}, 0
+            current = play_id
+            batch.setdefault(play_id, []).append(pickle.loads(blob))
+            size += len(blob)
+        if batch:
+            yield batch
+
+    def close(self):
+        self._db.close()
+        os.remove(self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def gather_region_data_bounded(
+    region,
+    auth,
+    start_time,
+    existing_ids,
+    es_client,
+    sink,
+    memory_budget_mb,
+    spill_dir=None,
+    cursor=None,
+):
+    """Bounded-memory version of the fetch, group, validate and upload steps.
+
+    Each page of playbooks is grouped and spilled to a PlaybookSpill straight
+    away, then complete workflows are read back, validated and uploaded in
+    batches, so the playbooks held in memory stay around memory_budget_mb
+    however wide the window is. The budget does not cover the page being
+    grouped, existing_ids (up to 10k IDs as a set, fixed-size as a
+    WorkflowIdFilter) or the returned workflow IDs, which grow with the
+    window. Returns the same keys as gather_region_data, holding workflow
+    IDs instead of bulk actions.
+    """
+    budget = memory_budget_mb * 1024 * 1024
+    res = {"uploaded_workflows": [], "updated_workflows": []}
+    latest_job = None
+    with PlaybookSpill(budget // 2, budget // 2, spill_dir) as spill:
+        with _span("generate_workflows", region=region):
+            for playbooks in iter_playbooks(region, start_time, auth, cursor):
+                spill.add(generate_workflows(playbooks, region, auth, existing_ids))
+                if playbooks:
+                    latest_job = playbooks[-1]["finished"]
+
+        for playbook_groups in spill.groups():
+            with _span("validate_workflows", region=region, groups=len(playbook_groups)):
+                workflows = validate_workflows(playbook_groups, region, latest_job)
+            batch = workflow_actions(workflows, existing_ids)
+            write_actions(es_client, sink, batch, region)
+            if cursor is not None:
+                cursor.hold_workflows(workflows)
+            for key in res:
+                res[key].extend(action["_id"] for action in batch[key])
     return res
 
 
+def gather_all_regions(
+    cookies,
+    sink=None,
+    memory_budget_mb=None,
+    spill_dir=None,
+    cursor_dir=None,
+    id_filter_dir=None,
+    parallel_regions=1,
+):
+    """Gathers data for several regions, planning their fetch windows up front.
+
+    Regions sharing an Elasticsearch cluster are planned together with
+    plan_fetch_windows. Without a sink, their writes go through one
+    ClusterWriter stream per cluster. Up to parallel_regions regions are
+    gathered at once, and their writes to a shared cluster are merged.
+
+    cookies - dict - {region: cookie}
+    """
+    clusters = {}
+    for region in cookies:
+        clusters.setdefault(_ENVIRONMENTS[region]["elk"], []).append(region)
+
+    plans = {}
+    for elk, regions in clusters.items():
+        with _span("plan_fetch_windows", regions=regions):
+            plans.update(
+                plan_fetch_windows(_elasticsearch(elk), regions, with_ids=not id_filter_dir)
+            )
+
+    writer = ClusterWriter() if sink is None else None
+
+    def gather(region):
+        with _span("gather_region_data", region=region):
+            return gather_region_data(
+                region,
+                cookies[region],
+                sink=sink or writer.sink(_ENVIRONMENTS[region]["elk"]),
+                plan=plans.get(region),
+                memory_budget_mb=memory_budget_mb,
+                spill_dir=spill_dir,
+                cursor_dir=cursor_dir,
+                id_filter_dir=id_filter_dir,
+            )
+
+    try:
+        with ThreadPoolExecutor(max_workers=max(parallel_regions, 1)) as pool:
+            results = dict(zip(cookies, pool.map(gather, cookies)))
+    finally:
+        if writer is not None:
+            writer.close()
+    return results
+
+
 # Main execution
 if __name__ == "__main__":
     # Example usage